@@ -46,6 +46,12 @@ def get_info():
     """Returns package information"""
     return _get_pkg_info(os.path.dirname(__file__))
 
-from .pipeline import Node, MapNode, JoinNode, Workflow
-from .interfaces import (DataGrabber, DataSink, SelectFiles,
-                         IdentityInterface, Rename, Function, Select, Merge)
+# the pipeline and interfaces are only imported when first used, so that
+# importing a single module of nipype (e.g. to run a node) stays cheap
+from .utils.lazy import lazy_imports
+lazy_imports(__name__, {
+    '.pipeline': ('Node', 'MapNode', 'JoinNode', 'Workflow'),
+    '.interfaces': ('DataGrabber', 'DataSink', 'SelectFiles',
+                    'IdentityInterface', 'Rename', 'Function', 'Select',
+                    'Merge'),
+})
@@ -7,17 +7,19 @@
 Top-level namespace for afni.
 """
 
-from .base import Info
-from .preprocess import (Allineate, Automask, AutoTcorrelate,
-                         Bandpass, BlurInMask, BlurToFWHM,
-                         ClipLevel, DegreeCentrality, Despike,
-                         Detrend, ECM, Fim, Fourier, Hist, LFCD,
-                         Maskave, Means, OutlierCount,
-                         QualityIndex, ROIStats, Retroicor,
-                         Seg, SkullStrip, TCorr1D, TCorrMap, TCorrelate,
-                         TShift, Volreg, Warp)
-from .svm import (SVMTest, SVMTrain)
-from .utils import (AFNItoNIFTI, Autobox, BrickStat, Calc, Copy,
-                    Eval, FWHMx,
-                    MaskTool, Merge, Notes, Refit, Resample, TCat, TStat, To3D,
-                    ZCutUp,)
+from ...utils.lazy import lazy_imports
+
+lazy_imports(__name__, {
+    '.base': ('Info',),
+    '.preprocess': ('Allineate', 'Automask', 'AutoTcorrelate', 'Bandpass',
+                    'BlurInMask', 'BlurToFWHM', 'ClipLevel',
+                    'DegreeCentrality', 'Despike', 'Detrend', 'ECM', 'Fim',
+                    'Fourier', 'Hist', 'LFCD', 'Maskave', 'Means',
+                    'OutlierCount', 'QualityIndex', 'ROIStats', 'Retroicor',
+                    'Seg', 'SkullStrip', 'TCorr1D', 'TCorrMap', 'TCorrelate',
+                    'TShift', 'Volreg', 'Warp'),
+    '.svm': ('SVMTest', 'SVMTrain'),
+    '.utils': ('AFNItoNIFTI', 'Autobox', 'BrickStat', 'Calc', 'Copy', 'Eval',
+               'FWHMx', 'MaskTool', 'Merge', 'Notes', 'Refit', 'Resample',
+               'TCat', 'TStat', 'To3D', 'ZCutUp'),
+})
@@ -4,19 +4,22 @@
 
 """Top-level namespace for ants."""
 
-# Registraiton programs
-from .registration import ANTS, Registration
+from ...utils.lazy import lazy_imports
 
-# Resampling Programs
-from .resampling import (ApplyTransforms, ApplyTransformsToPoints, WarpImageMultiTransform,
-                         WarpTimeSeriesImageMultiTransform)
-
-# Segmentation Programs
-from .segmentation import (Atropos, LaplacianThickness, N4BiasFieldCorrection, JointFusion, CorticalThickness,
-                           BrainExtraction, DenoiseImage, AntsJointFusion)
-
-# Visualization Programs
-from .visualization import ConvertScalarImageToRGB, CreateTiledMosaic
-
-# Utility Programs
-from .utils import AverageAffineTransform, AverageImages, MultiplyImages, CreateJacobianDeterminantImage
+lazy_imports(__name__, {
+    # Registraiton programs
+    '.registration': ('ANTS', 'Registration'),
+    # Resampling Programs
+    '.resampling': ('ApplyTransforms', 'ApplyTransformsToPoints',
+                    'WarpImageMultiTransform',
+                    'WarpTimeSeriesImageMultiTransform'),
+    # Segmentation Programs
+    '.segmentation': ('Atropos', 'LaplacianThickness', 'N4BiasFieldCorrection',
+                      'JointFusion', 'CorticalThickness', 'BrainExtraction',
+                      'DenoiseImage', 'AntsJointFusion'),
+    # Visualization Programs
+    '.visualization': ('ConvertScalarImageToRGB', 'CreateTiledMosaic'),
+    # Utility Programs
+    '.utils': ('AverageAffineTransform', 'AverageImages', 'MultiplyImages',
+               'CreateJacobianDeterminantImage'),
+})
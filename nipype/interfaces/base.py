@@ -35,12 +35,15 @@ from dateutil.parser import parse as parseutc
 from .. import config, logging, LooseVersion, __version__
 from ..utils.provenance import write_provenance
 from ..utils.misc import is_container, trim, str2bool
-from ..utils.filemanip import (md5, hash_infile, FileNotFoundError, hash_timestamp,
-                               split_filename, to_str)
+from ..utils.filemanip import (md5, hash_infile, hash_infiles, FileNotFoundError,
+                               hash_timestamp, split_filename, to_str)
 from .traits_extension import (
     traits, Undefined, TraitDictObject, TraitListObject, TraitError, isdefined, File,
     Directory, DictStrStr, has_metadata)
 from ..external.due import due
+from ..utils.resource_monitor import (get_sampler, sampling_supported,
+                                      tree_stats, ResourceRecord)
+from ..utils.profiler import get_profiler, profiled
 
 runtime_profile = str2bool(config.get('execution', 'profile_runtime'))
 nipype_version = LooseVersion(__version__)
@@ -50,13 +53,10 @@ FLOAT_FORMAT = '{:.10f}'.format
 PY35 = sys.version_info >= (3, 5)
 PY3 = sys.version_info[0] > 2
 
-if runtime_profile:
-    try:
-        import psutil
-    except ImportError as exc:
-        iflogger.info('Unable to import packages needed for runtime profiling. '\
-                    'Turning off runtime profiler. Reason: %s' % exc)
-        runtime_profile = False
+if runtime_profile and not sampling_supported():
+    iflogger.info('Unable to sample the resources used by processes (psutil '
+                  'is needed without /proc). Turning off runtime profiler.')
+    runtime_profile = False
 
 __docformat__ = 'restructuredtext'
 
@@ -207,18 +207,7 @@ class Bunch(object):
             stuff = [stuff]
         file_list = []
         for afile in stuff:
-            if os.path.isfile(afile):
-                md5obj = md5()
-                with open(afile, 'rb') as fp:
-                    while True:
-                        data = fp.read(8192)
-                        if not data:
-                            break
-                        md5obj.update(data)
-                md5hex = md5obj.hexdigest()
-            else:
-                md5hex = None
-            file_list.append((afile, md5hex))
+            file_list.append((afile, hash_infile(afile)))
         return file_list
 
     def _get_bunch_hash(self):
@@ -565,8 +554,10 @@ class BaseTraitedSpec(traits.HasTraits):
 
         """
 
-        dict_withhash = []
-        dict_nofilename = []
+        if hash_method is None:
+            hash_method = config.get('execution', 'hash_method')
+
+        items = []
         for name, val in sorted(self.get().items()):
             if not isdefined(val) or self.has_metadata(name, "nohash", True):
                 # skip undefined traits and traits with nohash=True
@@ -574,17 +565,45 @@ class BaseTraitedSpec(traits.HasTraits):
 
             hash_files = (not self.has_metadata(name, "hash_files", False) and not
                           self.has_metadata(name, "name_source"))
+            items.append((name, val, hash_files))
+
+        file_hashes = None
+        if hash_method.lower() == 'content':
+            # read and hash all the files of the spec concurrently
+            filenames = []
+            for _, val, hash_files in items:
+                if hash_files:
+                    filenames.extend(self._get_filenames(val))
+            file_hashes = hash_infiles(filenames)
+
+        dict_withhash = []
+        dict_nofilename = []
+        for name, val, hash_files in items:
             dict_nofilename.append((name,
                                     self._get_sorteddict(val, hash_method=hash_method,
-                                                         hash_files=hash_files)))
+                                                         hash_files=hash_files,
+                                                         file_hashes=file_hashes)))
             dict_withhash.append((name,
                                   self._get_sorteddict(val, True, hash_method=hash_method,
-                                                       hash_files=hash_files)))
+                                                       hash_files=hash_files,
+                                                       file_hashes=file_hashes)))
         return dict_withhash, md5(to_str(dict_nofilename).encode()).hexdigest()
 
+    def _get_filenames(self, objekt):
+        """Return the existing files referenced by a trait value"""
+        if isinstance(objekt, dict):
+            return [fname for val in objekt.values() if isdefined(val)
+                    for fname in self._get_filenames(val)]
+        if isinstance(objekt, (list, tuple)):
+            return [fname for val in objekt if isdefined(val)
+                    for fname in self._get_filenames(val)]
+        if isinstance(objekt, (str, bytes)) and os.path.isfile(objekt):
+            return [objekt]
+        return []
+
 
     def _get_sorteddict(self, objekt, dictwithhash=False, hash_method=None,
-                        hash_files=True):
+                        hash_files=True, file_hashes=None):
         if isinstance(objekt, dict):
             out = []
             for key, val in sorted(objekt.items()):
@@ -592,14 +611,16 @@ class BaseTraitedSpec(traits.HasTraits):
                     out.append((key,
                                 self._get_sorteddict(val, dictwithhash,
                                                      hash_method=hash_method,
-                                                     hash_files=hash_files)))
+                                                     hash_files=hash_files,
+                                                     file_hashes=file_hashes)))
         elif isinstance(objekt, (list, tuple)):
             out = []
             for val in objekt:
                 if isdefined(val):
                     out.append(self._get_sorteddict(val, dictwithhash,
                                                     hash_method=hash_method,
-                                                    hash_files=hash_files))
+                                                    hash_files=hash_files,
+                                                    file_hashes=file_hashes))
             if isinstance(objekt, tuple):
                 out = tuple(out)
         else:
@@ -612,7 +633,10 @@ class BaseTraitedSpec(traits.HasTraits):
                     if hash_method.lower() == 'timestamp':
                         hash = hash_timestamp(objekt)
                     elif hash_method.lower() == 'content':
-                        hash = hash_infile(objekt)
+                        if file_hashes and objekt in file_hashes:
+                            hash = file_hashes[objekt]
+                        else:
+                            hash = hash_infile(objekt)
                     else:
                         raise Exception("Unknown hash method: %s" % hash_method)
                     if dictwithhash:
@@ -774,8 +798,14 @@ class BaseInterface(Interface):
                             self.__class__.__name__)
 
         self.inputs = self.input_spec(**inputs)
-        self.estimated_memory_gb = 1
+        # memory set by hand, and learned from the runtime history
+        self._estimated_memory_gb = None
+        self.learned_memory_gb = None
         self.num_threads = 1
+        self.estimated_runtime = None
+        # Python profiler the interface is run under: None follows the
+        # configuration, False disables profiling (set by nodes)
+        self.profiler = None
 
         if from_file is not None:
             self.load_inputs_from_json(from_file, overwrite=True)
@@ -784,6 +814,23 @@ class BaseInterface(Interface):
                 setattr(self.inputs, name, value)
 
 
+    @property
+    def estimated_memory_gb(self):
+        """Memory (in GB) the interface is expected to use: the value set
+        by hand, else the estimate learned from the runtime history, else 1
+        """
+        memory_gb = getattr(self, '_estimated_memory_gb',
+                            self.__dict__.get('estimated_memory_gb'))
+        if memory_gb is None:
+            memory_gb = getattr(self, 'learned_memory_gb', None)
+        if memory_gb is None:
+            return 1
+        return memory_gb
+
+    @estimated_memory_gb.setter
+    def estimated_memory_gb(self, value):
+        self._estimated_memory_gb = value
+
     @classmethod
     def help(cls, returnhelp=False):
         """ Prints class help
@@ -1081,9 +1128,19 @@ class BaseInterface(Interface):
                         platform=platform.platform(),
                         hostname=platform.node(),
                         version=self.version)
+        profiler = getattr(self, 'profiler', None)
+        if profiler is None:
+            profiler = get_profiler(self, config._sections)
         try:
-            runtime = self._run_wrapper(runtime)
-            outputs = self.aggregate_outputs(runtime)
+            if profiler:
+                with profiled(self, profiler, runtime.cwd, interval=float(
+                        config.get('monitoring', 'profiler_interval'))) \
+                        as runtime.profile:
+                    runtime = self._run_wrapper(runtime)
+                    outputs = self.aggregate_outputs(runtime)
+            else:
+                runtime = self._run_wrapper(runtime)
+                outputs = self.aggregate_outputs(runtime)
             runtime.endTime = dt.isoformat(dt.utcnow())
             timediff = parseutc(runtime.endTime) - parseutc(runtime.startTime)
             runtime.duration = (timediff.days * 86400 + timediff.seconds +
@@ -1093,7 +1150,9 @@ class BaseInterface(Interface):
                                       outputs=outputs)
             prov_record = None
             if str2bool(config.get('execution', 'write_provenance')):
-                prov_record = write_provenance(results)
+                prov_record = write_provenance(
+                    results, background=str2bool(
+                        config.get('execution', 'report_async')))
             results.provenance = prov_record
         except Exception as e:
             runtime.endTime = dt.isoformat(dt.utcnow())
@@ -1131,7 +1190,9 @@ class BaseInterface(Interface):
             prov_record = None
             if str2bool(config.get('execution', 'write_provenance')):
                 try:
-                    prov_record = write_provenance(results)
+                    prov_record = write_provenance(
+                        results, background=str2bool(
+                            config.get('execution', 'report_async')))
                 except Exception:
                     prov_record = None
             results.provenance = prov_record
@@ -1271,150 +1332,24 @@ class Stream(object):
         self._lastidx = len(self._rows)
 
 
-# Get number of threads for process
-def _get_num_threads(proc):
-    """Function to get the number of threads a process is using
-    NOTE: If
-
-    Parameters
-    ----------
-    proc : psutil.Process instance
-        the process to evaluate thead usage of
-
-    Returns
-    -------
-    num_threads : int
-        the number of threads that the process is using
-    """
-
-    # Import packages
-    import psutil
-
-    # If process is running
-    if proc.status() == psutil.STATUS_RUNNING:
-        num_threads = proc.num_threads()
-    elif proc.num_threads() > 1:
-        tprocs = [psutil.Process(thr.id) for thr in proc.threads()]
-        alive_tprocs = [tproc for tproc in tprocs if tproc.status() == psutil.STATUS_RUNNING]
-        num_threads = len(alive_tprocs)
-    else:
-        num_threads = 1
-
-    # Try-block for errors
-    try:
-        child_threads = 0
-        # Iterate through child processes and get number of their threads
-        for child in proc.children(recursive=True):
-            # Leaf process
-            if len(child.children()) == 0:
-                # If process is running, get its number of threads
-                if child.status() == psutil.STATUS_RUNNING:
-                    child_thr = child.num_threads()
-                # If its not necessarily running, but still multi-threaded
-                elif child.num_threads() > 1:
-                    # Cast each thread as a process and check for only running
-                    tprocs = [psutil.Process(thr.id) for thr in child.threads()]
-                    alive_tprocs = [tproc for tproc in tprocs if tproc.status() == psutil.STATUS_RUNNING]
-                    child_thr = len(alive_tprocs)
-                # Otherwise, no threads are running
-                else:
-                    child_thr = 0
-                # Increment child threads
-                child_threads += child_thr
-    # Catch any NoSuchProcess errors
-    except psutil.NoSuchProcess:
-        pass
-
-    # Number of threads is max between found active children and parent
-    num_threads = max(child_threads, num_threads)
-
-    # Return number of threads found
-    return num_threads
-
-
-# Get ram usage of process
-def _get_ram_mb(pid, pyfunc=False):
-    """Function to get the RAM usage of a process and its children
-
-    Parameters
-    ----------
-    pid : integer
-        the PID of the process to get RAM usage of
-    pyfunc : boolean (optional); default=False
-        a flag to indicate if the process is a python function;
-        when Pythons are multithreaded via multiprocess or threading,
-        children functions include their own memory + parents. if this
-        is set, the parent memory will removed from children memories
-
-    Reference: http://ftp.dev411.com/t/python/python-list/095thexx8g/multiprocessing-forking-memory-usage
-
-    Returns
-    -------
-    mem_mb : float
-        the memory RAM in MB utilized by the process PID
-    """
-
-    # Import packages
-    import psutil
-
-    # Init variables
-    _MB = 1024.0**2
-
-    # Try block to protect against any dying processes in the interim
-    try:
-        # Init parent
-        parent = psutil.Process(pid)
-        # Get memory of parent
-        parent_mem = parent.memory_info().rss
-        mem_mb = parent_mem/_MB
-
-        # Iterate through child processes
-        for child in parent.children(recursive=True):
-            child_mem = child.memory_info().rss
-            if pyfunc:
-                child_mem -= parent_mem
-            mem_mb += child_mem/_MB
-
-    # Catch if process dies, return gracefully
-    except psutil.NoSuchProcess:
-        pass
-
-    # Return memory
-    return mem_mb
-
-
-# Get max resources used for process
 def get_max_resources_used(pid, mem_mb, num_threads, pyfunc=False):
-    """Function to get the RAM and threads usage of a process
-
-    Parameters
-    ----------
-    pid : integer
-        the process ID of process to profile
-    mem_mb : float
-        the high memory watermark so far during process execution (in MB)
-    num_threads: int
-        the high thread watermark so far during process execution
+    """Update the high watermarks of the RAM (in MB) and threads used by a
+    process and its children
 
-    Returns
-    -------
-    mem_mb : float
-        the new high memory watermark of process (MB)
-    num_threads : float
-        the new high thread watermark of process
+    .. deprecated::
+       The resources of commands are sampled by the shared sampler of
+       :func:`nipype.utils.resource_monitor.get_sampler`
     """
-
-    # Import packages
-    import psutil
-
-    try:
-        mem_mb = max(mem_mb, _get_ram_mb(pid, pyfunc=pyfunc))
-        num_threads = max(num_threads, _get_num_threads(psutil.Process(pid)))
-    except Exception as exc:
-        iflogger.info('Could not get resources used by process. Error: %s'\
-                      % exc)
-
-    # Return resources
+    warn('get_max_resources_used is deprecated, use '
+         'nipype.utils.resource_monitor.get_sampler instead',
+         DeprecationWarning)
+    stats = tree_stats(pid)
+    if stats:
+        record = ResourceRecord(pid, pyfunc=pyfunc)
+        record.update(stats)
+        mem_mb = max(mem_mb, record.peak_memory_gb * 1024)
+        num_threads = max(num_threads, sum(threads for _, threads, _
+                                           in stats.values()))
     return mem_mb, num_threads
 
 
@@ -1463,10 +1398,12 @@ def run_command(runtime, output=None, timeout=0.01, redirect_x=False):
     errfile = os.path.join(runtime.cwd, 'stderr.nipype')
     outfile = os.path.join(runtime.cwd, 'stdout.nipype')
 
-    # Init variables for memory profiling
-    mem_mb = 0
-    num_threads = 1
     interval = .5
+    # the resources of the command are sampled by the shared sampler thread
+    if runtime_profile:
+        sampler = get_sampler(float(config.get('execution',
+                                               'profile_interval')))
+        record = sampler.track(proc.pid)
 
     if output == 'stream':
         streams = [Stream('stdout', proc.stdout), Stream('stderr', proc.stderr)]
@@ -1484,9 +1421,6 @@ def run_command(runtime, output=None, timeout=0.01, redirect_x=False):
                 for stream in res[0]:
                     stream.read(drain)
         while proc.returncode is None:
-            if runtime_profile:
-                mem_mb, num_threads = \
-                    get_max_resources_used(proc.pid, mem_mb, num_threads)
             proc.poll()
             _process()
             time.sleep(interval)
@@ -1503,12 +1437,6 @@ def run_command(runtime, output=None, timeout=0.01, redirect_x=False):
         result['merged'] = [r[1] for r in temp]
 
     if output == 'allatonce':
-        if runtime_profile:
-            while proc.returncode is None:
-                mem_mb, num_threads = \
-                    get_max_resources_used(proc.pid, mem_mb, num_threads)
-                proc.poll()
-                time.sleep(interval)
         stdout, stderr = proc.communicate()
         stdout = stdout.decode(default_encoding)
         stderr = stderr.decode(default_encoding)
@@ -1516,12 +1444,6 @@ def run_command(runtime, output=None, timeout=0.01, redirect_x=False):
         result['stderr'] = stderr.split('\n')
         result['merged'] = ''
     if output == 'file':
-        if runtime_profile:
-            while proc.returncode is None:
-                mem_mb, num_threads = \
-                    get_max_resources_used(proc.pid, mem_mb, num_threads)
-                proc.poll()
-                time.sleep(interval)
         ret_code = proc.wait()
         stderr.flush()
         stdout.flush()
@@ -1529,19 +1451,20 @@ def run_command(runtime, output=None, timeout=0.01, redirect_x=False):
         result['stderr'] = [line.decode(default_encoding).strip() for line in open(errfile, 'rb').readlines()]
         result['merged'] = ''
     if output == 'none':
-        if runtime_profile:
-            while proc.returncode is None:
-                mem_mb, num_threads = \
-                    get_max_resources_used(proc.pid, mem_mb, num_threads)
-                proc.poll()
-                time.sleep(interval)
         proc.communicate()
         result['stdout'] = []
         result['stderr'] = []
         result['merged'] = ''
 
-    setattr(runtime, 'runtime_memory_gb', mem_mb/1024.0)
-    setattr(runtime, 'runtime_threads', num_threads)
+    if runtime_profile:
+        record = sampler.release(record)
+        setattr(runtime, 'runtime_memory_gb', record.peak_memory_gb)
+        setattr(runtime, 'runtime_threads', record.peak_threads)
+        setattr(runtime, 'runtime_cpu_seconds', record.cpu_seconds)
+        setattr(runtime, 'resource_samples', record.samples)
+    else:
+        setattr(runtime, 'runtime_memory_gb', 0.)
+        setattr(runtime, 'runtime_threads', 1)
     runtime.stderr = '\n'.join(result['stderr'])
     runtime.stdout = '\n'.join(result['stdout'])
     runtime.merged = result['merged']
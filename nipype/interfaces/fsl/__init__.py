@@ -7,30 +7,33 @@
 Top-level namespace for fsl.
 """
 
-from .base import (FSLCommand, Info, check_fsl, no_fsl, no_fsl_course_data)
-from .preprocess import (FAST, FLIRT, ApplyXFM, BET, MCFLIRT, FNIRT,
-                         ApplyWarp, SliceTimer, SUSAN, PRELUDE, FUGUE, FIRST)
-from .model import (Level1Design, FEAT, FEATModel, FILMGLS, FEATRegister,
-                    FLAMEO, ContrastMgr, MultipleRegressDesign, L2Model, SMM,
-                    MELODIC, SmoothEstimate, Cluster, Randomise, GLM)
-from .utils import (AvScale, Smooth, Merge, ExtractROI, Split, ImageMaths, ImageMeants,
-                    ImageStats, FilterRegressor, Overlay, Slicer,
-                    PlotTimeSeries, PlotMotionParams, ConvertXFM,
-                    SwapDimensions, PowerSpectrum, Reorient2Std,
-                    Complex, InvWarp, WarpUtils, ConvertWarp, WarpPoints,
-                    WarpPointsToStd, RobustFOV, CopyGeom, MotionOutliers)
+from ...utils.lazy import lazy_imports
 
-from .epi import (PrepareFieldmap, TOPUP, ApplyTOPUP, Eddy, EPIDeWarp,
-                  SigLoss, EddyCorrect, EpiReg)
-
-from .dti import (BEDPOSTX, XFibres, DTIFit,
-                  ProbTrackX, ProbTrackX2,
-                  VecReg, ProjThresh, FindTheBiggest, DistanceMap,
-                  TractSkeleton, MakeDyadicVectors, BEDPOSTX5, XFibres5)
-from .maths import (ChangeDataType, Threshold, MeanImage, ApplyMask,
-                    IsotropicSmooth, TemporalFilter, DilateImage, ErodeImage,
-                    SpatialFilter, UnaryMaths, BinaryMaths, MultiImageMaths,
-                    MaxnImage, MinImage, MedianImage, PercentileImage,
-                    AR1Image)
-
-from .possum import B0Calc
+lazy_imports(__name__, {
+    '.base': ('FSLCommand', 'Info', 'check_fsl', 'no_fsl',
+              'no_fsl_course_data'),
+    '.preprocess': ('FAST', 'FLIRT', 'ApplyXFM', 'BET', 'MCFLIRT', 'FNIRT',
+                    'ApplyWarp', 'SliceTimer', 'SUSAN', 'PRELUDE', 'FUGUE',
+                    'FIRST'),
+    '.model': ('Level1Design', 'FEAT', 'FEATModel', 'FILMGLS', 'FEATRegister',
+               'FLAMEO', 'ContrastMgr', 'MultipleRegressDesign', 'L2Model',
+               'SMM', 'MELODIC', 'SmoothEstimate', 'Cluster', 'Randomise',
+               'GLM'),
+    '.utils': ('AvScale', 'Smooth', 'Merge', 'ExtractROI', 'Split',
+               'ImageMaths', 'ImageMeants', 'ImageStats', 'FilterRegressor',
+               'Overlay', 'Slicer', 'PlotTimeSeries', 'PlotMotionParams',
+               'ConvertXFM', 'SwapDimensions', 'PowerSpectrum', 'Reorient2Std',
+               'Complex', 'InvWarp', 'WarpUtils', 'ConvertWarp', 'WarpPoints',
+               'WarpPointsToStd', 'RobustFOV', 'CopyGeom', 'MotionOutliers'),
+    '.epi': ('PrepareFieldmap', 'TOPUP', 'ApplyTOPUP', 'Eddy', 'EPIDeWarp',
+             'SigLoss', 'EddyCorrect', 'EpiReg'),
+    '.dti': ('BEDPOSTX', 'XFibres', 'DTIFit', 'ProbTrackX', 'ProbTrackX2',
+             'VecReg', 'ProjThresh', 'FindTheBiggest', 'DistanceMap',
+             'TractSkeleton', 'MakeDyadicVectors', 'BEDPOSTX5', 'XFibres5'),
+    '.maths': ('ChangeDataType', 'Threshold', 'MeanImage', 'ApplyMask',
+               'IsotropicSmooth', 'TemporalFilter', 'DilateImage',
+               'ErodeImage', 'SpatialFilter', 'UnaryMaths', 'BinaryMaths',
+               'MultiImageMaths', 'MaxnImage', 'MinImage', 'MedianImage',
+               'PercentileImage', 'AR1Image'),
+    '.possum': ('B0Calc',),
+})
@@ -21,7 +21,6 @@ standard_library.install_aliases()
 import os
 import re
 import numpy as np
-import nibabel as nb
 
 from ..base import (traits, TraitedSpec, DynamicTraitedSpec, File,
                     Undefined, isdefined, OutputMultiPath, InputMultiPath,
@@ -404,6 +403,7 @@ class AssertEqual(BaseInterface):
     input_spec = AssertEqualInputSpec
 
     def _run_interface(self, runtime):
+        import nibabel as nb
 
         data1 = nb.load(self.inputs.volume1).get_data()
         data2 = nb.load(self.inputs.volume2).get_data()
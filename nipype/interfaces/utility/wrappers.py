@@ -19,21 +19,15 @@ standard_library.install_aliases()
 
 from builtins import str, bytes
 
-from nipype import logging
+from nipype import config, logging
 from ..base import (traits, DynamicTraitedSpec, Undefined, isdefined, runtime_profile,
                     BaseInterfaceInputSpec)
 from ..io import IOBase, add_traits
 from ...utils.filemanip import filename_to_list
 from ...utils.misc import getsource, create_function_from_source
+from ...utils.resource_monitor import get_sampler
 
 logger = logging.getLogger('interface')
-if runtime_profile:
-    try:
-        import psutil
-    except ImportError as exc:
-        logger.info('Unable to import packages needed for runtime profiling. '\
-                    'Turning off runtime profiler. Reason: %s' % exc)
-        runtime_profile = False
 
 
 class FunctionInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
@@ -163,33 +157,31 @@ class Function(IOBase):
 
         # Profile resources if set
         if runtime_profile:
-            from nipype.interfaces.base import get_max_resources_used
             import multiprocessing
             # Init communication queue and proc objs
             queue = multiprocessing.Queue()
             proc = multiprocessing.Process(target=_function_handle_wrapper,
                                            args=(queue,), kwargs=args)
 
-            # Init memory and threads before profiling
-            mem_mb = 0
-            num_threads = 0
-
-            # Start process and profile while it's alive
+            # Start process, sampled by the shared sampler thread
+            sampler = get_sampler(float(config.get('execution',
+                                                   'profile_interval')))
             proc.start()
-            while proc.is_alive():
-                mem_mb, num_threads = \
-                    get_max_resources_used(proc.pid, mem_mb, num_threads,
-                                           pyfunc=True)
+            record = sampler.track(proc.pid, pyfunc=True)
 
-            # Get result from process queue
+            # Get result from process queue before the process can exit
             out = queue.get()
+            proc.join()
+            record = sampler.release(record)
             # If it is an exception, raise it
             if isinstance(out, Exception):
                 raise out
 
             # Function ran successfully, populate runtime stats
-            setattr(runtime, 'runtime_memory_gb', mem_mb / 1024.0)
-            setattr(runtime, 'runtime_threads', num_threads)
+            setattr(runtime, 'runtime_memory_gb', record.peak_memory_gb)
+            setattr(runtime, 'runtime_threads', record.peak_threads)
+            setattr(runtime, 'runtime_cpu_seconds', record.cpu_seconds)
+            setattr(runtime, 'resource_samples', record.samples)
         else:
             out = function_handle(**args)
 
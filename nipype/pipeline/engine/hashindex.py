@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Persistent index of the input hashes of executed nodes
+
+The index is an SQLite database stored in the working directory of a
+workflow. For every node output directory it records the hash of the inputs
+the node last ran with, whether it finished, and where its results are.
+Checking whether a node is up to date then takes an indexed lookup and a
+single stat, instead of listing and globbing its output directory.
+
+The index is advisory: the first error accessing it is logged and disables
+it for the process, and the engine falls back to inspecting the output
+directories.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+from builtins import object
+
+import os
+import sqlite3
+import threading
+
+from ... import logging
+
+logger = logging.getLogger('workflow')
+
+
+class HashIndex(object):
+    """Index mapping node output directories to their input hash
+
+    Examples
+    --------
+
+    >>> import os, tempfile
+    >>> from nipype.pipeline.engine.hashindex import HashIndex
+    >>> index = HashIndex(os.path.join(tempfile.mkdtemp(), 'hashindex.sqlite'))
+    >>> index.update('/work/wf/node', 'node', 'abc', 'done', 'result_node.pklz')
+    >>> index.lookup('/work/wf/node')[:2] == ('abc', 'done')
+    True
+    >>> index.remove('/work/wf/node')
+    >>> index.lookup('/work/wf/node') is None
+    True
+
+    """
+
+    _schema = ('CREATE TABLE IF NOT EXISTS nodes ('
+               'outdir TEXT PRIMARY KEY, node_id TEXT, hashvalue TEXT, '
+               'status TEXT, resultfile TEXT)')
+
+    def __init__(self, filename, timeout=30):
+        """
+        Parameters
+        ----------
+        filename : string
+            path of the SQLite database, created if it does not exist
+        timeout : float
+            seconds to wait for a lock held by another process
+        """
+        self.filename = filename
+        self.timeout = timeout
+        self.disabled = False
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # a connection inherited through a fork cannot be used
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.filename, timeout=self.timeout,
+                                   check_same_thread=False)
+            with conn:
+                conn.execute(self._schema)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _execute(self, query, args=()):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute(query, args).fetchall()
+
+    def _disable(self, err):
+        if not self.disabled:
+            logger.warning('Cannot access hash index %s, not using it: %s',
+                           self.filename, err)
+        self.disabled = True
+
+    def lookup(self, outdir):
+        """Return the (hashvalue, status, resultfile) recorded for a node
+        output directory, or None"""
+        if self.disabled:
+            return None
+        try:
+            rows = self._execute('SELECT hashvalue, status, resultfile '
+                                 'FROM nodes WHERE outdir = ?', (outdir,))
+        except sqlite3.Error as err:
+            self._disable(err)
+            return None
+        if rows:
+            return tuple(rows[0])
+        return None
+
+    def update(self, outdir, node_id, hashvalue, status, resultfile=None):
+        """Record the hash and status of a node output directory"""
+        if self.disabled:
+            return
+        try:
+            self._execute('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?)',
+                          (outdir, node_id, hashvalue, status, resultfile))
+        except sqlite3.Error as err:
+            self._disable(err)
+
+    def remove(self, outdir):
+        """Forget a node output directory"""
+        if self.disabled:
+            return
+        try:
+            self._execute('DELETE FROM nodes WHERE outdir = ?', (outdir,))
+        except sqlite3.Error as err:
+            self._disable(err)
+
+
+_indexes = {}
+
+
+def get_hash_index(filename):
+    """Return the hash index of a file, shared by the nodes of a process"""
+    key = (os.getpid(), filename)
+    if key not in _indexes:
+        _indexes[key] = HashIndex(filename)
+    return _indexes[key]
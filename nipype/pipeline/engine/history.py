@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Persistent history of the resources used by executed interfaces
+
+The history is an SQLite database, by default ``~/.nipype/runtime_history.sqlite``.
+Every time a node runs its interface, the duration, peak memory and number of
+threads it used are recorded under the name of the interface class and the
+size class of its input files (the base 2 logarithm of their total size).
+The plugins then use the recent runs of an interface on inputs of a similar
+size to estimate the memory and runtime of the nodes they schedule.
+
+Peak memory and threads are only measured when ``profile_runtime`` is
+enabled. Like the hash index, the history is advisory: any error accessing it
+is logged and ignored.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+from builtins import object, str, bytes
+
+import errno
+import math
+import os
+import os.path as op
+import sqlite3
+import threading
+from time import time
+
+from ... import logging
+from ...utils.misc import str2bool, interface_name
+
+logger = logging.getLogger('workflow')
+
+
+def _input_files_size(value):
+    if isinstance(value, dict):
+        return sum(_input_files_size(val) for val in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_input_files_size(val) for val in value)
+    if isinstance(value, (str, bytes)) and op.isfile(value):
+        return op.getsize(value)
+    return 0
+
+
+def input_size_class(inputs):
+    """Return the size class of the files referenced by a dictionary of
+    inputs: 0 without input files, else 1 + the base 2 logarithm of their
+    total size in bytes, rounded down"""
+    size = _input_files_size(inputs)
+    if not size:
+        return 0
+    return 1 + int(math.log(size, 2))
+
+
+class RuntimeHistory(object):
+    """History of the duration, peak memory and threads of interface runs
+
+    Examples
+    --------
+
+    >>> import os, tempfile
+    >>> from nipype.pipeline.engine.history import RuntimeHistory
+    >>> history = RuntimeHistory(os.path.join(tempfile.mkdtemp(), 'h.sqlite'))
+    >>> history.record('my.Interface', 20, duration=60., memory_gb=2.)
+    >>> history.record('my.Interface', 20, duration=30., memory_gb=3.)
+    >>> history.estimate('my.Interface', 20)['memory_gb']
+    3.0
+    >>> history.estimate('my.Interface', 20)['duration']
+    45.0
+
+    """
+
+    _schema = ('CREATE TABLE IF NOT EXISTS runs ('
+               'interface TEXT, size_class INTEGER, duration REAL, '
+               'memory_gb REAL, threads INTEGER, recorded REAL)')
+    _index = ('CREATE INDEX IF NOT EXISTS runs_key '
+              'ON runs (interface, size_class, recorded)')
+
+    def __init__(self, filename, max_runs=20, timeout=30):
+        """
+        Parameters
+        ----------
+        filename : string
+            path of the SQLite database, created if it does not exist
+        max_runs : int
+            number of recent runs kept for each interface and size class
+        timeout : float
+            seconds to wait for a lock held by another process
+        """
+        self.filename = filename
+        self.max_runs = max_runs
+        self.timeout = timeout
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # a connection inherited through a fork cannot be used
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.filename, timeout=self.timeout,
+                                   check_same_thread=False)
+            with conn:
+                conn.execute(self._schema)
+                conn.execute(self._index)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _execute(self, *queries):
+        """Run (query, args) pairs in a single transaction and return the
+        rows of the last one"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for query, args in queries:
+                    rows = conn.execute(query, args).fetchall()
+                return rows
+
+    def record(self, interface, size_class, duration=None, memory_gb=None,
+               threads=None):
+        """Record a run of an interface, keeping only the most recent runs
+        of each interface and size class"""
+        try:
+            self._execute(
+                ('INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?)',
+                 (interface, size_class, duration, memory_gb, threads,
+                  time())),
+                ('DELETE FROM runs WHERE interface = ? AND size_class = ? '
+                 'AND recorded NOT IN (SELECT recorded FROM runs WHERE '
+                 'interface = ? AND size_class = ? ORDER BY recorded DESC '
+                 'LIMIT ?)', (interface, size_class, interface, size_class,
+                              self.max_runs)))
+        except sqlite3.Error as err:
+            logger.debug('Cannot update runtime history %s: %s',
+                         self.filename, err)
+
+    def estimate(self, interface, size_class=None):
+        """Return the mean duration, and the largest peak memory and number
+        of threads, of the recorded runs of an interface
+
+        Runs on inputs of the given size class are used if there are any,
+        otherwise all the runs of the interface. Returns None if the
+        interface never ran; the values are None if they were never
+        measured.
+        """
+        query = ('SELECT COUNT(*), AVG(duration), MAX(memory_gb), '
+                 'MAX(threads) FROM runs WHERE interface = ?')
+        try:
+            rows = None
+            if size_class is not None:
+                rows = self._execute((query + ' AND size_class = ?',
+                                      (interface, size_class)))
+            if not rows or not rows[0][0]:
+                rows = self._execute((query, (interface,)))
+        except sqlite3.Error as err:
+            logger.debug('Cannot read runtime history %s: %s',
+                         self.filename, err)
+            return None
+        count, duration, memory_gb, threads = rows[0]
+        if not count:
+            return None
+        return dict(runs=count, duration=duration, memory_gb=memory_gb,
+                    threads=threads)
+
+    def summary(self, interface=None):
+        """Return (interface, size class, runs, mean duration, peak memory,
+        threads) for every interface and size class in the history"""
+        query = ('SELECT interface, size_class, COUNT(*), AVG(duration), '
+                 'MAX(memory_gb), MAX(threads) FROM runs')
+        args = ()
+        if interface is not None:
+            query += ' WHERE interface = ?'
+            args = (interface,)
+        return self._execute((query + ' GROUP BY interface, size_class '
+                              'ORDER BY interface, size_class', args))
+
+    def clear(self, interface=None):
+        """Forget the runs of an interface, or of all interfaces"""
+        if interface is None:
+            self._execute(('DELETE FROM runs', ()))
+        else:
+            self._execute(('DELETE FROM runs WHERE interface = ?',
+                           (interface,)))
+
+
+_histories = {}
+
+
+def get_runtime_history(config_dict):
+    """Return the runtime history selected by the ``[execution]`` section of
+    a config dictionary, shared by the nodes of a process, or None if it is
+    disabled or its directory cannot be created"""
+    execution = config_dict['execution']
+    if not str2bool(execution.get('runtime_history', False)):
+        return None
+    filename = execution.get('runtime_history_file')
+    if not filename:
+        filename = op.join(op.expanduser('~'), '.nipype',
+                           'runtime_history.sqlite')
+    key = (os.getpid(), filename)
+    if key not in _histories:
+        dirname = op.dirname(op.abspath(filename))
+        try:
+            os.makedirs(dirname)
+        except OSError as err:
+            # other processes may create the directory at the same time
+            if err.errno != errno.EEXIST:
+                logger.warning('Cannot create runtime history directory '
+                               '%s, not using it: %s', dirname, err)
+                return None
+        _histories[key] = RuntimeHistory(filename)
+    return _histories[key]
@@ -24,19 +24,20 @@ from collections import OrderedDict
 from copy import deepcopy
 import pickle
 from glob import glob
-import gzip
 import os
 import os.path as op
 import shutil
 import errno
+from multiprocessing import Pool, current_process
 import socket
 from shutil import rmtree
 import sys
 from tempfile import mkdtemp
+from traceback import format_exc
 from hashlib import sha1
 
 from ... import config, logging
-from ...utils.misc import (flatten, unflatten, str2bool)
+from ...utils.misc import (flatten, unflatten, str2bool, interface_name)
 from ...utils.filemanip import (save_json, FileNotFoundError,
                                 filename_to_list, list_to_filename,
                                 copyfiles, fnames_presuffix, loadpkl,
@@ -53,9 +54,45 @@ from .utils import (generate_expanded_graph, modify_paths,
                     clean_working_directory, format_dot, topological_sort,
                     get_print_name, merge_dict, evaluate_connect_function)
 from .base import EngineBase
+from .hashindex import get_hash_index
+from .history import get_runtime_history, input_size_class
+from .reportdb import get_report_database
+from ...utils.asyncwriter import write as write_async
+from ...utils.profiler import get_profiler
+from ...utils.tracing import (configure as configure_tracing, span,
+                              traced)
 
 logger = logging.getLogger('workflow')
 
+# savepkl arguments of the state and result files of a node, for each value
+# of [execution] result_format
+RESULT_FORMATS = {
+    'pklz': dict(compress=True),
+    'pkl': dict(compress=False, protocol=pickle.HIGHEST_PROTOCOL),
+    'split': dict(compress=False, protocol=pickle.HIGHEST_PROTOCOL,
+                  split_attr='outputs'),
+}
+
+def _run_subnode(args):
+    """Run a MapNode subnode in a worker process
+
+    Returns the result of the subnode and the exception it raised, if any.
+    Exceptions that cannot be sent back to the parent process are replaced
+    by a RuntimeError holding their traceback.
+    """
+    node, updatehash = args
+    err = None
+    try:
+        node.run(updatehash=updatehash)
+    except Exception as this_err:
+        err = this_err
+        try:
+            pickle.loads(pickle.dumps(err))
+        except Exception:
+            err = RuntimeError(format_exc())
+    return node.result, err
+
+
 class Node(EngineBase):
     """Wraps interface objects for use in pipeline
 
@@ -171,6 +208,8 @@ class Node(EngineBase):
         if needed_outputs:
             self.needed_outputs = sorted(needed_outputs)
         self._got_inputs = False
+        # report database of the subnodes of a MapNode
+        self._report_database = None
 
     @property
     def interface(self):
@@ -232,28 +271,42 @@ class Node(EngineBase):
         """ Print interface help"""
         self._interface.help()
 
+    @traced('hash')
     def hash_exists(self, updatehash=False):
         # Get a dictionary with hashed filenames and a hashvalue
         # of the dictionary itself.
         hashed_inputs, hashvalue = self._get_hashval()
         outdir = self.output_dir()
-        if op.exists(outdir):
+        hashfile = op.join(outdir, '_0x%s.json' % hashvalue)
+        hash_index = self._get_hash_index()
+        if hash_index is not None and not updatehash:
+            # a node indexed as finished with the same inputs only needs its
+            # hashfile to be checked, not a listing of its output directory
+            entry = hash_index.lookup(outdir)
+            if (entry is not None and entry[:2] == (hashvalue, 'done') and
+                    op.exists(hashfile)):
+                logger.debug('Found hashfile in index: %s', hashfile)
+                return True, hashvalue, hashfile, hashed_inputs
+        log_debug = config.get('logging', 'workflow_level') == 'DEBUG'
+        if log_debug and op.exists(outdir):
             logger.debug('Output dir: %s', to_str(os.listdir(outdir)))
         hashfiles = glob(op.join(outdir, '_0x*.json'))
         logger.debug('Found hashfiles: %s', to_str(hashfiles))
         if len(hashfiles) > 1:
             logger.info(hashfiles)
             logger.info('Removing multiple hashfiles and forcing node to rerun')
-            for hashfile in hashfiles:
-                os.unlink(hashfile)
-        hashfile = op.join(outdir, '_0x%s.json' % hashvalue)
+            for oldfile in hashfiles:
+                os.unlink(oldfile)
         logger.debug('Final hashfile: %s', hashfile)
         if updatehash and op.exists(outdir):
             logger.debug("Updating hash: %s", hashvalue)
             for file in glob(op.join(outdir, '_0x*.json')):
                 os.remove(file)
             self._save_hashfile(hashfile, hashed_inputs)
-        return op.exists(hashfile), hashvalue, hashfile, hashed_inputs
+        hash_exists = op.exists(hashfile)
+        if hash_index is not None and hash_exists:
+            self._update_hash_index(hash_index, hashvalue, 'done')
+        return hash_exists, hashvalue, hashfile, hashed_inputs
 
     def run(self, updatehash=False):
         """Execute the node in its directory.
@@ -264,18 +317,26 @@ class Node(EngineBase):
         updatehash: boolean
             Update the hash stored in the output directory
         """
-        # check to see if output directory and hash exist
         if self.config is None:
             self.config = deepcopy(config._sections)
         else:
             self.config = merge_dict(deepcopy(config._sections), self.config)
+        tracer = configure_tracing(self.config)
+        if tracer is None:
+            return self._run(updatehash=updatehash)
+        try:
+            with tracer.span(self.fullname, node=self._id):
+                return self._run(updatehash=updatehash)
+        finally:
+            tracer.flush()
+
+    def _run(self, updatehash=False):
+        # check to see if output directory and hash exist
         if not self._got_inputs:
             self._get_inputs()
             self._got_inputs = True
         outdir = self.output_dir()
         logger.info("Executing node %s in dir: %s", self._id, outdir)
-        if op.exists(outdir):
-            logger.debug('Output dir: %s', to_str(os.listdir(outdir)))
         hash_info = self.hash_exists(updatehash=updatehash)
         hash_exists, hashvalue, hashfile, hashed_inputs = hash_info
         logger.debug(
@@ -334,7 +395,8 @@ class Node(EngineBase):
             if rm_outdir:
                 logger.debug("Removing old %s and its contents", outdir)
                 try:
-                    rmtree(outdir)
+                    with span('remove_outdir', node=self._id):
+                        rmtree(outdir)
                 except OSError as ex:
                     outdircont = os.listdir(outdir)
                     if ((ex.errno == errno.ENOTEMPTY) and (len(outdircont) == 0)):
@@ -358,25 +420,39 @@ class Node(EngineBase):
                         os.unlink(filename)
             outdir = make_output_dir(outdir)
             self._save_hashfile(hashfile_unfinished, hashed_inputs)
+            hash_index = self._get_hash_index()
+            if hash_index is not None:
+                self._update_hash_index(hash_index, hashvalue, 'running')
             self.write_report(report_type='preexec', cwd=outdir)
-            savepkl(op.join(outdir, '_node.pklz'), self)
-            savepkl(op.join(outdir, '_inputs.pklz'),
-                    self.inputs.get_traitsfree())
+            self._savepkl(op.join(outdir, '_node.pklz'), self)
+            self._savepkl(op.join(outdir, '_inputs.pklz'),
+                          self.inputs.get_traitsfree())
             try:
                 self._run_interface()
             except:
                 os.remove(hashfile_unfinished)
+                if hash_index is not None:
+                    hash_index.remove(outdir)
                 raise
+            if not isinstance(self, MapNode):
+                # the history is optional and must never fail the node
+                try:
+                    self._record_runtime_history()
+                except Exception as err:
+                    logger.warning('%s: cannot record runtime history: %s',
+                                   self.name, err)
             shutil.move(hashfile_unfinished, hashfile)
+            if hash_index is not None:
+                self._update_hash_index(hash_index, hashvalue, 'done')
             self.write_report(report_type='postexec', cwd=outdir)
         else:
             if not op.exists(op.join(outdir, '_inputs.pklz')):
                 logger.debug('%s: creating inputs file', self.name)
-                savepkl(op.join(outdir, '_inputs.pklz'),
-                        self.inputs.get_traitsfree())
+                self._savepkl(op.join(outdir, '_inputs.pklz'),
+                              self.inputs.get_traitsfree())
             if not op.exists(op.join(outdir, '_node.pklz')):
                 logger.debug('%s: creating node file', self.name)
-                savepkl(op.join(outdir, '_node.pklz'), self)
+                self._savepkl(op.join(outdir, '_node.pklz'), self)
             logger.debug("Hashfile exists. Skipping execution")
             self._run_interface(execute=False, updatehash=updatehash)
         logger.debug('Finished running %s in dir: %s\n', self._id, outdir)
@@ -412,6 +488,57 @@ class Node(EngineBase):
             hashed_inputs.append(('needed_outputs', sorted_outputs))
         return hashed_inputs, hashvalue
 
+    def _get_hash_index(self):
+        """Return the hash index of the workflow this node belongs to
+
+        Returns None if the index is disabled or the node is not part of a
+        workflow.
+        """
+        if not str2bool(self.config['execution']['hash_index']):
+            return None
+        if self.base_dir is None or not self._hierarchy:
+            return None
+        index_dir = op.join(self.base_dir, self._hierarchy.split('.')[0])
+        if not op.exists(index_dir):
+            return None
+        return get_hash_index(op.join(index_dir, '_hashindex.sqlite'))
+
+    def _update_hash_index(self, hash_index, hashvalue, status):
+        outdir = self.output_dir()
+        hash_index.update(outdir, self._id, hashvalue, status,
+                          op.join(outdir, 'result_%s.pklz' % self.name))
+
+    @traced('pickle')
+    def _savepkl(self, filename, record, is_result=False):
+        """Save a state or result file in the [execution] result_format"""
+        result_format = self.config['execution']['result_format']
+        try:
+            kwargs = dict(RESULT_FORMATS[result_format])
+        except KeyError:
+            raise ValueError('Unknown result_format %s, expected one of %s' %
+                             (result_format, ', '.join(sorted(RESULT_FORMATS))))
+        if not is_result:
+            kwargs.pop('split_attr', None)
+        savepkl(filename, record, **kwargs)
+
+    @traced('runtime_history')
+    def _record_runtime_history(self):
+        """Record the resources used by the interface in the runtime
+        history, if enabled"""
+        history = get_runtime_history(self.config)
+        runtime = getattr(self._result, 'runtime', None)
+        if history is None or runtime is None:
+            return
+        # peak memory and threads are placeholders unless profiling
+        memory_gb = threads = None
+        if str2bool(self.config['execution']['profile_runtime']):
+            memory_gb = getattr(runtime, 'runtime_memory_gb', None) or None
+            threads = getattr(runtime, 'runtime_threads', None)
+        history.record(interface_name(self._interface),
+                       input_size_class(self.inputs.get_traitsfree()),
+                       duration=getattr(runtime, 'duration', None),
+                       memory_gb=memory_gb, threads=threads)
+
     def _save_hashfile(self, hashfile, hashed_inputs):
         try:
             save_json(hashfile, hashed_inputs)
@@ -430,22 +557,37 @@ class Node(EngineBase):
                 logger.critical('Unable to open the file in write mode: %s',
                                 hashfile)
 
-    def _get_inputs(self):
+    @traced('get_inputs')
+    def _get_inputs(self, results_cache=None):
         """Retrieve inputs from pointers to results file
 
         This mechanism can be easily extended/replaced to retrieve data from
         other data sources (e.g., XNAT, HTTP, etc.,.)
+
+        Parameters
+        ----------
+        results_cache : object with a ``get_outputs(results_file)`` method
+            used instead of loading the outputs from the results files (see
+            :class:`~nipype.pipeline.plugins.base.ResultsCache`)
         """
         logger.debug('Setting node inputs')
+        # several inputs are often connected to the same upstream node
+        outputs_cache = {}
         for key, info in list(self.input_source.items()):
             logger.debug('input: %s', key)
             results_file = info[0]
             logger.debug('results file: %s', results_file)
-            results = loadpkl(results_file)
+            if results_file not in outputs_cache:
+                if results_cache is not None:
+                    outputs = results_cache.get_outputs(results_file)
+                else:
+                    outputs = loadpkl(results_file, attr='outputs')
+                outputs_cache[results_file] = outputs
+            outputs = outputs_cache[results_file]
             output_value = Undefined
             if isinstance(info[1], tuple):
                 output_name = info[1][0]
-                value = getattr(results.outputs, output_name)
+                value = getattr(outputs, output_name)
                 if isdefined(value):
                     output_value = evaluate_connect_function(info[1][1],
                                                              info[1][2],
@@ -453,9 +595,9 @@ class Node(EngineBase):
             else:
                 output_name = info[1]
                 try:
-                    output_value = results.outputs.get()[output_name]
+                    output_value = outputs.get()[output_name]
                 except TypeError:
-                    output_value = results.outputs.dictcopy()[output_name]
+                    output_value = outputs.dictcopy()[output_name]
             logger.debug('output: %s', output_name)
             try:
                 self.set_input(key, deepcopy(output_value))
@@ -476,6 +618,7 @@ class Node(EngineBase):
         self._result = self._run_command(execute)
         os.chdir(old_cwd)
 
+    @traced('save_results')
     def _save_results(self, result, cwd):
         resultsfile = op.join(cwd, 'result_%s.pklz' % self.name)
         if result.outputs:
@@ -486,7 +629,7 @@ class Node(EngineBase):
             result.outputs.set(**modify_paths(outputs, relative=True,
                                               basedir=cwd))
 
-        savepkl(resultsfile, result)
+        self._savepkl(resultsfile, result, is_result=True)
         logger.debug('saved results in %s', resultsfile)
 
         if result.outputs:
@@ -514,13 +657,8 @@ class Node(EngineBase):
         result = None
         attribute_error = False
         if op.exists(resultsoutputfile):
-            pkl_file = gzip.open(resultsoutputfile, 'rb')
             try:
-                result = pickle.load(pkl_file)
-            except UnicodeDecodeError:
-                # Was this pickle created with Python 2.x?
-                pickle.load(pkl_file, fix_imports=True, encoding='utf-8')
-                logger.warn('Successfully loaded pickle in compatibility mode')
+                result = loadpkl(resultsoutputfile)
             except (traits.TraitError, AttributeError, ImportError,
                     EOFError) as err:
                 if isinstance(err, (AttributeError, ImportError)):
@@ -544,10 +682,10 @@ class Node(EngineBase):
                         logger.debug('conversion to full path results in '
                                      'non existent file')
                 aggregate = False
-            pkl_file.close()
         logger.debug('Aggregate: %s', aggregate)
         return result, aggregate, attribute_error
 
+    @traced('load_results')
     def _load_results(self, cwd):
         result, aggregate, attribute_error = self._load_resultfile(cwd)
         # try aggregating first
@@ -603,8 +741,11 @@ class Node(EngineBase):
                 fd.writelines(cmd + "\n")
                 fd.close()
                 logger.info('Running: %s' % cmd)
+            self._interface.profiler = get_profiler(self._interface,
+                                                    self.config)
             try:
-                result = self._interface.run()
+                with span('interface', node=self._id):
+                    result = self._interface.run()
             except Exception as msg:
                 self._save_results(result, cwd)
                 self._result.runtime.stderr = msg
@@ -613,11 +754,10 @@ class Node(EngineBase):
             dirs2keep = None
             if isinstance(self, MapNode):
                 dirs2keep = [op.join(cwd, 'mapflow')]
-            result.outputs = clean_working_directory(result.outputs, cwd,
-                                                     self._interface.inputs,
-                                                     self.needed_outputs,
-                                                     self.config,
-                                                     dirs2keep=dirs2keep)
+            with span('clean_working_directory', node=self._id):
+                result.outputs = clean_working_directory(
+                    result.outputs, cwd, self._interface.inputs,
+                    self.needed_outputs, self.config, dirs2keep=dirs2keep)
             self._save_results(result, cwd)
         else:
             logger.info("Collecting precomputed outputs")
@@ -639,6 +779,7 @@ class Node(EngineBase):
                 out.append(f.replace(op.join(wd, '_tempinput'), wd))
         return out
 
+    @traced('copyfiles')
     def _copyfiles_to_wd(self, outdir, execute, linksonly=False):
         """ copy files over and change the inputs"""
         if hasattr(self._interface, '_get_filecopy_info'):
@@ -683,62 +824,106 @@ class Node(EngineBase):
     def update(self, **opts):
         self.inputs.update(**opts)
 
+    @traced('report')
     def write_report(self, report_type=None, cwd=None):
         if not str2bool(self.config['execution']['create_report']):
             return
+        if report_type == 'preexec':
+            logger.debug('writing pre-exec report of %s', self.fullname)
+            self._save_report(cwd, self._preexec_report())
+        if report_type == 'postexec':
+            logger.debug('writing post-exec report of %s', self.fullname)
+            self._save_report(cwd, self._postexec_report(), append=True)
+
+    def _preexec_report(self):
+        return [write_rst_header('Node: %s' % get_print_name(self), level=0),
+                write_rst_list(['Hierarchy : %s' % self.fullname,
+                                'Exec ID : %s' % self._id]),
+                write_rst_header('Original Inputs', level=1),
+                write_rst_dict(self.inputs.get())]
+
+    def _postexec_report(self):
+        lines = [write_rst_header('Execution Inputs', level=1),
+                 write_rst_dict(self.inputs.get())]
+        exit_now = (not hasattr(self.result, 'outputs') or
+                    self.result.outputs is None)
+        if exit_now:
+            return lines
+        lines.append(write_rst_header('Execution Outputs', level=1))
+        if isinstance(self.result.outputs, Bunch):
+            lines.append(write_rst_dict(self.result.outputs.dictcopy()))
+        elif self.result.outputs:
+            lines.append(write_rst_dict(self.result.outputs.get()))
+        if isinstance(self, MapNode):
+            return lines
+        lines.append(write_rst_header('Runtime info', level=1))
+        # Init rst dictionary of runtime stats
+        rst_dict = {'hostname' : self.result.runtime.hostname,
+                    'duration' : self.result.runtime.duration}
+        # Try and insert memory/threads usage if available
+        if runtime_profile:
+            try:
+                rst_dict['runtime_memory_gb'] = self.result.runtime.runtime_memory_gb
+                rst_dict['runtime_threads'] = self.result.runtime.runtime_threads
+            except AttributeError:
+                logger.info('Runtime memory and threads stats unavailable')
+        if hasattr(self.result.runtime, 'cmdline'):
+            rst_dict['command'] = self.result.runtime.cmdline
+        lines.append(write_rst_dict(rst_dict))
+        execution = self.config['execution']
+        if hasattr(self.result.runtime, 'merged'):
+            merged = self.result.runtime.merged
+            max_lines = execution.get('report_output_lines')
+            if max_lines and len(merged) > int(max_lines):
+                omitted = len(merged) - int(max_lines)
+                merged = (['(%d lines omitted)' % omitted] +
+                          list(merged[omitted:]))
+            lines.append(write_rst_header('Terminal output', level=2))
+            lines.append(write_rst_list(merged))
+        if hasattr(self.result.runtime, 'environ') and \
+                str2bool(execution.get('report_environ', True)):
+            lines.append(write_rst_header('Environment', level=2))
+            lines.append(write_rst_dict(self.result.runtime.environ))
+        return lines
+
+    def _save_report(self, cwd, lines, append=False):
+        """Write a section of the report of the node, in its ``_report``
+        directory or in the report database of the workflow, and in the
+        background if ``report_async`` is enabled"""
+        execution = self.config['execution']
+        background = str2bool(execution.get('report_async', False))
+        text = ''.join(lines)
+        report_db = self._get_report_database()
+        if report_db is not None:
+            report_db.add(cwd, self.fullname, text, append=append)
+            if report_db.commit_due():
+                write_async(background, report_db.commit)
+            return
         report_dir = op.join(cwd, '_report')
-        report_file = op.join(report_dir, 'report.rst')
         if not op.exists(report_dir):
             os.makedirs(report_dir)
-        if report_type == 'preexec':
-            logger.debug('writing pre-exec report to %s', report_file)
-            fp = open(report_file, 'wt')
-            fp.writelines(write_rst_header('Node: %s' % get_print_name(self),
-                                           level=0))
-            fp.writelines(write_rst_list(['Hierarchy : %s' % self.fullname,
-                                          'Exec ID : %s' % self._id]))
-            fp.writelines(write_rst_header('Original Inputs', level=1))
-            fp.writelines(write_rst_dict(self.inputs.get()))
-        if report_type == 'postexec':
-            logger.debug('writing post-exec report to %s', report_file)
-            fp = open(report_file, 'at')
-            fp.writelines(write_rst_header('Execution Inputs', level=1))
-            fp.writelines(write_rst_dict(self.inputs.get()))
-            exit_now = (not hasattr(self.result, 'outputs') or
-                        self.result.outputs is None)
-            if exit_now:
-                return
-            fp.writelines(write_rst_header('Execution Outputs', level=1))
-            if isinstance(self.result.outputs, Bunch):
-                fp.writelines(write_rst_dict(self.result.outputs.dictcopy()))
-            elif self.result.outputs:
-                fp.writelines(write_rst_dict(self.result.outputs.get()))
-            if isinstance(self, MapNode):
-                fp.close()
-                return
-            fp.writelines(write_rst_header('Runtime info', level=1))
-            # Init rst dictionary of runtime stats
-            rst_dict = {'hostname' : self.result.runtime.hostname,
-                        'duration' : self.result.runtime.duration}
-            # Try and insert memory/threads usage if available
-            if runtime_profile:
-                try:
-                    rst_dict['runtime_memory_gb'] = self.result.runtime.runtime_memory_gb
-                    rst_dict['runtime_threads'] = self.result.runtime.runtime_threads
-                except AttributeError:
-                    logger.info('Runtime memory and threads stats unavailable')
-            if hasattr(self.result.runtime, 'cmdline'):
-                rst_dict['command'] = self.result.runtime.cmdline
-                fp.writelines(write_rst_dict(rst_dict))
-            else:
-                fp.writelines(write_rst_dict(rst_dict))
-            if hasattr(self.result.runtime, 'merged'):
-                fp.writelines(write_rst_header('Terminal output', level=2))
-                fp.writelines(write_rst_list(self.result.runtime.merged))
-            if hasattr(self.result.runtime, 'environ'):
-                fp.writelines(write_rst_header('Environment', level=2))
-                fp.writelines(write_rst_dict(self.result.runtime.environ))
-        fp.close()
+        write_async(background, _write_text,
+                    op.join(report_dir, 'report.rst'), text, append)
+
+    def _get_report_database(self):
+        """Return the report database of the workflow this node belongs to,
+        or None if it is disabled or the node is not part of a workflow"""
+        if not str2bool(self.config['execution'].get('report_database',
+                                                     False)):
+            return None
+        if self._report_database is not None:
+            return get_report_database(self._report_database)
+        if self.base_dir is None or not self._hierarchy:
+            return None
+        report_dir = op.join(self.base_dir, self._hierarchy.split('.')[0])
+        if not op.exists(report_dir):
+            return None
+        return get_report_database(op.join(report_dir, '_reports.sqlite'))
+
+
+def _write_text(filename, text, append=False):
+    with open(filename, 'at' if append else 'wt') as fp:
+        fp.write(text)
 
 
 class JoinNode(Node):
@@ -999,6 +1184,8 @@ class MapNode(Node):
             node specific name
         serial : boolean
             flag to enforce executing the jobs of the mapnode in a serial manner rather than parallel
+            by the execution plugin. Set ``mapnode_procs`` in the node ``plugin_args`` to run the
+            jobs in a pool of processes whenever the mapnode is executed as a whole
         nested : boolea
             support for nested lists, if set the input list will be flattened before running, and the
             nested list structure of the outputs will be resored
@@ -1104,6 +1291,7 @@ class MapNode(Node):
             nitems = len(flatten(filename_to_list(getattr(self.inputs, self.iterfield[0]))))
         else:
             nitems = len(filename_to_list(getattr(self.inputs, self.iterfield[0])))
+        report_db = self._get_report_database()
         for i in range(nitems):
             nodename = '_' + self.name + str(i)
             node = Node(deepcopy(self._interface), name=nodename)
@@ -1121,6 +1309,8 @@ class MapNode(Node):
                 setattr(node.inputs, field, fieldvals[i])
             node.config = self.config
             node.base_dir = op.join(cwd, 'mapflow')
+            if report_db is not None:
+                node._report_database = report_db.filename
             yield i, node
 
     def _node_runner(self, nodes, updatehash=False):
@@ -1137,6 +1327,34 @@ class MapNode(Node):
                 os.chdir(old_cwd)
                 yield i, node, err
 
+    def _parallel_node_runner(self, nodes, n_procs, updatehash=False):
+        """Run subnodes in a pool of n_procs processes, yielding them in
+        order"""
+        nodes = list(nodes)
+        pool = Pool(processes=n_procs)
+        try:
+            results = pool.imap(_run_subnode,
+                                [(node, updatehash) for _, node in nodes])
+            for (i, node), (result, err) in zip(nodes, results):
+                node._result = result
+                if err is not None and \
+                        str2bool(self.config['execution']['stop_on_first_crash']):
+                    raise err
+                yield i, node, err
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _subnode_procs(self, nitems):
+        """Number of processes to run the subnodes with, from the
+        ``mapnode_procs`` plugin argument of the node"""
+        n_procs = min(int(self.plugin_args.get('mapnode_procs', 1)), nitems)
+        if n_procs > 1 and current_process().daemon:
+            logger.debug('Running the subnodes of %s serially: daemonic '
+                         'processes cannot start a process pool', self._id)
+            return 1
+        return n_procs
+
     def _collate_results(self, nodes):
         self._result = InterfaceResult(interface=[], runtime=[],
                                        provenance=[], inputs=[],
@@ -1186,6 +1404,7 @@ class MapNode(Node):
             raise Exception('Subnodes of node: %s failed:\n%s' %
                             (self.name, '\n'.join(msg)))
 
+    @traced('report')
     def write_report(self, report_type=None, cwd=None):
         if not str2bool(self.config['execution']['create_report']):
             return
@@ -1193,12 +1412,13 @@ class MapNode(Node):
             super(MapNode, self).write_report(report_type=report_type, cwd=cwd)
         if report_type == 'postexec':
             super(MapNode, self).write_report(report_type=report_type, cwd=cwd)
-            report_dir = op.join(cwd, '_report')
-            report_file = op.join(report_dir, 'report.rst')
-            fp = open(report_file, 'at')
-            fp.writelines(write_rst_header('Subnode reports', level=1))
             nitems = len(filename_to_list(
                 getattr(self.inputs, self.iterfield[0])))
+            # subnode reports are looked up by output directory in the
+            # report database
+            report_file = []
+            if self._get_report_database() is None:
+                report_file = ['_report', 'report.rst']
             subnode_report_files = []
             for i in range(nitems):
                 nodename = '_' + self.name + str(i)
@@ -1206,10 +1426,11 @@ class MapNode(Node):
                                                op.join(cwd,
                                                        'mapflow',
                                                        nodename,
-                                                       '_report',
-                                                       'report.rst'))
-            fp.writelines(write_rst_list(subnode_report_files))
-            fp.close()
+                                                       *report_file))
+            self._save_report(cwd, [write_rst_header('Subnode reports',
+                                                     level=1),
+                                    write_rst_list(subnode_report_files)],
+                              append=True)
 
     def get_subnodes(self):
         if not self._got_inputs:
@@ -1232,12 +1453,12 @@ class MapNode(Node):
             else:
                 return len(filename_to_list(getattr(self.inputs, self.iterfield[0])))
 
-    def _get_inputs(self):
+    def _get_inputs(self, results_cache=None):
         old_inputs = self._inputs.get()
         self._inputs = self._create_dynamic_traits(self._interface.inputs,
                                                    fields=self.iterfield)
         self._inputs.set(**old_inputs)
-        super(MapNode, self)._get_inputs()
+        super(MapNode, self)._get_inputs(results_cache=results_cache)
 
     def _check_iterfield(self):
         """Checks iterfield
@@ -1263,7 +1484,9 @@ class MapNode(Node):
         """Run the mapnode interface
 
         This is primarily intended for serial execution of mapnode. A parallel
-        execution requires creation of new nodes that can be spawned
+        execution requires creation of new nodes that can be spawned, or
+        setting ``mapnode_procs`` in the node ``plugin_args`` to run them in
+        a process pool
         """
         old_cwd = os.getcwd()
         cwd = self.output_dir()
@@ -1277,8 +1500,15 @@ class MapNode(Node):
                 nitems = len(filename_to_list(getattr(self.inputs,
                                                       self.iterfield[0])))
             nodenames = ['_' + self.name + str(i) for i in range(nitems)]
-            self._collate_results(self._node_runner(self._make_nodes(cwd),
-                                                    updatehash=updatehash))
+            n_procs = self._subnode_procs(nitems)
+            if n_procs > 1:
+                nodes = self._parallel_node_runner(self._make_nodes(cwd),
+                                                   n_procs,
+                                                   updatehash=updatehash)
+            else:
+                nodes = self._node_runner(self._make_nodes(cwd),
+                                          updatehash=updatehash)
+            self._collate_results(nodes)
             self._save_results(self._result, cwd)
             # remove any node directories no longer required
             dirs2remove = []
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Database of the reports of the nodes of a workflow
+
+With ``report_database`` enabled, the nodes of a workflow store their
+reports in a single SQLite database in the working directory of the workflow
+(``_reports.sqlite``), instead of writing a ``_report/report.rst`` file in
+each of their output directories. Reports are added in batches: the sections
+added by the nodes of a process are kept in memory and stored in a single
+transaction once ``batch_size`` sections are waiting or ``commit_interval``
+seconds have passed, when the process exits and when a workflow finishes
+running (:func:`commit_reports`).
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+from builtins import object
+
+import atexit
+import os
+import sqlite3
+import threading
+from multiprocessing.util import Finalize
+from time import time
+
+from ... import logging
+
+logger = logging.getLogger('workflow')
+
+
+class ReportDatabase(object):
+    """Reports of the nodes of a workflow, by output directory
+
+    Examples
+    --------
+
+    >>> import os, tempfile
+    >>> from nipype.pipeline.engine.reportdb import ReportDatabase
+    >>> reports = ReportDatabase(os.path.join(tempfile.mkdtemp(), 'r.sqlite'))
+    >>> reports.add('/work/wf/node', 'wf.node', 'Node: node\\n')
+    >>> reports.add('/work/wf/node', 'wf.node', 'Outputs\\n', append=True)
+    >>> reports.commit()
+    >>> print(reports.report('/work/wf/node'))
+    Node: node
+    Outputs
+    <BLANKLINE>
+
+    """
+
+    _schema = ('CREATE TABLE IF NOT EXISTS reports ('
+               'outdir TEXT, node TEXT, text TEXT, written REAL)')
+    _index = 'CREATE INDEX IF NOT EXISTS reports_outdir ON reports (outdir)'
+
+    def __init__(self, filename, timeout=30, batch_size=100,
+                 commit_interval=10.):
+        """
+        Parameters
+        ----------
+        filename : string
+            path of the SQLite database, created if it does not exist
+        timeout : float
+            seconds to wait for a lock held by another process
+        batch_size : int
+            number of added sections after which a commit is due
+        commit_interval : float
+            seconds after which the added sections are due to be committed
+        """
+        self.filename = filename
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self._pending = []
+        self._last_commit = time()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.filename, timeout=self.timeout)
+        with conn:
+            conn.execute(self._schema)
+            conn.execute(self._index)
+        return conn
+
+    def add(self, outdir, node, text, append=False):
+        """Add a section to the report of a node output directory, replacing
+        its previous report unless append is true
+
+        The section is only stored by the next commit.
+        """
+        with self._lock:
+            self._pending.append((outdir, node, text, append))
+
+    def commit_due(self):
+        """Whether the added sections are due to be committed"""
+        with self._lock:
+            return len(self._pending) >= self.batch_size or (
+                bool(self._pending) and
+                time() - self._last_commit >= self.commit_interval)
+
+    def commit(self):
+        """Store the sections added since the last commit"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_commit = time()
+        if not pending:
+            return
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    for outdir, node, text, append in pending:
+                        if not append:
+                            conn.execute('DELETE FROM reports WHERE outdir = ?',
+                                         (outdir,))
+                        conn.execute('INSERT INTO reports VALUES (?, ?, ?, ?)',
+                                     (outdir, node, text, time()))
+            finally:
+                conn.close()
+        except sqlite3.Error as err:
+            logger.warning('Cannot store %d report sections in %s: %s',
+                           len(pending), self.filename, err)
+
+    def report(self, outdir):
+        """Return the report of a node output directory, or None"""
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT text FROM reports WHERE outdir = ? '
+                                'ORDER BY rowid', (outdir,)).fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            return None
+        return ''.join(row[0] for row in rows)
+
+    def nodes(self):
+        """Return the (output directory, node) of every stored report"""
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT outdir, node FROM reports '
+                                'GROUP BY outdir ORDER BY MIN(rowid)').fetchall()
+        finally:
+            conn.close()
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+_exit_pid = None
+
+
+def get_report_database(filename):
+    """Return the report database of a file, shared within the process so
+    that the reports of its nodes are committed together"""
+    global _exit_pid
+    # the sections added by a parent process are not committed by a fork
+    key = (os.getpid(), filename)
+    with _databases_lock:
+        if key not in _databases:
+            _databases[key] = ReportDatabase(filename)
+        if _exit_pid != os.getpid():
+            _exit_pid = os.getpid()
+            atexit.register(commit_reports)
+            # worker processes of multiprocessing skip atexit handlers
+            Finalize(None, commit_reports, exitpriority=50)
+        return _databases[key]
+
+
+def commit_reports():
+    """Store the sections added to the report databases of the current
+    process"""
+    with _databases_lock:
+        databases = [database for (pid, _), database in _databases.items()
+                     if pid == os.getpid()]
+    for database in databases:
+        database.commit()
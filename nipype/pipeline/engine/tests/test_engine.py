@@ -486,6 +486,33 @@ def test_mapnode_nested(tmpdir):
     assert "can only concatenate list" in str(excinfo.value)
 
 
+def test_mapnode_procs(tmpdir):
+    os.chdir(str(tmpdir))
+    from nipype import MapNode, Function, config
+
+    def func1(in1):
+        import os
+        return in1 + 1, os.getpid()
+    n1 = MapNode(Function(input_names=['in1'],
+                          output_names=['out', 'pid'],
+                          function=func1),
+                 iterfield=['in1'],
+                 name='n1')
+    n1.inputs.in1 = [5, 4, 3, 2, 1]
+    n1.plugin_args = {'mapnode_procs': 2}
+    n1.run()
+    assert n1.get_output('out') == [6, 5, 4, 3, 2]
+    assert os.getpid() not in n1.get_output('pid')
+    assert sorted(os.listdir(os.path.join(n1.output_dir(), 'mapflow'))) == \
+        ['_n1%d' % i for i in range(5)]
+
+    n1.config = deepcopy(config._sections)
+    n1.config['execution']['stop_on_first_crash'] = True
+    n1.inputs.in1 = [1, 'a', 3]
+    with pytest.raises(TypeError):
+        n1.run()
+
+
 def test_node_hash(tmpdir):
     wd = str(tmpdir)
     os.chdir(wd)
@@ -571,6 +598,71 @@ def test_old_config(tmpdir):
     w1.run(plugin='Linear')
 
 
+def test_shared_node_config(tmpdir):
+    from nipype.interfaces.utility import Function
+
+    def func2(a):
+        return a + 1
+    n1 = pe.Node(Function(input_names=['a'], output_names=['b'],
+                          function=func2), name='n1')
+    n1.iterables = ('a', [1, 2])
+    n2 = pe.Node(Function(input_names=['a'], output_names=['b'],
+                          function=func2), name='n2')
+    n3 = pe.Node(Function(input_names=['a'], output_names=['b'],
+                          function=func2), name='n3')
+    n3.config = {'execution': {'keep_inputs': 'true'}}
+    w1 = pe.Workflow(name='test', base_dir=str(tmpdir))
+    w1.connect([(n1, n2, [('b', 'a')]), (n2, n3, [('b', 'a')])])
+    w1.config['execution']['crashdump_dir'] = str(tmpdir)
+
+    class InspectPlugin(object):
+        def run(self, graph, config, updatehash=False):
+            self.nodes = dict((node.itername, node) for node in graph.nodes())
+
+    plugin = InspectPlugin()
+    w1.run(plugin=plugin)
+    nodes = plugin.nodes
+    assert len(nodes) == 6
+    # nodes without overrides share the same copy of the workflow config
+    assert nodes['test.n1.aI.a0'].config is nodes['test.n2.a1'].config
+    assert nodes['test.n1.aI.a0'].config is not w1.config
+    assert nodes['test.n3.a0'].config['execution']['keep_inputs'] == 'true'
+    assert nodes['test.n2.a0'].config['execution']['keep_inputs'] == 'false'
+    assert (nodes['test.n3.a0'].config['execution']['crashdump_dir'] ==
+            str(tmpdir))
+
+
+@pytest.mark.parametrize("result_format", ['pklz', 'pkl', 'split'])
+def test_result_format(tmpdir, result_format):
+    from nipype.interfaces.utility import Function
+    from ....utils.filemanip import loadpkl
+
+    def func2(a):
+        return a + 1
+    n1 = pe.Node(Function(input_names=['a'], output_names=['b'],
+                          function=func2), name='n1')
+    n1.inputs.a = 1
+    n2 = pe.Node(Function(input_names=['a'], output_names=['b'],
+                          function=func2), name='n2')
+    w1 = pe.Workflow(name='test', base_dir=str(tmpdir))
+    w1.connect([(n1, n2, [('b', 'a')])])
+    w1.config['execution'] = {'crashdump_dir': str(tmpdir),
+                              'result_format': result_format}
+    w1.run(plugin='Linear')
+    resultfile = os.path.join(str(tmpdir), 'test', 'n2', 'result_n2.pklz')
+    with open(resultfile, 'rb') as fp:
+        assert (fp.read(2) == b'\x1f\x8b') == (result_format == 'pklz')
+    result = loadpkl(resultfile)
+    assert result.outputs.b == 3
+    assert result.runtime.cwd == os.path.dirname(resultfile)
+
+    # results written in any format are reused by the others
+    w1.config['execution'] = {'crashdump_dir': str(tmpdir),
+                              'result_format': 'pklz',
+                              'stop_on_first_rerun': True}
+    w1.run(plugin='Linear')
+
+
 def test_mapnode_json(tmpdir):
     """Tests that mapnodes don't generate excess jsons
     """
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the hash index of executed nodes
+"""
+from __future__ import print_function, unicode_literals
+import os
+
+from ... import engine as pe
+from ..hashindex import HashIndex, get_hash_index
+from ....interfaces import base as nib
+
+
+class InputSpec(nib.TraitedSpec):
+    input1 = nib.traits.Int(desc='a random int')
+
+
+class OutputSpec(nib.TraitedSpec):
+    output1 = nib.traits.Int(desc='a random int')
+
+
+class CountingInterface(nib.BaseInterface):
+    input_spec = InputSpec
+    output_spec = OutputSpec
+    runs = 0
+
+    def _run_interface(self, runtime):
+        CountingInterface.runs += 1
+        runtime.returncode = 0
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['output1'] = self.inputs.input1
+        return outputs
+
+
+def _make_workflow(base_dir, value=1):
+    wf = pe.Workflow(name='indexed', base_dir=base_dir)
+    wf.config['execution'] = {'hash_index': True}
+    mod1 = pe.Node(CountingInterface(), name='mod1')
+    mod1.inputs.input1 = value
+    mod2 = pe.Node(CountingInterface(), name='mod2')
+    wf.connect(mod1, 'output1', mod2, 'input1')
+    return wf
+
+
+def test_hashindex_roundtrip(tmpdir):
+    index = HashIndex(os.path.join(str(tmpdir), 'index.sqlite'))
+    assert index.lookup('/some/dir') is None
+    index.update('/some/dir', 'node', 'abc', 'running')
+    index.update('/some/dir', 'node', 'abc', 'done', 'result_node.pklz')
+    assert index.lookup('/some/dir') == ('abc', 'done', 'result_node.pklz')
+    index.remove('/some/dir')
+    assert index.lookup('/some/dir') is None
+
+
+def test_hashindex_unreadable(tmpdir):
+    index = HashIndex(os.path.join(str(tmpdir), 'missing', 'index.sqlite'))
+    index.update('/some/dir', 'node', 'abc', 'done')
+    # the first error disables the index
+    assert index.disabled
+    os.makedirs(os.path.join(str(tmpdir), 'missing'))
+    assert index.lookup('/some/dir') is None
+
+
+def test_hashindex_connection(tmpdir):
+    filename = os.path.join(str(tmpdir), 'index.sqlite')
+    index = get_hash_index(filename)
+    assert get_hash_index(filename) is index
+    index.update('/some/dir', 'node', 'abc', 'done')
+    conn = index._conn
+    assert index.lookup('/some/dir')[:2] == ('abc', 'done')
+    assert index._conn is conn
+
+
+def test_workflow_hashindex(tmpdir):
+    base_dir = str(tmpdir)
+    CountingInterface.runs = 0
+    _make_workflow(base_dir).run()
+    assert CountingInterface.runs == 2
+    index = HashIndex(os.path.join(base_dir, 'indexed', '_hashindex.sqlite'))
+    outdir = os.path.join(base_dir, 'indexed', 'mod1')
+    hashvalue, status, resultfile = index.lookup(outdir)
+    assert status == 'done'
+    assert os.path.exists(os.path.join(outdir, '_0x%s.json' % hashvalue))
+    assert resultfile == os.path.join(outdir, 'result_mod1.pklz')
+
+    # up to date nodes are not rerun
+    _make_workflow(base_dir).run()
+    assert CountingInterface.runs == 2
+
+    # an index entry without its hashfile is not trusted
+    os.remove(os.path.join(outdir, '_0x%s.json' % hashvalue))
+    _make_workflow(base_dir).run()
+    assert CountingInterface.runs == 3
+
+    # changed inputs are detected
+    _make_workflow(base_dir, value=2).run()
+    assert CountingInterface.runs == 5
+    assert index.lookup(outdir)[0] != hashvalue
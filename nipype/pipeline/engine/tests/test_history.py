@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the runtime history of interfaces
+"""
+from __future__ import print_function, unicode_literals
+import os
+
+from ... import engine as pe
+from ...plugins.base import DistributedPluginBase
+from ..history import (RuntimeHistory, get_runtime_history,
+                       input_size_class)
+from ....utils.misc import interface_name
+from ....interfaces import base as nib
+
+
+class InputSpec(nib.TraitedSpec):
+    input1 = nib.traits.Int(desc='a random int')
+
+
+class OutputSpec(nib.TraitedSpec):
+    output1 = nib.traits.Int(desc='a random int')
+
+
+class SimpleInterface(nib.BaseInterface):
+    input_spec = InputSpec
+    output_spec = OutputSpec
+
+    def _run_interface(self, runtime):
+        runtime.returncode = 0
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['output1'] = self.inputs.input1
+        return outputs
+
+
+def test_history_roundtrip(tmpdir):
+    history = RuntimeHistory(os.path.join(str(tmpdir), 'history.sqlite'),
+                             max_runs=3)
+    assert history.estimate('a.Interface') is None
+    for duration in [1., 2., 3., 4.]:
+        history.record('a.Interface', 10, duration=duration, memory_gb=2.,
+                       threads=1)
+    history.record('a.Interface', 20, duration=10., memory_gb=4.)
+    # only the three most recent runs are kept for each size class
+    estimate = history.estimate('a.Interface', 10)
+    assert estimate['runs'] == 3
+    assert estimate['duration'] == 3.
+    assert estimate['memory_gb'] == 2.
+    assert estimate['threads'] == 1
+    # unknown size classes fall back to all the runs of the interface
+    assert history.estimate('a.Interface', 30)['runs'] == 4
+    assert [row[:3] for row in history.summary()] == [
+        ('a.Interface', 10, 3), ('a.Interface', 20, 1)]
+    history.clear('a.Interface')
+    assert history.estimate('a.Interface') is None
+
+
+def test_input_size_class(tmpdir):
+    small = tmpdir.join('small.txt')
+    small.write('x' * 10)
+    large = tmpdir.join('large.txt')
+    large.write('x' * 5000)
+    assert input_size_class({'value': 1}) == 0
+    assert input_size_class({'in_file': str(small)}) == 4
+    assert input_size_class({'in_files': [str(small), str(large)]}) == 13
+
+
+def test_history_workflow(tmpdir):
+    history_file = os.path.join(str(tmpdir), 'history.sqlite')
+    wf = pe.Workflow(name='recorded', base_dir=str(tmpdir))
+    wf.config['execution'] = {'runtime_history': True,
+                              'runtime_history_file': history_file}
+    mod1 = pe.Node(SimpleInterface(), name='mod1')
+    mod1.inputs.input1 = 1
+    mod2 = pe.Node(SimpleInterface(), name='mod2')
+    wf.connect(mod1, 'output1', mod2, 'input1')
+    wf.run()
+
+    name = interface_name(SimpleInterface())
+    estimate = RuntimeHistory(history_file).estimate(name, 0)
+    assert estimate['runs'] == 2
+    assert estimate['duration'] is not None
+
+    # the history only fills in the estimates left at their defaults
+    node = pe.Node(SimpleInterface(), name='estimated')
+    node.config = {'execution': {'runtime_history': 'true',
+                                 'runtime_history_file': history_file}}
+    RuntimeHistory(history_file).record(name, 0, duration=5., memory_gb=3.)
+    plugin = DistributedPluginBase()
+    plugin.procs = [node]
+    assert plugin._estimate_resources(0)['runs'] == 3
+    assert node.interface.estimated_memory_gb == 3.
+    assert node.interface.estimated_runtime > 0
+    node.interface.estimated_memory_gb = 2
+    node.interface.estimated_runtime = 60
+    plugin._estimate_resources(0)
+    assert node.interface.estimated_memory_gb == 2
+    assert node.interface.estimated_runtime == 60
+    # even when set by hand to the default
+    node.interface.estimated_memory_gb = 1
+    plugin._estimate_resources(0)
+    assert node.interface.estimated_memory_gb == 1
+
+
+def test_history_unavailable(tmpdir):
+    # the history directory cannot be created below a file
+    blocker = tmpdir.join('blocker')
+    blocker.write('')
+    history_file = os.path.join(str(blocker), 'history', 'history.sqlite')
+    config = {'execution': {'runtime_history': True,
+                            'runtime_history_file': history_file}}
+    assert get_runtime_history(config) is None
+
+    wf = pe.Workflow(name='unrecorded', base_dir=str(tmpdir))
+    wf.config['execution'] = config['execution']
+    mod1 = pe.Node(SimpleInterface(), name='mod1')
+    mod1.inputs.input1 = 1
+    wf.add_nodes([mod1])
+    wf.run()
+    # the node still finished
+    hashfiles = [path.basename for path in
+                 tmpdir.join('unrecorded', 'mod1').listdir('_0x*.json')]
+    assert len(hashfiles) == 1
+    assert 'unfinished' not in hashfiles[0]
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the node reports and the report database
+"""
+from __future__ import print_function, unicode_literals
+import os
+
+import pytest
+
+from ... import engine as pe
+from .. import reportdb
+from ..reportdb import ReportDatabase
+from ....interfaces import base as nib
+from ....interfaces.utility import Function
+from ....utils.asyncwriter import BackgroundWriter
+
+
+def add_one(x):
+    return x + 1
+
+
+class Counter(nib.CommandLine):
+    _cmd = 'seq'
+    output_spec = nib.TraitedSpec
+
+    def _list_outputs(self):
+        return {}
+
+
+def test_report_database_roundtrip(tmpdir):
+    reports = ReportDatabase(os.path.join(str(tmpdir), 'reports.sqlite'))
+    reports.add('/work/node', 'wf.node', 'pre\n')
+    reports.add('/work/node', 'wf.node', 'post\n', append=True)
+    reports.add('/work/other', 'wf.other', 'other\n')
+    # nothing is stored before the batch is committed
+    assert reports.nodes() == []
+    reports.commit()
+    assert reports.report('/work/node') == 'pre\npost\n'
+    assert reports.nodes() == [('/work/node', 'wf.node'),
+                               ('/work/other', 'wf.other')]
+    # a rerun replaces the report
+    reports.add('/work/node', 'wf.node', 'rerun\n')
+    reports.commit()
+    assert reports.report('/work/node') == 'rerun\n'
+    assert reports.report('/work/missing') is None
+
+
+def test_report_database_batches(tmpdir, monkeypatch):
+    filename = os.path.join(str(tmpdir), 'reports.sqlite')
+    reports = ReportDatabase(filename, batch_size=2, commit_interval=60)
+    assert not reports.commit_due()
+    reports.add('/work/node', 'wf.node', 'pre\n')
+    assert not reports.commit_due()
+    reports.add('/work/other', 'wf.other', 'other\n')
+    assert reports.commit_due()
+    reports.commit()
+    reports.add('/work/node', 'wf.node', 'rerun\n')
+    reports.commit_interval = 0
+    assert reports.commit_due()
+
+    # a forked process does not share the sections of its parent
+    shared = reportdb.get_report_database(filename)
+    assert reportdb.get_report_database(filename) is shared
+    shared.add('/work/node', 'wf.node', 'shared\n')
+    monkeypatch.setattr(reportdb.os, 'getpid', lambda: -1)
+    assert reportdb.get_report_database(filename) is not shared
+    monkeypatch.undo()
+    reportdb.commit_reports()
+    assert shared.report('/work/node') == 'shared\n'
+
+
+def test_background_writer_errors(tmpdir):
+    written = []
+    writer = BackgroundWriter()
+    writer.submit(open, os.path.join(str(tmpdir), 'missing', 'file'), 'w')
+    writer.submit(written.append, 1)
+    writer.flush()
+    # a failed write does not stop the writer
+    assert written == [1]
+
+
+@pytest.mark.parametrize('report_async', [True, False])
+def test_report_database_workflow(tmpdir, report_async):
+    wf = pe.Workflow(name='reported', base_dir=str(tmpdir))
+    wf.config['execution'] = {'report_database': True,
+                              'report_async': report_async}
+    source = pe.Node(Function(input_names=['x'], output_names=['y'],
+                              function=add_one), name='source')
+    source.inputs.x = 1
+    mapped = pe.MapNode(Function(input_names=['x'], output_names=['y'],
+                                 function=add_one),
+                        iterfield=['x'], name='mapped')
+    mapped.inputs.x = [1, 2]
+    wf.add_nodes([source, mapped])
+    wf.run()
+
+    reports = ReportDatabase(str(tmpdir.join('reported', '_reports.sqlite')))
+    outdirs = [outdir for outdir, _ in reports.nodes()]
+    assert len(outdirs) == 4
+    source_report = reports.report(str(tmpdir.join('reported', 'source')))
+    assert 'Execution Outputs' in source_report
+    mapped_dir = tmpdir.join('reported', 'mapped')
+    assert 'Subnode reports' in reports.report(str(mapped_dir))
+    assert reports.report(str(mapped_dir.join('mapflow', '_mapped1')))
+    assert not tmpdir.join('reported', 'source', '_report').check()
+
+
+def test_report_verbosity(tmpdir):
+    node = pe.Node(Counter(args='10', terminal_output='stream'),
+                   name='counting', base_dir=str(tmpdir))
+    node.config = {'execution': {'report_environ': False,
+                                 'report_output_lines': 3}}
+    node.run()
+    report = tmpdir.join('counting', '_report', 'report.rst').read()
+    assert 'Environment' not in report
+    output = report.split('Terminal output')[1].splitlines()
+    assert 'lines omitted)' in output[3]
+    assert len([line for line in output if 'stdout' in line]) == 3
@@ -16,6 +16,7 @@ from ....interfaces import base as nib
 from ....interfaces import utility as niu
 from .... import config
 from ..utils import merge_dict, clean_working_directory, write_workflow_prov
+from ....utils.filemanip import loadpkl
 
 
 def test_identitynode_removal():
@@ -389,3 +390,117 @@ def test_mapnode_crash3(tmpdir):
     wf.base_dir = str(tmpdir)
     with pytest.raises(RuntimeError):
         wf.run(plugin='Linear')
+
+
+def shared_offset(crash):
+    if crash:
+        raise RuntimeError('shared node crashed')
+    return 10
+
+
+def add_offset(subject, offset):
+    return subject + offset
+
+
+def scale(value, session):
+    return value * session
+
+
+def total(values):
+    return sum(values)
+
+
+def create_study_wf(name, base_dir, crash=False, join_subjects=False):
+    wf = pe.Workflow(name=name, base_dir=base_dir)
+    shared = pe.Node(niu.Function(input_names=['crash'],
+                                  output_names=['offset'],
+                                  function=shared_offset),
+                     name='shared')
+    shared.inputs.crash = crash
+    subjects = pe.Node(niu.IdentityInterface(fields=['subject']),
+                       name='subjects')
+    subjects.iterables = ('subject', [1, 2, 3])
+    sessions = pe.Node(niu.IdentityInterface(fields=['session']),
+                       name='sessions')
+    sessions.iterables = ('session', [1, 2])
+    offset = pe.Node(niu.Function(input_names=['subject', 'offset'],
+                                  output_names=['value'],
+                                  function=add_offset),
+                     name='offset')
+    scaled = pe.Node(niu.Function(input_names=['value', 'session'],
+                                  output_names=['value'], function=scale),
+                     name='scale')
+    summary = pe.JoinNode(niu.Function(input_names=['values'],
+                                       output_names=['total'],
+                                       function=total),
+                          joinsource='subjects' if join_subjects else 'sessions',
+                          joinfield=['values'], name='total')
+    wf.connect([(subjects, offset, [('subject', 'subject')]),
+                (shared, offset, [('offset', 'offset')]),
+                (offset, scaled, [('value', 'value')]),
+                (sessions, scaled, [('session', 'session')]),
+                (scaled, summary, [('value', 'values')])])
+    return wf
+
+
+def _result_dirs(base_dir):
+    return sorted(os.path.relpath(root, base_dir)
+                  for root, _, files in os.walk(base_dir)
+                  if any(f.startswith('result_') for f in files))
+
+
+@pytest.mark.parametrize('plugin', ['Linear', 'MultiProc', 'AsyncMultiProc'])
+def test_stream_expansion(tmpdir, plugin):
+    plugin_args = {'n_procs': 2} if 'MultiProc' in plugin else None
+    full_dir = tmpdir.mkdir('full').strpath
+    create_study_wf('study', full_dir).run(plugin=plugin,
+                                           plugin_args=plugin_args)
+
+    stream_dir = tmpdir.mkdir('stream').strpath
+    wf = create_study_wf('study', stream_dir)
+    wf.config['execution'] = {'stream_expansion': True,
+                              'poll_sleep_duration': 0.1}
+    execgraph = wf.run(plugin=plugin, plugin_args=plugin_args)
+    # only the shared node is returned
+    assert [node.name for node in execgraph.nodes()] == ['shared']
+    assert _result_dirs(stream_dir) == _result_dirs(full_dir)
+    totals = [loadpkl(os.path.join(stream_dir, 'study', d, 'total',
+                                   'result_total.pklz'))
+              for d in ['_subject_1', '_subject_2', '_subject_3']]
+    assert [res.outputs.total for res in totals] == [33, 36, 39]
+
+
+@pytest.mark.parametrize('plugin', ['MultiProc', 'AsyncMultiProc'])
+def test_stream_expansion_rerun(tmpdir, plugin):
+    wf = create_study_wf('study', tmpdir.strpath)
+    wf.config['execution'] = {'stream_expansion': True,
+                              'poll_sleep_duration': 0.1}
+    wf.run(plugin=plugin, plugin_args={'n_procs': 2})
+    results = _result_dirs(tmpdir.strpath)
+    # every node of every branch is found up to date
+    wf.run(plugin=plugin, plugin_args={'n_procs': 2})
+    assert _result_dirs(tmpdir.strpath) == results
+
+
+def test_stream_expansion_fallback():
+    wf = create_study_wf('study', None, join_subjects=True)
+    assert pe.utils.generate_expanded_subgraphs(
+        deepcopy(wf._create_flat_graph())) is None
+    wf = create_study_wf('study', None)
+    graph, subgraphs = pe.utils.generate_expanded_subgraphs(
+        deepcopy(wf._create_flat_graph()))
+    assert graph.number_of_nodes() == 1
+    # the shared node, and the nodes of the 2 sessions of a subject
+    assert [sub.number_of_nodes() for sub in subgraphs] == [5, 5, 5]
+
+
+@pytest.mark.parametrize('plugin', ['Linear', 'MultiProc'])
+def test_stream_expansion_shared_crash(tmpdir, plugin):
+    wf = create_study_wf('study', tmpdir.strpath, crash=True)
+    wf.config['execution'] = {'stream_expansion': True,
+                              'poll_sleep_duration': 0.1,
+                              'crashdump_dir': tmpdir.strpath}
+    with pytest.raises(RuntimeError):
+        wf.run(plugin=plugin)
+    # no branch node ran
+    assert _result_dirs(tmpdir.strpath) == ['study/shared']
@@ -10,9 +10,11 @@ from builtins import str, open, map, next, zip, range
 import sys
 from future import standard_library
 standard_library.install_aliases()
+from bisect import bisect_left
 from collections import defaultdict
 
 from copy import deepcopy
+from fnmatch import fnmatch
 from glob import glob
 try:
     from inspect import signature
@@ -483,24 +485,20 @@ def _merge_graphs(supergraph, nodes, subgraph, nodeid, iterables,
     """
     # Retrieve edge information connecting nodes of the subgraph to other
     # nodes of the supergraph.
-    supernodes = supergraph.nodes()
-    ids = [n._hierarchy + n._id for n in supernodes]
-    if len(np.unique(ids)) != len(ids):
+    ids = set(n._hierarchy + n._id for n in supergraph.nodes_iter())
+    if len(ids) != supergraph.number_of_nodes():
         # This should trap the problem of miswiring when multiple iterables are
         # used at the same level. The use of the template below for naming
         # updates to nodes is the general solution.
         raise Exception(("Execution graph does not have a unique set of node "
                          "names. Please rerun the workflow"))
     edgeinfo = {}
-    for n in subgraph.nodes():
-        nidx = ids.index(n._hierarchy + n._id)
-        for edge in supergraph.in_edges_iter(supernodes[nidx]):
-                # make sure edge is not part of subgraph
-            if edge[0] not in subgraph.nodes():
-                if n._hierarchy + n._id not in list(edgeinfo.keys()):
-                    edgeinfo[n._hierarchy + n._id] = []
-                edgeinfo[n._hierarchy + n._id].append((edge[0],
-                                                       supergraph.get_edge_data(*edge)))
+    for n in subgraph.nodes_iter():
+        for edge in supergraph.in_edges_iter(n):
+            # make sure edge is not part of subgraph
+            if edge[0] not in subgraph:
+                edgeinfo.setdefault(n._hierarchy + n._id, []).append(
+                    (edge[0], supergraph.get_edge_data(*edge)))
     supergraph.remove_nodes_from(nodes)
     # Add copies of the subgraph depending on the number of iterables
     iterable_params = expand_iterables(iterables, synchronize)
@@ -510,12 +508,19 @@ def _merge_graphs(supergraph, nodes, subgraph, nodeid, iterables,
     # Make an iterable subgraph node id template
     count = len(iterable_params)
     template = '.%s%%0%dd' % (prefix, np.ceil(np.log10(count)))
+    # The subgraph structure is the same in every copy: find the root node
+    # and the node levels once
+    subnodes = subgraph.nodes()
+    subedges = subgraph.edges(data=True)
+    rootidx = [n._hierarchy + n._id for n in subnodes].index(nodeid)
+    levels = get_levels(subgraph)
     # Copy the iterable subgraphs
     for i, params in enumerate(iterable_params):
-        Gc = deepcopy(subgraph)
-        ids = [n._hierarchy + n._id for n in Gc.nodes()]
-        nodeidx = ids.index(nodeid)
-        rootnode = Gc.nodes()[nodeidx]
+        # copy the nodes and edges sharing a memo, as a deepcopy of the
+        # subgraph would, without copying the graph structure itself
+        memo = {}
+        copies = dict((n, deepcopy(n, memo)) for n in subnodes)
+        rootnode = copies[subnodes[rootidx]]
         paramstr = ''
         for key, val in sorted(params.items()):
             paramstr = '{}_{}_{}'.format(
@@ -523,8 +528,7 @@ def _merge_graphs(supergraph, nodes, subgraph, nodeid, iterables,
             rootnode.set_input(key, val)
 
         logger.debug('Parameterization: paramstr=%s', paramstr)
-        levels = get_levels(Gc)
-        for n in Gc.nodes():
+        for orig, n in list(copies.items()):
             """
             update parameterization of the node to reflect the location of
             the output directory.  For example, if the iterables along a
@@ -533,7 +537,7 @@ def _merge_graphs(supergraph, nodes, subgraph, nodeid, iterables,
             with iterable 'b' will be placed in a directory
             _a_aval/_b_bval/.
             """
-            path_length = levels[n]
+            path_length = levels[orig]
             # enter as negative numbers so that earlier iterables with longer
             # path lengths get precedence in a sort
             paramlist = [(-path_length, paramstr)]
@@ -541,12 +545,12 @@ def _merge_graphs(supergraph, nodes, subgraph, nodeid, iterables,
                 n.parameterization = paramlist + n.parameterization
             else:
                 n.parameterization = paramlist
-        supergraph.add_nodes_from(Gc.nodes())
-        supergraph.add_edges_from(Gc.edges(data=True))
-        for node in Gc.nodes():
-            if node._hierarchy + node._id in list(edgeinfo.keys()):
-                for info in edgeinfo[node._hierarchy + node._id]:
-                    supergraph.add_edges_from([(info[0], node, info[1])])
+        supergraph.add_nodes_from(copies.values())
+        supergraph.add_edges_from((copies[u], copies[v], deepcopy(d, memo))
+                                  for u, v, d in subedges)
+        for node in copies.values():
+            for info in edgeinfo.get(node._hierarchy + node._id, []):
+                supergraph.add_edges_from([(info[0], node, info[1])])
             node._id += template % i
     return supergraph
 
@@ -698,10 +702,9 @@ def generate_expanded_graph(graph_in):
         logger.debug("Expanding the iterable node %s..." % inode)
 
         # the join successor nodes of the current iterable node
-        jnodes = [node for node in graph_in.nodes_iter()
+        jnodes = [node for node in dfs_preorder(graph_in, inode)
                   if hasattr(node, 'joinsource') and
-                  inode.name == node.joinsource and
-                  nx.has_path(graph_in, inode, node)]
+                  inode.name == node.joinsource]
 
         # excise the join in-edges. save the excised edges in a
         # {jnode: {source name: (destination name, edge data)}}
@@ -727,9 +730,8 @@ def generate_expanded_graph(graph_in):
                 src_fields = [src_fields]
             # find the unique iterable source node in the graph
             try:
-                iter_src = next((node for node in graph_in.nodes_iter()
-                                 if node.name == src_name and
-                                 nx.has_path(graph_in, node, inode)))
+                iter_src = next((node for node in nx.ancestors(graph_in, inode)
+                                 if node.name == src_name))
             except StopIteration:
                 raise ValueError("The node %s itersource %s was not found"
                                  " among the iterable predecessor nodes"
@@ -788,16 +790,14 @@ def generate_expanded_graph(graph_in):
                                  iterables, iterable_prefix, inode.synchronize)
 
         # reconnect the join nodes
+        if jnodes:
+            itername_index = _IternameIndex(graph_in.nodes_iter())
         for jnode in jnodes:
             # the {node id: edge data} dictionary for edges connecting
             # to the join node in the unexpanded graph
             old_edge_dict = jedge_dict[jnode]
             # the edge source node replicates
-            expansions = defaultdict(list)
-            for node in graph_in.nodes_iter():
-                for src_id, edge_data in list(old_edge_dict.items()):
-                    if node.itername.startswith(src_id):
-                        expansions[src_id].append(node)
+            expansions = itername_index.find_prefixes(old_edge_dict)
             for in_id, in_nodes in list(expansions.items()):
                 logger.debug("The join node %s input %s was expanded"
                              " to %d nodes." % (jnode, in_id, len(in_nodes)))
@@ -860,6 +860,133 @@ def generate_expanded_graph(graph_in):
     return _remove_nonjoin_identity_nodes(graph_in)
 
 
+def generate_expanded_subgraphs(graph_in):
+    """Expands the iterables of a graph one branch at a time
+
+    The graph is split at the root iterable node with the most values (e.g.,
+    the node iterating over the subjects) whose branches are independent:
+    no join node collects its values, and the only other iterable nodes
+    feeding its descendants are identity nodes feeding nothing else (e.g.,
+    the node iterating over the sessions), which are then replicated in
+    each branch. The nodes that do not descend from it are expanded
+    immediately, while the branch of each of its values is only expanded
+    when requested, so that the execution of the first branches can start
+    before the last ones are built, and so that branches can be released
+    once they have run.
+
+    The nodes of the branches have the same output directories as they would
+    in the graph expanded by :func:`generate_expanded_graph`, but the
+    identifiers of the nodes replicated by other iterables may differ.
+
+    Returns
+    -------
+    None if the graph cannot be split, otherwise a (graph, subgraphs) tuple,
+    where graph is the expanded graph of the nodes shared by all branches and
+    subgraphs generates the expanded graph of each branch. A branch graph
+    also contains the shared nodes its nodes are connected to.
+    """
+    logger.debug("PE: expanding iterables by branch")
+    graph_in = _remove_nonjoin_identity_nodes(graph_in, keep_iterables=True)
+    split = _branch_node(graph_in)
+    if split is None:
+        return None
+    snode, iterables, branch = split
+    logger.debug("Expanding the branches of the iterable node %s" % snode)
+    in_edges = [(src, dest, data) for dest in branch
+                for src, _, data in graph_in.in_edges_iter(dest, data=True)]
+    params = expand_iterables(iterables, snode.synchronize)
+    graph_out = generate_expanded_graph(graph_in.subgraph(
+        [node for node in graph_in.nodes_iter() if node not in branch]))
+
+    def make_field_func(value):
+        return lambda: [value]
+
+    def subgraphs():
+        for values in params:
+            # copy the branch, keeping its connections to the shared nodes
+            memo = {}
+            copies = dict((node, deepcopy(node, memo)) for node in branch)
+            subgraph = nx.DiGraph()
+            subgraph.add_nodes_from(copies.values())
+            for src, dest, data in in_edges:
+                subgraph.add_edge(copies.get(src, src), copies[dest],
+                                  deepcopy(data, memo))
+            root = copies[snode]
+            root.iterables = dict((field, make_field_func(value))
+                                  for field, value in list(values.items()))
+            root.synchronize = False
+            yield generate_expanded_graph(subgraph)
+
+    return graph_out, subgraphs()
+
+
+def _branch_node(graph_in):
+    """Returns the (node, standardized iterables, branch nodes) of the root
+    iterable node whose branches can be expanded independently, or None"""
+    joinsources = set(getattr(node, 'joinsource', None)
+                      for node in graph_in.nodes_iter())
+    inodes = [node for node in graph_in.nodes_iter()
+              if node.iterables is not None]
+    split = None
+    best_count = 1
+    for node in inodes:
+        if (node.itersource or graph_in.in_degree(node) or
+                node.name in joinsources):
+            continue
+        # standardize a copy, the graph expansion standardizes the original
+        iterables = node.iterables
+        _standardize_iterables(node)
+        iterables, node.iterables = node.iterables, iterables
+        count = count_iterables(iterables, node.synchronize)
+        if count <= best_count:
+            continue
+        branch = set(dfs_preorder(graph_in, node))
+        # other iterable nodes feeding the branch, e.g. a session
+        # identity source, are replicated in every branch, provided they
+        # do not feed any other node
+        feeders = set()
+        for other in inodes:
+            if other in branch:
+                continue
+            reached = set(dfs_preorder(graph_in, other))
+            reached.discard(other)
+            if reached.isdisjoint(branch):
+                continue
+            if (not isinstance(other._interface, IdentityInterface) or
+                    not reached <= branch):
+                break
+            feeders.add(other)
+        else:
+            split = (node, iterables, branch | feeders)
+            best_count = count
+    return split
+
+
+class _IternameIndex(object):
+    """Sorted index of node iternames, to find the replicates of a node,
+    i.e. the nodes whose itername starts with its itername, without
+    scanning the whole graph for every node"""
+
+    def __init__(self, nodes):
+        items = sorted((node.itername, idx, node)
+                       for idx, node in enumerate(nodes))
+        self._names = [name for name, _, _ in items]
+        self._nodes = [node for _, _, node in items]
+
+    def find_prefixes(self, prefixes):
+        """Return the {prefix: nodes} dictionary of the nodes whose itername
+        starts with each of the given prefixes"""
+        matches = {}
+        for prefix in prefixes:
+            start = end = bisect_left(self._names, prefix)
+            while end < len(self._names) and \
+                    self._names[end].startswith(prefix):
+                end += 1
+            if end > start:
+                matches[prefix] = self._nodes[start:end]
+        return matches
+
+
 def _iterable_nodes(graph_in):
     """Returns the iterable nodes in the given graph and their join
     dependencies.
@@ -1139,7 +1266,8 @@ def clean_working_directory(outputs, cwd, inputs, needed_outputs, config,
         input_files.extend(walk_outputs(inputdict))
         needed_files += [path for path, type in input_files if type == 'f']
     for extra in ['_0x*.json', 'provenance.*', 'pyscript*.m', 'pyjobs*.mat',
-                  'command.txt', 'result*.pklz', '_inputs.pklz', '_node.pklz']:
+                  'command.txt', 'result*.pklz', '_inputs.pklz', '_node.pklz',
+                  '_profile_*']:
         needed_files.extend(glob(os.path.join(cwd, extra)))
     if files2keep:
         needed_files.extend(filename_to_list(files2keep))
@@ -1157,6 +1285,9 @@ def clean_working_directory(outputs, cwd, inputs, needed_outputs, config,
     files2remove = []
     if str2bool(config['execution']['remove_unnecessary_outputs']):
         for f in walk_files(cwd):
+            # provenance files may still be written in the background
+            if fnmatch(os.path.basename(f), 'provenance.*'):
+                continue
             if f not in needed_files:
                 if len(needed_dirs) == 0:
                     files2remove.append(f)
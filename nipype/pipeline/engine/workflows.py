@@ -22,6 +22,10 @@ from future import standard_library
 standard_library.install_aliases()
 
 from datetime import datetime
+try:
+    from inspect import signature
+except ImportError:
+    from funcsigs import signature
 
 from copy import deepcopy
 import pickle
@@ -43,19 +47,24 @@ from ...interfaces.base import (traits, InputMultiPath, CommandLine,
                                 Bunch, InterfaceResult, md5, Interface,
                                 TraitDictObject, TraitListObject, isdefined)
 
+from ...utils.asyncwriter import flush_writes
+from ...utils.tracing import (configure as configure_tracing, merge_trace,
+                              reset_trace)
 from ...utils.filemanip import (save_json, FileNotFoundError,
                                 filename_to_list, list_to_filename,
                                 copyfiles, fnames_presuffix, loadpkl,
                                 split_filename, load_json, savepkl,
                                 write_rst_header, write_rst_dict,
                                 write_rst_list, to_str)
-from .utils import (generate_expanded_graph, modify_paths,
+from .utils import (generate_expanded_graph, generate_expanded_subgraphs,
+                    modify_paths,
                     export_graph, make_output_dir, write_workflow_prov,
                     clean_working_directory, format_dot, topological_sort,
                     get_print_name, merge_dict, evaluate_connect_function,
                     _write_inputs, format_node)
 
 from .base import EngineBase
+from .reportdb import commit_reports
 from .nodes import Node, MapNode
 
 package_check('networkx', '1.3')
@@ -577,17 +586,47 @@ connected.
             del self.config['crashdump_dir']
         logger.info('Workflow %s settings: %s', self.name, to_str(sorted(self.config)))
         self._set_needed_outputs(flatgraph)
-        execgraph = generate_expanded_graph(deepcopy(flatgraph))
-        for index, node in enumerate(execgraph.nodes()):
-            node.config = merge_dict(deepcopy(self.config), node.config)
-            node.base_dir = self.base_dir
-            node.index = index
-            if isinstance(node, MapNode):
-                node.use_plugin = (plugin, plugin_args)
-        self._configure_exec_nodes(execgraph)
+        expanded = None
+        if str2bool(self.config['execution']['stream_expansion']):
+            if 'subgraphs' in signature(runner.run).parameters:
+                expanded = generate_expanded_subgraphs(deepcopy(flatgraph))
+                if expanded is None:
+                    logger.info('Workflow %s has no independent iterable '
+                                'branches, expanding it at once', self.name)
+            else:
+                logger.info('Plugin %s cannot run expanded branches, '
+                            'expanding workflow %s at once',
+                            runner.__class__.__name__, self.name)
+        if expanded is None:
+            execgraph = generate_expanded_graph(deepcopy(flatgraph))
+            subgraphs = None
+        else:
+            execgraph, subgraphs = expanded
+        # nodes without config overrides share a single copy of the workflow
+        # config, which must therefore be treated as read-only
+        exec_config = deepcopy(self.config)
+        trace_file = self._start_trace(exec_config)
+        self._configure_new_exec_nodes(execgraph, execgraph.nodes(), 0,
+                                       exec_config, plugin, plugin_args)
         if str2bool(self.config['execution']['create_report']):
             self._write_report_info(self.base_dir, self.name, execgraph)
-        runner.run(execgraph, updatehash=updatehash, config=self.config)
+        try:
+            if subgraphs is None:
+                runner.run(execgraph, updatehash=updatehash,
+                           config=self.config)
+            else:
+                subgraphs = self._configure_subgraphs(
+                    subgraphs, set(execgraph.nodes()), exec_config, plugin,
+                    plugin_args)
+                runner.run(execgraph, updatehash=updatehash,
+                           config=self.config, subgraphs=subgraphs)
+        finally:
+            if trace_file is not None:
+                logger.info('Trace file: %s', merge_trace(trace_file))
+                configure_tracing({})
+        # reports of the nodes run by this process may still be queued
+        flush_writes()
+        commit_reports()
         datestr = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
         if str2bool(self.config['execution']['write_provenance']):
             prov_base = op.join(self.base_dir,
@@ -598,6 +637,23 @@ connected.
 
     # PRIVATE API AND FUNCTIONS
 
+    def _start_trace(self, exec_config):
+        """Start tracing the execution if enabled, and return the trace
+        file, by default in the working directory of the workflow"""
+        monitoring = exec_config.get('monitoring', {})
+        if not str2bool(monitoring.get('trace', False)):
+            configure_tracing(exec_config)
+            return None
+        if not monitoring.get('trace_file'):
+            workingdir = self.base_dir or os.getcwd()
+            monitoring['trace_file'] = op.join(workingdir, self.name,
+                                               'trace.json')
+        trace_file = op.abspath(monitoring['trace_file'])
+        monitoring['trace_file'] = trace_file
+        reset_trace(trace_file)
+        configure_tracing(exec_config)
+        return trace_file
+
     def _write_report_info(self, workingdir, name, graph):
         if workingdir is None:
             workingdir = os.getcwd()
@@ -678,18 +734,51 @@ connected.
             if node.needed_outputs:
                 node.needed_outputs = sorted(node.needed_outputs)
 
-    def _configure_exec_nodes(self, graph):
+    def _configure_new_exec_nodes(self, graph, nodes, index, exec_config,
+                                  plugin, plugin_args):
+        """Set the execution configuration of the given nodes of a graph,
+        numbering them from index
+        """
+        for node in nodes:
+            if node.config is None:
+                node.config = exec_config
+            else:
+                node.config = merge_dict(exec_config, node.config)
+            node.base_dir = self.base_dir
+            node.index = index
+            index += 1
+            if isinstance(node, MapNode):
+                node.use_plugin = (plugin, plugin_args)
+        self._configure_exec_nodes(graph, nodes)
+        return index
+
+    def _configure_subgraphs(self, subgraphs, basenodes, exec_config, plugin,
+                             plugin_args):
+        """Configure the nodes of each expanded branch as they are generated
+        """
+        index = len(basenodes)
+        for subgraph in subgraphs:
+            nodes = [node for node in subgraph.nodes_iter()
+                     if node not in basenodes]
+            index = self._configure_new_exec_nodes(subgraph, nodes, index,
+                                                   exec_config, plugin,
+                                                   plugin_args)
+            yield subgraph
+
+    def _configure_exec_nodes(self, graph, nodes=None):
         """Ensure that each node knows where to get inputs from
         """
-        for node in graph.nodes():
+        if nodes is None:
+            nodes = graph.nodes()
+        for node in nodes:
             node.input_source = {}
             for edge in graph.in_edges_iter(node):
                 data = graph.get_edge_data(*edge)
+                # all the fields of an edge share the result file name
+                resultfile = op.join(edge[0].output_dir(),
+                                     'result_%s.pklz' % edge[0].name)
                 for sourceinfo, field in data['connect']:
-                    node.input_source[field] = \
-                        (op.join(edge[0].output_dir(),
-                                 'result_%s.pklz' % edge[0].name),
-                         sourceinfo)
+                    node.input_source[field] = (resultfile, sourceinfo)
 
     def _check_nodes(self, nodes):
         """Checks if any of the nodes are already in the graph
@@ -2,22 +2,31 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
-from .debug import DebugPlugin
-from .linear import LinearPlugin
-from .ipythonx import IPythonXPlugin
-from .pbs import PBSPlugin
-from .oar import OARPlugin
-from .sge import SGEPlugin
-from .condor import CondorPlugin
-from .dagman import CondorDAGManPlugin
-from .multiproc import MultiProcPlugin
-from .ipython import IPythonPlugin
-from .somaflow import SomaFlowPlugin
-from .pbsgraph import PBSGraphPlugin
-from .sgegraph import SGEGraphPlugin
-from .lsf import LSFPlugin
-from .slurm import SLURMPlugin
-from .slurmgraph import SLURMGraphPlugin
+from __future__ import absolute_import
 
-from .callback_log import log_nodes_cb
-from . import  semaphore_singleton
+from ...utils.lazy import lazy_attributes
+
+# plugin modules are imported when their plugin is first used
+lazy_attributes(__name__, {
+    'DebugPlugin': ('.debug', 'DebugPlugin'),
+    'LinearPlugin': ('.linear', 'LinearPlugin'),
+    'IPythonXPlugin': ('.ipythonx', 'IPythonXPlugin'),
+    'PBSPlugin': ('.pbs', 'PBSPlugin'),
+    'OARPlugin': ('.oar', 'OARPlugin'),
+    'SGEPlugin': ('.sge', 'SGEPlugin'),
+    'CondorPlugin': ('.condor', 'CondorPlugin'),
+    'CondorDAGManPlugin': ('.dagman', 'CondorDAGManPlugin'),
+    'MultiProcPlugin': ('.multiproc', 'MultiProcPlugin'),
+    'AsyncMultiProcPlugin': ('.asyncmultiproc', 'AsyncMultiProcPlugin'),
+    'IPythonPlugin': ('.ipython', 'IPythonPlugin'),
+    'SomaFlowPlugin': ('.somaflow', 'SomaFlowPlugin'),
+    'PBSGraphPlugin': ('.pbsgraph', 'PBSGraphPlugin'),
+    'SGEGraphPlugin': ('.sgegraph', 'SGEGraphPlugin'),
+    'LSFPlugin': ('.lsf', 'LSFPlugin'),
+    'SLURMPlugin': ('.slurm', 'SLURMPlugin'),
+    'SLURMGraphPlugin': ('.slurmgraph', 'SLURMGraphPlugin'),
+    'PilotPlugin': ('.pilot', 'PilotPlugin'),
+    'log_nodes_cb': ('.callback_log', 'log_nodes_cb'),
+    'ExecutionLog': ('.callback_log', 'ExecutionLog'),
+    'semaphore_singleton': ('.semaphore_singleton', None),
+})
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Completion-driven parallel workflow execution via concurrent.futures
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+from future import standard_library
+standard_library.install_aliases()
+
+from queue import Queue, Empty
+from traceback import format_exception, format_exc
+import sys
+
+futures_not_loaded = False
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    futures_not_loaded = True
+
+from ...utils.metrics import NULL_METRICS, start_metrics
+from .base import logger, report_nodes_not_run
+from .multiproc import MultiProcPlugin
+
+
+class AsyncMultiProcPlugin(MultiProcPlugin):
+    """Execute workflow with a process pool, releasing the dependents of a
+    node as soon as it finishes.
+
+    Instead of waking up periodically and querying every pending task, the
+    scheduler blocks until a worker reports a finished node, harvests it,
+    and immediately submits whatever became ready. This removes the
+    polling latency between short, dependent nodes.
+
+    Supports the same options as the MultiProc plugin (``n_procs``,
+    ``memory_gb``, ``ship_nodes_by_file``, ``scheduler``,
+    ``default_runtime``), except ``non_daemon``: workers
+    of a ``concurrent.futures`` process pool can always start child
+    processes. Requires the ``futures`` backport on Python 2.
+
+    """
+
+    def __init__(self, plugin_args=None):
+        if futures_not_loaded:
+            raise ImportError('Please install futures to use this plugin.')
+        self._completed = Queue()
+        super(AsyncMultiProcPlugin, self).__init__(plugin_args=plugin_args)
+
+    def _create_pool(self, non_daemon):
+        return ProcessPoolExecutor(max_workers=self.processors)
+
+    def run(self, graph, config, updatehash=False, subgraphs=None):
+        """Executes a pre-defined pipeline, submitting nodes as soon as their
+        dependencies complete
+        """
+        logger.info("Running in parallel.")
+        self._config = config
+        self._results_cache.clear()
+        self._ready_times = {}
+        self._estimated = set()
+        self._metrics = start_metrics(config)
+        self._generate_dependency_list(graph)
+        graph = self._start_subgraphs(graph, subgraphs)
+        self.pending_tasks = []
+        self.mapnodes = []
+        self.mapnodesubids = {}
+        notrun = []
+        while True:
+            self._pull_subgraphs(graph, notrun)
+            self._send_procs_to_workers(updatehash=updatehash, graph=graph)
+            if not self.pending_tasks:
+                if (self._subgraphs is None or
+                        self._peek_ready() is not None):
+                    break
+                # the pulled branches finished without submitting any task
+                # (up to date, run without submitting or crashed)
+                continue
+            self._update_metrics()
+            jobids = dict(self.pending_tasks)
+            for taskid in self._wait_completed():
+                self._harvest(taskid, jobids[taskid], graph, notrun)
+
+        jobid = self._peek_ready()
+        if jobid is not None:
+            raise RuntimeError(
+                'Resources required by node %s (%f GB, %d threads) exceed what '
+                'is available (%f GB, %d threads)' % (
+                    self.procs[jobid]._id,
+                    self.procs[jobid]._interface.estimated_memory_gb,
+                    self._job_threads(jobid),
+                    self.memory_gb, self.processors))
+        self._remove_node_dirs()
+        report_nodes_not_run(notrun)
+
+        # close any open resources
+        self._close()
+        self._update_metrics()
+        self._metrics.close()
+        self._metrics = NULL_METRICS
+
+    def _wait_completed(self):
+        """Block until at least one task completes and return the ids of all
+        the tasks completed so far"""
+        taskids = [self._completed.get()]
+        while True:
+            try:
+                taskids.append(self._completed.get_nowait())
+            except Empty:
+                break
+        return taskids
+
+    def _harvest(self, taskid, jobid, graph, notrun):
+        """Process the result of a completed task"""
+        self.pending_tasks.remove((taskid, jobid))
+        try:
+            with self._metrics.timer('nipype_result_load_seconds'):
+                result = self._get_result(taskid)
+            if result['traceback']:
+                notrun.append(self._clean_queue(jobid, graph, result=result))
+            else:
+                self._task_finished_cb(jobid, result=result['result'])
+                self._remove_node_dirs()
+            self._clear_task(taskid)
+        except Exception:
+            result = {'result': None,
+                      'traceback': format_exc()}
+            notrun.append(self._clean_queue(jobid, graph, result=result))
+
+    def _get_result(self, taskid):
+        future = self._task_obj[taskid]
+        try:
+            return future.result()
+        except Exception:
+            etype, eval, etr = sys.exc_info()
+            return dict(result=None, taskid=taskid,
+                        traceback=format_exception(etype, eval, etr))
+
+    def _submit_job(self, node, updatehash=False):
+        self._taskid += 1
+        taskid = self._taskid
+        func, args = self._task_args(node, updatehash)
+        future = self.pool.submit(func, *args)
+        self._task_obj[taskid] = future
+        future.add_done_callback(lambda _: self._completed.put(taskid))
+        return taskid
+
+    def _close(self):
+        self.pool.shutdown(wait=True)
+        self._remove_ship_dir()
+        return True
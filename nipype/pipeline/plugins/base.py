@@ -6,10 +6,13 @@
 from __future__ import print_function, division, unicode_literals, absolute_import
 from builtins import range, object, open
 
+from collections import OrderedDict
 from copy import deepcopy
 from glob import glob
+import math
 import os
 import getpass
+from heapq import heappush, heappop
 import shutil
 from socket import gethostname
 import sys
@@ -19,14 +22,16 @@ from traceback import format_exception, format_exc
 from warnings import warn
 
 import numpy as np
-import scipy.sparse as ssp
 
 
 from ... import logging
 from ...utils.filemanip import savepkl, loadpkl, crash2txt
-from ...utils.misc import str2bool
+from ...utils.misc import str2bool, interface_name
+from ...utils.metrics import NULL_METRICS, start_metrics
+from ...utils.tracing import span
 from ..engine.utils import (nx, dfs_preorder, topological_sort)
 from ..engine import MapNode
+from ..engine.history import get_runtime_history, input_size_class
 
 
 logger = logging.getLogger('workflow')
@@ -122,13 +127,8 @@ def create_pyscript(node, updatehash=False, store_exception=True):
     cmdstr = """import os
 import sys
 
-can_import_matplotlib = True #Silently allow matplotlib to be ignored
-try:
-    import matplotlib
-    matplotlib.use('%s')
-except ImportError:
-    can_import_matplotlib = False
-    pass
+# matplotlib is optional, and only imported by the nodes using it
+os.environ['MPLBACKEND'] = '%s'
 
 from nipype import config, logging
 from nipype.utils.filemanip import loadpkl, savepkl
@@ -137,15 +137,11 @@ from traceback import format_exception
 info = None
 pklfile = '%s'
 batchdir = '%s'
-from nipype.utils.filemanip import loadpkl, savepkl
 try:
     if not sys.version_info < (2, 7):
         from collections import OrderedDict
     config_dict=%s
     config.update_config(config_dict)
-    ## Only configure matplotlib if it was successfully imported, matplotlib is an optional component to nipype
-    if can_import_matplotlib:
-        config.update_matplotlib()
     logging.update_logging(config)
     traceback=None
     cwd = os.getcwd()
@@ -184,6 +180,107 @@ except Exception as e:
     return pyscript
 
 
+def create_bundle_script(pyscripts, bundlefile, procs=1, index_var=None):
+    """Write a python script running the pyscripts of a bundle of nodes
+
+    The nodes run one after the other in the same interpreter, so that
+    nipype is imported only once, or in a pool of ``procs`` processes. With
+    ``index_var``, the script is run by an array job and every task runs
+    the node selected by the (1-based) task index in that environment
+    variable.
+    """
+    cmdstr = """import os
+import sys
+from runpy import run_path
+from traceback import print_exc
+
+pyscripts = %s
+
+
+def run(pyscript):
+    try:
+        run_path(pyscript, run_name='__main__')
+    except Exception:
+        print_exc()
+
+
+if __name__ == '__main__':
+    index_var = %s
+    procs = %d
+    if index_var is not None:
+        pyscripts = [pyscripts[int(os.environ[index_var]) - 1]]
+    if procs > 1 and len(pyscripts) > 1:
+        # import nipype once, before the workers are started
+        import nipype
+        from multiprocessing import Pool
+        pool = Pool(min(procs, len(pyscripts)))
+        pool.map(run, pyscripts, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        for pyscript in pyscripts:
+            run(pyscript)
+""" % ('[%s]' % ', '.join("'%s'" % pyscript for pyscript in pyscripts),
+       "'%s'" % index_var if index_var else None, procs)
+    with open(bundlefile, 'wt') as fp:
+        fp.writelines(cmdstr)
+    return bundlefile
+
+
+class ResultsCache(object):
+    """Bounded LRU cache of the outputs of finished nodes
+
+    Entries are keyed on the results file of a node, which is how its
+    dependents refer to it in their ``input_source``. Outputs handed back by
+    the workers are added as nodes finish; outputs of nodes that were not
+    run by the plugin (e.g., whose hash already existed) are loaded from
+    their results file the first time a dependent needs them. Either way a
+    results file is read at most once while its outputs are cached, instead
+    of once per connected input.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def results_file(node):
+        return os.path.join(node.output_dir(), 'result_%s.pklz' % node.name)
+
+    def add(self, node, result):
+        """Cache the outputs of the result of a node that just finished"""
+        outputs = getattr(result, 'outputs', None)
+        if outputs is None:
+            return
+        # results files then hold relative paths, unlike results in memory
+        if str2bool(node.config['execution']['use_relative_paths']):
+            return
+        self._store(self.results_file(node), outputs)
+
+    def discard(self, node):
+        """Forget the outputs of a node no other node is waiting for"""
+        self._entries.pop(self.results_file(node), None)
+
+    def get_outputs(self, results_file):
+        """Return the outputs stored in a results file"""
+        outputs = self._entries.pop(results_file, None)
+        if outputs is None:
+            outputs = loadpkl(results_file, attr='outputs')
+        self._store(results_file, outputs)
+        return outputs
+
+    def clear(self):
+        self._entries.clear()
+
+    def _store(self, results_file, outputs):
+        if self.maxsize <= 0:
+            return
+        self._entries.pop(results_file, None)
+        self._entries[results_file] = outputs
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
 class PluginBase(object):
     """Base class for plugins"""
 
@@ -200,6 +297,16 @@ class PluginBase(object):
 
 class DistributedPluginBase(PluginBase):
     """Execute workflow with a distribution engine
+
+    The scheduler is event driven: every process keeps a counter of the
+    dependencies it is still waiting for, and processes whose counter drops
+    to zero are pushed onto a ready queue. Finishing a job only touches the
+    counters of its direct dependents, so the cost of a scheduling tick does
+    not grow with the size of the execution graph.
+
+    The inputs of a job are collected on the master through a
+    :class:`ResultsCache` of the outputs of finished jobs, whose size is set
+    with the ``results_cache_size`` plugin argument (0 disables it).
     """
 
     def __init__(self, plugin_args=None):
@@ -212,74 +319,147 @@ class DistributedPluginBase(PluginBase):
             process is currently running. Note: A process is finished only when
             both proc_done==True and
         proc_pending==False
-        depidx: a boolean matrix (NxN) storing the dependency structure accross
-            processes. Process dependencies are derived from each column.
+        depcount: an integer vector (N) with the number of unfinished
+            processes each process is waiting for
+        refcount: an integer vector (N) with the number of unfinished
+            processes consuming the outputs of each process of the original
+            graph
         """
         super(DistributedPluginBase, self).__init__(plugin_args=plugin_args)
         self.procs = None
-        self.depidx = None
-        self.refidx = None
+        self.depcount = None
+        self.refcount = None
         self.mapnodes = None
         self.mapnodesubids = None
         self.proc_done = None
         self.proc_pending = None
+        self._procidx = None
+        self._dependents = None
+        self._dependencies = None
+        self._ready = None
+        self._subgraphs = None
+        self._branches = None
+        self._crashed = None
+        self._ready_times = None
+        self._estimated = set()
+        self._metrics = NULL_METRICS
         self.max_jobs = np.inf
         if plugin_args and 'max_jobs' in plugin_args:
             self.max_jobs = plugin_args['max_jobs']
+        results_cache_size = 128
+        if plugin_args and 'results_cache_size' in plugin_args:
+            results_cache_size = int(plugin_args['results_cache_size'])
+        self._results_cache = ResultsCache(maxsize=results_cache_size)
 
-    def run(self, graph, config, updatehash=False):
+    def run(self, graph, config, updatehash=False, subgraphs=None):
         """Executes a pre-defined pipeline using distributed approaches
+
+        Parameters
+        ----------
+
+        graph : networkx digraph
+            the expanded execution graph
+        subgraphs : generator
+            optional generator of additional expanded graphs (see
+            :func:`~nipype.pipeline.engine.utils.generate_expanded_subgraphs`),
+            pulled whenever no job is ready to run
         """
         logger.info("Running in parallel.")
         self._config = config
+        self._results_cache.clear()
+        self._ready_times = {}
+        self._estimated = set()
+        self._metrics = start_metrics(config)
         # Generate appropriate structures for worker-manager model
         self._generate_dependency_list(graph)
+        graph = self._start_subgraphs(graph, subgraphs)
         self.pending_tasks = []
-        self.readytorun = []
         self.mapnodes = []
         self.mapnodesubids = {}
         # setup polling - TODO: change to threaded model
         notrun = []
         while np.any(self.proc_done == False) | \
-                np.any(self.proc_pending == True):
+                np.any(self.proc_pending == True) | \
+                (self._subgraphs is not None):
 
             toappend = []
             # trigger callbacks for any pending results
-            while self.pending_tasks:
-                taskid, jobid = self.pending_tasks.pop()
-                try:
-                    result = self._get_result(taskid)
-                    if result:
-                        if result['traceback']:
-                            notrun.append(self._clean_queue(jobid, graph,
-                                                            result=result))
+            with span('collect_results', category='scheduler'):
+                while self.pending_tasks:
+                    taskid, jobid = self.pending_tasks.pop()
+                    try:
+                        started = time()
+                        result = self._get_result(taskid)
+                        if result:
+                            self._metrics.observe('nipype_result_load_seconds',
+                                                  time() - started)
+                            if result['traceback']:
+                                notrun.append(self._clean_queue(
+                                    jobid, graph, result=result))
+                            else:
+                                self._task_finished_cb(
+                                    jobid, result=result['result'])
+                                self._remove_node_dirs()
+                            self._clear_task(taskid)
                         else:
-                            self._task_finished_cb(jobid)
-                            self._remove_node_dirs()
-                        self._clear_task(taskid)
-                    else:
-                        toappend.insert(0, (taskid, jobid))
-                except Exception:
-                    result = {'result': None,
-                              'traceback': format_exc()}
-                    notrun.append(self._clean_queue(jobid, graph,
-                                                    result=result))
+                            toappend.insert(0, (taskid, jobid))
+                    except Exception:
+                        result = {'result': None,
+                                  'traceback': format_exc()}
+                        notrun.append(self._clean_queue(jobid, graph,
+                                                        result=result))
             if toappend:
                 self.pending_tasks.extend(toappend)
+            with span('pull_subgraphs', category='scheduler'):
+                self._pull_subgraphs(graph, notrun)
             num_jobs = len(self.pending_tasks)
             logger.debug('Number of pending tasks: %d' % num_jobs)
             if num_jobs < self.max_jobs:
-                self._send_procs_to_workers(updatehash=updatehash,
-                                            graph=graph)
+                with span('send_procs_to_workers', category='scheduler'):
+                    self._send_procs_to_workers(updatehash=updatehash,
+                                                graph=graph)
             else:
                 logger.debug('Not submitting')
-            self._wait()
+            self._update_metrics()
+            with span('wait', category='scheduler'):
+                self._wait()
 
         self._remove_node_dirs()
         report_nodes_not_run(notrun)
 
         # close any open resources
         self._close()
+        self._update_metrics()
+        self._metrics.close()
+        self._metrics = NULL_METRICS
+
+    def _update_metrics(self):
+        """Update the gauges of the state of the nodes and write the
+        snapshot of the metrics, when they are enabled"""
+        metrics = self._metrics
+        if not metrics.enabled:
+            return
+        running = len(self.pending_tasks)
+        done = int(np.count_nonzero(self.proc_done & ~self.proc_pending))
+        ready = len(self._ready)
+        metrics.set('nipype_nodes_total', len(self.procs))
+        metrics.set('nipype_nodes_ready', ready)
+        metrics.set('nipype_nodes_running', running)
+        metrics.set('nipype_nodes_done', done)
+        metrics.set('nipype_nodes_waiting',
+                    max(len(self.procs) - done - running - ready, 0))
+        metrics.inc('nipype_scheduler_iterations_total')
+        metrics.set('nipype_scheduler_last_iteration_timestamp_seconds',
+                    time())
+        metrics.write()
+
+    def _observe_submission(self, jobid):
+        """Record the submission of a job in the metrics"""
+        self._metrics.inc('nipype_nodes_submitted_total')
+        ready_time = self._ready_times.pop(jobid, None)
+        if ready_time is not None:
+            self._metrics.observe('nipype_submission_latency_seconds',
+                                  time() - ready_time)
 
     def _wait(self):
         sleep(float(self._config['execution']['poll_sleep_duration']))
@@ -306,6 +486,8 @@ class DistributedPluginBase(PluginBase):
             raise RuntimeError("".join(result['traceback']))
         crashfile = self._report_crash(self.procs[jobid],
                                        result=result)
+        self._metrics.inc('nipype_nodes_failed_total')
+        self._ready_times.pop(jobid, None)
         if self._status_callback:
             self._status_callback(self.procs[jobid], 'exception')
         if jobid in self.mapnodesubids:
@@ -327,29 +509,103 @@ class DistributedPluginBase(PluginBase):
         numnodes = len(mapnodesubids)
         logger.info('Adding %d jobs for mapnode %s' % (numnodes,
                                                        self.procs[jobid]._id))
-        for i in range(numnodes):
-            self.mapnodesubids[self.depidx.shape[0] + i] = jobid
+        firstid = len(self.procs)
         self.procs.extend(mapnodesubids)
-        self.depidx = ssp.vstack((self.depidx,
-                                  ssp.lil_matrix(np.zeros(
-                                      (numnodes, self.depidx.shape[1])))),
-                                 'lil')
-        self.depidx = ssp.hstack((self.depidx,
-                                  ssp.lil_matrix(
-                                      np.zeros((self.depidx.shape[0],
-                                                numnodes)))),
-                                 'lil')
-        self.depidx[-numnodes:, jobid] = 1
         self.proc_done = np.concatenate((self.proc_done,
                                          np.zeros(numnodes, dtype=bool)))
         self.proc_pending = np.concatenate((self.proc_pending,
                                             np.zeros(numnodes, dtype=bool)))
+        self.depcount = np.concatenate((self.depcount,
+                                        np.zeros(numnodes, dtype=int)))
+        # the directories of subnodes are not tracked
+        self.refcount = np.concatenate((self.refcount,
+                                        -np.ones(numnodes, dtype=int)))
+        # the mapnode now waits for all of its subnodes
+        self.depcount[jobid] += numnodes
+        for subid in range(firstid, firstid + numnodes):
+            self.mapnodesubids[subid] = jobid
+            self._dependents[subid] = [jobid]
+            self._push_ready(subid)
         return False
 
+    def _ready_key(self, jobid):
+        """Return the sort key of a job in the ready queue
+
+        Jobs with the lowest key are submitted first. By default jobs are
+        submitted in topological order.
+        """
+        return jobid
+
+    def _push_ready(self, jobid):
+        """Add a job whose dependencies are all satisfied to the ready queue
+        """
+        # estimates are only looked up once, not every time a job that
+        # does not fit in the free resources is queued again
+        if jobid not in self._estimated:
+            self._estimated.add(jobid)
+            self._estimate_resources(jobid)
+        if self._metrics.enabled:
+            self._ready_times.setdefault(jobid, time())
+        heappush(self._ready, (self._ready_key(jobid), jobid))
+
+    def _estimate_resources(self, jobid):
+        """Fill in the memory and runtime of a job that were not set by hand
+        from the runtime history, when it is enabled
+
+        The inputs of the job are collected first, as estimates depend on the
+        size of its input files. Returns the estimate, or None.
+        """
+        node = self.procs[jobid]
+        history = get_runtime_history(node.config)
+        if history is None:
+            return None
+        try:
+            self._load_inputs(jobid)
+        except Exception:
+            # the error is reported when the job is submitted
+            return None
+        interface = node._interface
+        estimate = history.estimate(
+            interface_name(interface),
+            input_size_class(node.inputs.get_traitsfree()))
+        if estimate is None:
+            return None
+        if estimate['memory_gb']:
+            # only used when no memory is set by hand
+            interface.learned_memory_gb = estimate['memory_gb']
+        if estimate['duration'] is not None and \
+                getattr(interface, 'estimated_runtime', None) is None:
+            interface.estimated_runtime = estimate['duration']
+        logger.debug('Estimated resources of %s from %d runs: %s',
+                     node._id, estimate['runs'], estimate)
+        return estimate
+
+    def _peek_ready(self):
+        """Return the next job of the ready queue without removing it
+
+        Jobs that were marked as done while queued (e.g., because an upstream
+        node crashed) are discarded. Returns None if no job is ready.
+        """
+        while self._ready:
+            jobid = self._ready[0][1]
+            if not self.proc_done[jobid]:
+                return jobid
+            heappop(self._ready)
+        return None
+
+    def _pop_ready(self):
+        """Remove and return the next job of the ready queue
+        """
+        jobid = self._peek_ready()
+        if jobid is not None:
+            heappop(self._ready)
+        return jobid
+
     def _send_procs_to_workers(self, updatehash=False, graph=None):
         """ Sends jobs to workers
         """
-        while np.any(self.proc_done == False):
+        requeue = []
+        while self._peek_ready() is not None:
             num_jobs = len(self.pending_tasks)
             if np.isinf(self.max_jobs):
                 slots = None
@@ -358,117 +614,272 @@ class DistributedPluginBase(PluginBase):
             logger.debug('Slots available: %s' % slots)
             if (num_jobs >= self.max_jobs) or (slots == 0):
                 break
-            # Check to see if a job is available
-            jobids = np.flatnonzero((self.proc_done == False) &
-                                    (self.depidx.sum(axis=0) == 0).__array__())
-            if len(jobids) > 0:
-                # send all available jobs
-                if slots:
-                    logger.info('Pending[%d] Submitting[%d] jobs Slots[%d]' % (num_jobs, len(jobids[:slots]), slots))
-                else:
-                    logger.info('Pending[%d] Submitting[%d] jobs Slots[inf]' % (num_jobs, len(jobids)))
-                for jobid in jobids[:slots]:
-                    if isinstance(self.procs[jobid], MapNode):
-                        try:
-                            num_subnodes = self.procs[jobid].num_subnodes()
-                        except Exception:
-                            self._clean_queue(jobid, graph)
-                            self.proc_pending[jobid] = False
+            # Collect the jobs that are available
+            jobids = []
+            while slots is None or len(jobids) < slots:
+                jobid = self._pop_ready()
+                if jobid is None:
+                    break
+                jobids.append(jobid)
+            # send all available jobs
+            if slots:
+                logger.info('Pending[%d] Submitting[%d] jobs Slots[%d]' % (num_jobs, len(jobids), slots))
+            else:
+                logger.info('Pending[%d] Submitting[%d] jobs Slots[inf]' % (num_jobs, len(jobids)))
+            for jobid in jobids:
+                try:
+                    self._load_inputs(jobid)
+                except Exception:
+                    self._clean_queue(jobid, graph)
+                    self.proc_pending[jobid] = False
+                    continue
+                if isinstance(self.procs[jobid], MapNode):
+                    try:
+                        num_subnodes = self.procs[jobid].num_subnodes()
+                    except Exception:
+                        self._clean_queue(jobid, graph)
+                        self.proc_pending[jobid] = False
+                        continue
+                    if num_subnodes > 1:
+                        submit = self._submit_mapnode(jobid)
+                        if not submit:
                             continue
-                        if num_subnodes > 1:
-                            submit = self._submit_mapnode(jobid)
-                            if not submit:
-                                continue
-                    # change job status in appropriate queues
-                    self.proc_done[jobid] = True
-                    self.proc_pending[jobid] = True
-                    # Send job to task manager and add to pending tasks
-                    logger.info('Submitting: %s ID: %d' %
-                                (self.procs[jobid]._id, jobid))
-                    if self._status_callback:
-                        self._status_callback(self.procs[jobid], 'start')
-                    continue_with_submission = True
-                    if str2bool(self.procs[jobid].config['execution']
-                                ['local_hash_check']):
-                        logger.debug('checking hash locally')
-                        try:
+                # change job status in appropriate queues
+                self.proc_done[jobid] = True
+                self.proc_pending[jobid] = True
+                # Send job to task manager and add to pending tasks
+                logger.info('Submitting: %s ID: %d' %
+                            (self.procs[jobid]._id, jobid))
+                if self._status_callback:
+                    self._status_callback(self.procs[jobid], 'start')
+                continue_with_submission = True
+                if str2bool(self.procs[jobid].config['execution']
+                            ['local_hash_check']):
+                    logger.debug('checking hash locally')
+                    try:
+                        with self._metrics.timer('nipype_hash_check_seconds'):
                             hash_exists, _, _, _ = self.procs[
                                 jobid].hash_exists()
-                            logger.debug('Hash exists %s' % str(hash_exists))
-                            if (hash_exists and (self.procs[jobid].overwrite is False or
-                                (self.procs[jobid].overwrite is None and not
-                                    self.procs[jobid]._interface.always_run))):
-                                continue_with_submission = False
-                                self._task_finished_cb(jobid)
-                                self._remove_node_dirs()
-                        except Exception:
-                            self._clean_queue(jobid, graph)
-                            self.proc_pending[jobid] = False
+                        logger.debug('Hash exists %s' % str(hash_exists))
+                        if (hash_exists and (self.procs[jobid].overwrite is False or
+                            (self.procs[jobid].overwrite is None and not
+                                self.procs[jobid]._interface.always_run))):
                             continue_with_submission = False
-                    logger.debug('Finished checking hash %s' %
-                                 str(continue_with_submission))
-                    if continue_with_submission:
-                        if self.procs[jobid].run_without_submitting:
-                            logger.debug('Running node %s on master thread' %
-                                         self.procs[jobid])
-                            try:
-                                self.procs[jobid].run()
-                            except Exception:
-                                self._clean_queue(jobid, graph)
+                            self._metrics.inc('nipype_nodes_cached_total')
                             self._task_finished_cb(jobid)
                             self._remove_node_dirs()
+                    except Exception:
+                        self._clean_queue(jobid, graph)
+                        self.proc_pending[jobid] = False
+                        continue_with_submission = False
+                logger.debug('Finished checking hash %s' %
+                             str(continue_with_submission))
+                if continue_with_submission:
+                    if self.procs[jobid].run_without_submitting:
+                        logger.debug('Running node %s on master thread' %
+                                     self.procs[jobid])
+                        try:
+                            self.procs[jobid].run()
+                        except Exception:
+                            self._clean_queue(jobid, graph)
+                        self._task_finished_cb(jobid,
+                                               result=self.procs[jobid]._result)
+                        self._remove_node_dirs()
+                    else:
+                        tid = self._submit_job(deepcopy(self.procs[jobid]),
+                                               updatehash=updatehash)
+                        if tid is None:
+                            self.proc_done[jobid] = False
+                            self.proc_pending[jobid] = False
+                            requeue.append(jobid)
                         else:
-                            tid = self._submit_job(deepcopy(self.procs[jobid]),
-                                                   updatehash=updatehash)
-                            if tid is None:
-                                self.proc_done[jobid] = False
-                                self.proc_pending[jobid] = False
-                            else:
-                                self.pending_tasks.insert(0, (tid, jobid))
-                    logger.info('Finished submitting: %s ID: %d' %
-                                (self.procs[jobid]._id, jobid))
-            else:
-                break
+                            self._observe_submission(jobid)
+                            self.pending_tasks.insert(0, (tid, jobid))
+                logger.info('Finished submitting: %s ID: %d' %
+                            (self.procs[jobid]._id, jobid))
+        # jobs that could not be submitted are retried on the next tick
+        for jobid in requeue:
+            self._push_ready(jobid)
 
-    def _task_finished_cb(self, jobid):
+    def _load_inputs(self, jobid):
+        """Collect the inputs of a job through the results cache"""
+        node = self.procs[jobid]
+        if not node._got_inputs:
+            node._get_inputs(results_cache=self._results_cache)
+            node._got_inputs = True
+
+    def _task_finished_cb(self, jobid, result=None):
         """ Extract outputs and assign to inputs of dependent tasks
 
-        This is called when a job is completed.
+        This is called when a job is completed. The interface result of the
+        job, when available in memory, is added to the results cache.
         """
         logger.info('[Job finished] jobname: %s jobid: %d' %
                     (self.procs[jobid]._id, jobid))
+        self._metrics.inc('nipype_nodes_finished_total')
+        # nodes found up to date are finished without being submitted
+        self._ready_times.pop(jobid, None)
         if self._status_callback:
             self._status_callback(self.procs[jobid], 'end')
         # Update job and worker queues
         self.proc_pending[jobid] = False
-        # update the job dependency structure
-        rowview = self.depidx.getrowview(jobid)
-        rowview[rowview.nonzero()] = 0
+        # release the dependents of this job; popping the list guarantees
+        # that a job cannot release its dependents twice
+        for depid in self._dependents.pop(jobid, []):
+            self.depcount[depid] -= 1
+            if self.depcount[depid] == 0 and not self.proc_done[depid]:
+                self._push_ready(depid)
         if jobid not in self.mapnodesubids:
-            self.refidx[self.refidx[:, jobid].nonzero()[0], jobid] = 0
+            if result is not None:
+                self._results_cache.add(self.procs[jobid], result)
+            for depid in self._dependencies.pop(jobid, []):
+                self.refcount[depid] -= 1
+                if self.refcount[depid] == 0:
+                    self._results_cache.discard(self.procs[depid])
 
     def _generate_dependency_list(self, graph):
         """ Generates a dependency list for a list of graphs.
         """
         self.procs, _ = topological_sort(graph)
-        try:
-            self.depidx = nx.to_scipy_sparse_matrix(graph,
-                                                    nodelist=self.procs,
-                                                    format='lil')
-        except:
-            self.depidx = nx.to_scipy_sparse_matrix(graph,
-                                                    nodelist=self.procs)
-        self.refidx = deepcopy(self.depidx)
-        self.refidx.astype = np.int
+        self._procidx = dict((node, jobid)
+                             for jobid, node in enumerate(self.procs))
+        self._dependents = {}
+        self._dependencies = {}
+        for jobid, node in enumerate(self.procs):
+            self._dependents[jobid] = [self._procidx[succ] for succ in
+                                       graph.successors(node)]
+            self._dependencies[jobid] = [self._procidx[pred] for pred in
+                                         graph.predecessors(node)]
+        self.depcount = np.array([len(self._dependencies[jobid])
+                                  for jobid in range(len(self.procs))],
+                                 dtype=int)
+        self.refcount = np.array([len(self._dependents[jobid])
+                                  for jobid in range(len(self.procs))],
+                                 dtype=int)
         self.proc_done = np.zeros(len(self.procs), dtype=bool)
         self.proc_pending = np.zeros(len(self.procs), dtype=bool)
+        self._ready = []
+        for jobid in np.flatnonzero(self.depcount == 0):
+            self._push_ready(int(jobid))
+
+    def _start_subgraphs(self, graph, subgraphs):
+        """Prepare to pull the given generator of expanded subgraphs
+
+        Returns the graph to run, which is a copy of the given graph if nodes
+        are to be added to it.
+        """
+        self._subgraphs = subgraphs
+        self._branches = []
+        self._crashed = {}
+        if subgraphs is None:
+            return graph
+        # the outputs of the initial nodes may still be needed by subgraphs
+        # that are not expanded yet
+        self._numbase = len(self.procs)
+        self.refcount += 1
+        return nx.DiGraph(graph)
+
+    def _pull_subgraphs(self, graph, notrun):
+        """Add the next expanded subgraphs to the graph until some job is
+        ready to run, and release the nodes of the subgraphs that have
+        completed
+        """
+        while self._subgraphs is not None and self._peek_ready() is None:
+            try:
+                subgraph = next(self._subgraphs)
+            except StopIteration:
+                self._subgraphs = None
+                self.refcount[:self._numbase] -= 1
+                self._remove_node_dirs()
+                break
+            notrun.extend(self._add_subgraph(graph, subgraph))
+        if self._branches:
+            self._release_branches(graph)
+
+    def _add_subgraph(self, graph, subgraph):
+        """Schedule the new nodes of an expanded subgraph
+
+        Returns the not run information of the nodes depending on crashed
+        nodes.
+        """
+        nodes = [node for node in topological_sort(subgraph)[0]
+                 if node not in self._procidx]
+        firstid = len(self.procs)
+        numnodes = len(nodes)
+        logger.info('Adding %d jobs of an expanded subgraph' % numnodes)
+        graph.add_nodes_from(nodes)
+        graph.add_edges_from(subgraph.edges_iter(data=True))
+        self.procs.extend(nodes)
+        jobids = list(range(firstid, firstid + numnodes))
+        self._procidx.update(zip(nodes, jobids))
+        self.proc_done = np.concatenate((self.proc_done,
+                                         np.zeros(numnodes, dtype=bool)))
+        self.proc_pending = np.concatenate((self.proc_pending,
+                                            np.zeros(numnodes, dtype=bool)))
+        self.depcount = np.concatenate((self.depcount,
+                                        np.zeros(numnodes, dtype=int)))
+        self.refcount = np.concatenate((self.refcount,
+                                        np.zeros(numnodes, dtype=int)))
+        crashed = {}
+        for jobid, node in zip(jobids, nodes):
+            self._dependents[jobid] = [self._procidx[succ] for succ in
+                                       subgraph.successors_iter(node)]
+            self._dependencies[jobid] = [self._procidx[pred] for pred in
+                                         subgraph.predecessors_iter(node)]
+            self.refcount[jobid] += len(self._dependents[jobid])
+            for depid in self._dependencies[jobid]:
+                if depid >= firstid:
+                    self.depcount[jobid] += 1
+                    continue
+                self.refcount[depid] += 1
+                if depid in self._crashed:
+                    crashed.setdefault(self._crashed[depid], []).append(jobid)
+                elif depid in self._dependents:
+                    # still running
+                    self._dependents[depid].append(jobid)
+                    self.depcount[jobid] += 1
+        notrun = []
+        for (crashid, crashfile), depids in list(crashed.items()):
+            info = self._remove_node_deps(depids[0], crashfile, subgraph)
+            for depid in depids[1:]:
+                info['dependents'].extend(self._remove_node_deps(
+                    depid, crashfile, subgraph)['dependents'])
+            info['node'] = self.procs[crashid]
+            notrun.append(info)
+        for jobid in jobids:
+            if self.depcount[jobid] == 0 and not self.proc_done[jobid]:
+                self._push_ready(jobid)
+        self._branches.append(jobids)
+        return notrun
+
+    def _release_branches(self, graph):
+        """Forget the nodes of the subgraphs whose jobs have all completed
+        """
+        self._remove_node_dirs()
+        branches = []
+        for jobids in self._branches:
+            if (np.all(self.proc_done[jobids]) and
+                    not np.any(self.proc_pending[jobids])):
+                nodes = [self.procs[jobid] for jobid in jobids]
+                graph.remove_nodes_from(nodes)
+                for jobid, node in zip(jobids, nodes):
+                    del self._procidx[node]
+                    self.procs[jobid] = None
+                    self._crashed.pop(jobid, None)
+                self.refcount[jobids] = -1
+            else:
+                branches.append(jobids)
+        self._branches = branches
 
     def _remove_node_deps(self, jobid, crashfile, graph):
         subnodes = [s for s in dfs_preorder(graph, self.procs[jobid])]
         for node in subnodes:
-            idx = self.procs.index(node)
+            idx = self._procidx[node]
             self.proc_done[idx] = True
             self.proc_pending[idx] = False
+            if self._subgraphs is not None:
+                # dependents in subgraphs added later cannot run either
+                self._crashed[idx] = (jobid, crashfile)
         return dict(node=self.procs[jobid],
                     dependents=subnodes,
                     crashfile=crashfile)
@@ -477,27 +888,83 @@ class DistributedPluginBase(PluginBase):
         """Removes directories whose outputs have already been used up
         """
         if str2bool(self._config['execution']['remove_node_directories']):
-            for idx in np.nonzero(
-                                 (self.refidx.sum(axis=1) == 0).__array__())[0]:
-                if idx in self.mapnodesubids:
-                    continue
-                if self.proc_done[idx] and (not self.proc_pending[idx]):
-                    self.refidx[idx, idx] = -1
-                    outdir = self.procs[idx]._output_directory()
-                    logger.info(('[node dependencies finished] '
-                                 'removing node: %s from directory %s') %
-                                (self.procs[idx]._id, outdir))
-                    shutil.rmtree(outdir)
+            numprocs = len(self.refcount)
+            indices = np.flatnonzero((self.refcount == 0) &
+                                     self.proc_done[:numprocs] &
+                                     ~self.proc_pending[:numprocs])
+            for idx in indices:
+                # mark as removed
+                self.refcount[idx] = -1
+                outdir = self.procs[idx].output_dir()
+                logger.info(('[node dependencies finished] '
+                             'removing node: %s from directory %s') %
+                            (self.procs[idx]._id, outdir))
+                shutil.rmtree(outdir)
+
+
+def _add_directive(template, directive):
+    """Insert a batch directive at the top of a template, after the
+    interpreter line if there is one"""
+    lines = template.lstrip('\n').split('\n')
+    if lines[0].startswith('#!'):
+        return '\n'.join([lines[0], directive] + lines[1:])
+    return '\n'.join([directive] + lines)
 
 
 class SGELikeBatchManagerBase(DistributedPluginBase):
     """Execute workflow with SGE/OGE/PBS like batch system
+
+    With the ``bundle_size`` plugin argument, the nodes that become ready
+    during a scheduling round are not submitted one by one: nodes with the
+    same ``plugin_args`` and resource estimates are grouped into bundles of
+    up to ``bundle_size`` nodes, each submitted as a single job. The
+    ``bundle_mode`` argument selects how a bundle runs:
+
+    - ``serial`` (default): one job runs the nodes in a single python
+      interpreter, ``bundle_procs`` nodes at a time (default 1); plugins
+      requesting the resources of nodes request those of ``bundle_procs``
+      nodes
+    - ``array``: one array job runs every node as a separate task (SGE,
+      PBS/Torque and SLURM only)
+
+    The results of the nodes of a bundle are collected once its job is done.
+
+    With the ``request_resources`` plugin argument, the ``estimated_memory_gb``
+    and ``num_threads`` of the interface of each node are requested from the
+    batch system, unless the submission arguments already request them
+    (SGE, PBS/Torque, LSF, SLURM and, for threads only, OAR). Memory estimates
+    are learned from previous runs when the ``runtime_history`` option of the
+    ``[execution]`` section is enabled.
     """
 
+    # directive added to the template to submit an array job of a given
+    # number of tasks, and environment variable holding the task index
+    _array_directive = None
+    _array_index = None
+
     def __init__(self, template, plugin_args=None):
         super(SGELikeBatchManagerBase, self).__init__(plugin_args=plugin_args)
         self._template = template
         self._qsub_args = None
+        self._bundle_size = 1
+        self._bundle_mode = 'serial'
+        self._bundle_procs = 1
+        self._request_resources = False
+        if plugin_args:
+            self._request_resources = str2bool(
+                plugin_args.get('request_resources', False))
+            self._bundle_size = int(plugin_args.get('bundle_size', 1))
+            self._bundle_mode = plugin_args.get('bundle_mode', 'serial')
+            self._bundle_procs = int(plugin_args.get('bundle_procs', 1))
+        if self._bundle_mode not in ('serial', 'array'):
+            raise ValueError('Unknown bundle_mode: %s' % self._bundle_mode)
+        if self._bundle_mode == 'array' and self._array_directive is None:
+            raise ValueError('%s does not support array jobs' %
+                             self.__class__.__name__)
+        self._queued = []
+        self._bundles = {}
+        self._bundle_members = {}
+        self._num_bundled = 0
         if plugin_args:
             if 'template' in plugin_args:
                 self._template = plugin_args['template']
@@ -506,24 +973,98 @@ class SGELikeBatchManagerBase(DistributedPluginBase):
                         self._template = tpl_file.read()
             if 'qsub_args' in plugin_args:
                 self._qsub_args = plugin_args['qsub_args']
+        self._status_ttl = None
+        if plugin_args and plugin_args.get('status_ttl') is not None:
+            self._status_ttl = float(plugin_args['status_ttl'])
         self._pending = {}
+        self._status_pending = set()
+        self._status_queried = set()
+        self._status_time = None
 
     def _is_pending(self, taskid):
         """Check if a task is pending in the batch system
+
+        The status of all the tracked tasks is fetched at once with
+        :meth:`_query_pending` and reused until it is older than
+        ``status_ttl`` seconds (by default, the ``poll_sleep_duration``), so
+        the batch system is queried once per polling round rather than once
+        per task.
+        """
+        ttl = self._status_ttl
+        if ttl is None:
+            ttl = float(self._config['execution']['poll_sleep_duration'])
+        if taskid not in self._status_queried or \
+                self._status_time is None or \
+                time() - self._status_time > ttl:
+            self._refresh_status()
+        return taskid in self._status_pending
+
+    def _refresh_status(self):
+        """Query the batch system for the status of all the pending tasks
+        """
+        taskids = list(self._pending)
+        pending = self._query_pending(taskids)
+        if pending is None:
+            # the batch system could not be queried (e.g. its controller
+            # timed out): jobs keep their last known status, and new jobs
+            # are assumed to be pending
+            logger.info('Batch status query failed, retrying later')
+            pending = [taskid for taskid in taskids
+                       if taskid in self._status_pending or
+                       taskid not in self._status_queried]
+        self._status_pending = set(pending)
+        self._status_queried = set(taskids)
+        self._status_time = time()
+
+    def _query_pending(self, taskids):
+        """Return the subset of taskids still queued or running in the batch
+        system, using a single query for all of them
+
+        Returns None if the batch system could not be queried; a job it
+        explicitly reports as unknown is considered finished.
         """
         raise NotImplementedError
 
-    def _submit_batchtask(self, scriptfile, node):
+    def _resource_args(self, memory_mb, threads):
+        """Return the submission arguments requesting memory (in MB) and
+        threads for a job, as (markers, argument) pairs: an argument is left
+        out when the submission arguments already contain one of its markers
+
+        Plugins that cannot request resources return an empty list.
+        """
+        return []
+
+    def _add_resource_args(self, args, node, procs=1):
+        """Add the arguments requesting the resources of ``procs`` nodes like
+        ``node`` to submission arguments, if ``request_resources`` is set"""
+        if not self._request_resources:
+            return args
+        interface = node._interface
+        memory_mb = int(math.ceil(interface.estimated_memory_gb * 1024 *
+                                  procs))
+        threads = interface.num_threads * procs
+        for markers, arg in self._resource_args(memory_mb, threads):
+            if not any(marker in args for marker in markers):
+                args = '%s %s' % (args, arg)
+        return args
+
+    def _submit_batchtask(self, scriptfile, node, procs=1):
         """Submit a task to the batch system
+
+        ``procs`` is the number of nodes like ``node`` the task runs at once,
+        whose resources are requested by plugins that request them.
         """
         raise NotImplementedError
 
     def _get_result(self, taskid):
-        if taskid not in self._pending:
-            raise Exception('Task %d not found' % taskid)
-        if self._is_pending(taskid):
+        if taskid in self._bundles:
+            batch_taskid, node_dir = self._bundles[taskid]
+        elif taskid in self._pending:
+            batch_taskid, node_dir = taskid, self._pending[taskid]
+        else:
+            raise Exception('Task %s not found' % taskid)
+        if self._is_pending(batch_taskid):
             return None
-        node_dir = self._pending[taskid]
         # MIT HACK
         # on the pbs system at mit the parent node directory needs to be
         # accessed before internal directories become available. there
@@ -572,8 +1113,16 @@ class SGELikeBatchManagerBase(DistributedPluginBase):
 
     def _submit_job(self, node, updatehash=False):
         """submit job and return taskid
+
+        When bundling, the job is only queued until the end of the scheduling
+        round, and its taskid is local to the plugin.
         """
         pyscript = create_pyscript(node, updatehash=updatehash)
+        if self._bundle_size > 1:
+            self._num_bundled += 1
+            taskid = 'bundled-%d' % self._num_bundled
+            self._queued.append((taskid, node, pyscript))
+            return taskid
         batch_dir, name = os.path.split(pyscript)
         name = '.'.join(name.split('.')[:-1])
         batchscript = '\n'.join((self._template,
@@ -583,6 +1132,60 @@ class SGELikeBatchManagerBase(DistributedPluginBase):
             fp.writelines(batchscript)
         return self._submit_batchtask(batchscriptfile, node)
 
+    def _send_procs_to_workers(self, updatehash=False, graph=None):
+        super(SGELikeBatchManagerBase, self)._send_procs_to_workers(
+            updatehash=updatehash, graph=graph)
+        if self._queued:
+            self._submit_bundles()
+
+    def _bundle_key(self, node):
+        """Nodes with the same key can be submitted in the same bundle"""
+        interface = node._interface
+        return (repr(sorted(node.plugin_args.items())),
+                interface.estimated_memory_gb, interface.num_threads)
+
+    def _submit_bundles(self):
+        """Submit the queued jobs in bundles of similar nodes"""
+        groups = OrderedDict()
+        for queued in self._queued:
+            groups.setdefault(self._bundle_key(queued[1]), []).append(queued)
+        self._queued = []
+        for members in groups.values():
+            for start in range(0, len(members), self._bundle_size):
+                self._submit_bundle(members[start:start + self._bundle_size])
+
+    def _submit_bundle(self, members):
+        """Submit a list of (taskid, node, pyscript) as a single job"""
+        taskids, nodes, pyscripts = zip(*members)
+        batch_dir = os.path.dirname(pyscripts[0])
+        name = 'bundle_%s_%s' % (strftime('%Y%m%d_%H%M%S'),
+                                 uuid.uuid4().hex[:8])
+        template = self._template
+        index_var = None
+        if self._bundle_mode == 'array':
+            template = _add_directive(
+                template, self._array_directive % len(members))
+            index_var = self._array_index
+        bundlefile = create_bundle_script(
+            pyscripts, os.path.join(batch_dir, '%s.py' % name),
+            procs=self._bundle_procs, index_var=index_var)
+        batchscript = '\n'.join((template,
+                                 '%s %s' % (sys.executable, bundlefile)))
+        batchscriptfile = os.path.join(batch_dir, 'batchscript_%s.sh' % name)
+        with open(batchscriptfile, 'wt') as fp:
+            fp.writelines(batchscript)
+        # the tasks of an array job run a node each
+        procs = 1
+        if self._bundle_mode == 'serial':
+            procs = min(self._bundle_procs, len(members))
+        batch_taskid = self._submit_batchtask(batchscriptfile, nodes[0],
+                                              procs=procs)
+        logger.info('Submitted %d nodes as job %s' % (len(members),
+                                                      batch_taskid))
+        self._bundle_members[batch_taskid] = len(members)
+        for taskid, node in zip(taskids, nodes):
+            self._bundles[taskid] = (batch_taskid, node.output_dir())
+
     def _report_crash(self, node, result=None):
         if result and result['traceback']:
             node._result = result['result']
@@ -593,6 +1196,13 @@ class SGELikeBatchManagerBase(DistributedPluginBase):
             return report_crash(node)
 
     def _clear_task(self, taskid):
+        if taskid in self._bundles:
+            batch_taskid, _ = self._bundles.pop(taskid)
+            self._bundle_members[batch_taskid] -= 1
+            if self._bundle_members[batch_taskid]:
+                return
+            del self._bundle_members[batch_taskid]
+            taskid = batch_taskid
         del self._pending[taskid]
 
 
@@ -4,6 +4,33 @@
 """Callback logger for recording workflow and node run stats
 """
 from __future__ import print_function, division, unicode_literals, absolute_import
+from builtins import object, open
+
+import atexit
+import os.path as op
+from time import time
+
+
+def _node_stats(node):
+    """Return the runtime profile stats of a node, as a dictionary"""
+    stats = {}
+    if node.result is None:
+        stats['runtime_memory_gb'] = stats['runtime_threads'] = 'N/A'
+        return stats
+    try:
+        runtime = node.result.runtime
+        stats['runtime_memory_gb'] = runtime.runtime_memory_gb
+        stats['runtime_threads'] = runtime.runtime_threads
+    except AttributeError:
+        stats['runtime_memory_gb'] = stats['runtime_threads'] = 'Unknown'
+        return stats
+    cpu_seconds = getattr(runtime, 'runtime_cpu_seconds', None)
+    if cpu_seconds is not None:
+        stats['runtime_cpu_seconds'] = cpu_seconds
+    samples = getattr(runtime, 'resource_samples', None)
+    if samples:
+        stats['runtime_samples'] = samples
+    return stats
 
 
 # Log node stats function
@@ -31,17 +58,6 @@ def log_nodes_cb(node, status):
     import logging
     import json
 
-    # Check runtime profile stats
-    if node.result is not None:
-        try:
-            runtime = node.result.runtime
-            runtime_memory_gb = runtime.runtime_memory_gb
-            runtime_threads = runtime.runtime_threads
-        except AttributeError:
-            runtime_memory_gb = runtime_threads = 'Unknown'
-    else:
-        runtime_memory_gb = runtime_threads = 'N/A'
-
     # Init variables
     logger = logging.getLogger('callback')
     status_dict = {'name' : node.name,
@@ -56,8 +72,7 @@ def log_nodes_cb(node, status):
     # End
     elif status == 'end':
         status_dict['finish'] = str(datetime.datetime.now())
-        status_dict['runtime_threads'] = runtime_threads
-        status_dict['runtime_memory_gb'] = runtime_memory_gb
+        status_dict.update(_node_stats(node))
     # Other
     else:
         status_dict['finish'] = str(datetime.datetime.now())
@@ -65,3 +80,68 @@ def log_nodes_cb(node, status):
 
     # Dump string to log
     logger.debug(json.dumps(status_dict))
+
+
+class ExecutionLog(object):
+    """Status callback appending the events of the nodes to a JSON lines
+    file, which :func:`~nipype.utils.draw_gantt_chart.log_to_dict` and
+    :func:`~nipype.utils.draw_gantt_chart.generate_gantt_chart` read
+
+    Each line is a compact record of a node event (``start``, ``end`` or
+    ``error``), with its time in seconds since the epoch. The file is kept
+    open and flushed at most every ``flush_interval`` seconds, and when the
+    process exits.
+
+    Examples
+    --------
+
+    >>> from nipype.pipeline.plugins.callback_log import ExecutionLog
+    >>> plugin_args = {'n_procs': 8,
+    ...                'status_callback': ExecutionLog('run_stats.jsonl')}
+
+    """
+
+    def __init__(self, filename, flush_interval=1.):
+        self.filename = op.abspath(filename)
+        self.flush_interval = flush_interval
+        self._fp = None
+        self._last_flush = 0.
+
+    def __call__(self, node, status):
+        import simplejson as json
+
+        now = time()
+        record = {'id': node._id, 'name': node.name, 'time': now}
+        if status == 'start':
+            record['event'] = 'start'
+            record['estimated_memory_gb'] = \
+                node._interface.estimated_memory_gb
+            record['num_threads'] = node._interface.num_threads
+        elif status == 'end':
+            record['event'] = 'end'
+            record.update(_node_stats(node))
+        else:
+            record['event'] = 'error'
+        if self._fp is None:
+            self._fp = open(self.filename, 'at')
+            atexit.register(self.close)
+        self._fp.write('%s\n' % json.dumps(record))
+        if now - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records to the file"""
+        if self._fp is not None:
+            self._fp.flush()
+        self._last_flush = time()
+
+    def close(self):
+        """Flush and close the file"""
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_fp'] = None
+        return state
@@ -4,6 +4,7 @@
 from __future__ import print_function, division, unicode_literals, absolute_import
 
 import os
+import re
 from time import sleep
 
 from ...interfaces.base import CommandLine
@@ -44,20 +45,23 @@ class CondorPlugin(SGELikeBatchManagerBase):
                 self._max_tries = kwargs['plugin_args']['max_tries']
         super(CondorPlugin, self).__init__(template, **kwargs)
 
-    def _is_pending(self, taskid):
+    def _query_pending(self, taskids):
         cmd = CommandLine('condor_q',
                           terminal_output='allatonce')
-        cmd.inputs.args = '%d' % taskid
+        cmd.inputs.args = ' '.join('%d' % taskid for taskid in taskids)
         # check condor cluster
         oldlevel = iflogger.level
         iflogger.setLevel(logging.getLevelName('CRITICAL'))
         result = cmd.run(ignore_exception=True)
         iflogger.setLevel(oldlevel)
-        if result.runtime.stdout.count('\n%d' % taskid):
-            return True
-        return False
+        # job lines start with <cluster>.<process>
+        listed = set(re.findall(r'^\s*(\d+)\.\d+\s',
+                                result.runtime.stdout or '', re.MULTILINE))
+        if result.runtime.returncode != 0 and not listed:
+            return None
+        return [taskid for taskid in taskids if '%d' % taskid in listed]
 
-    def _submit_batchtask(self, scriptfile, node):
+    def _submit_batchtask(self, scriptfile, node, procs=1):
         cmd = CommandLine('condor_qsub', environ=dict(os.environ),
                           terminal_output='allatonce')
         path = os.path.dirname(scriptfile)
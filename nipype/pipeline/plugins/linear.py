@@ -5,6 +5,7 @@
 """
 from __future__ import print_function, division, unicode_literals, absolute_import
 
+from itertools import chain
 import os
 
 import networkx as nx
@@ -17,7 +18,7 @@ class LinearPlugin(PluginBase):
     """Execute workflow in series
     """
 
-    def run(self, graph, config, updatehash=False):
+    def run(self, graph, config, updatehash=False, subgraphs=None):
         """Executes a pre-defined pipeline in a serial order.
 
         Parameters
@@ -25,6 +26,10 @@ class LinearPlugin(PluginBase):
 
         graph : networkx digraph
             defines order of execution
+        subgraphs : generator
+            optional generator of additional expanded graphs (see
+            :func:`~nipype.pipeline.engine.utils.generate_expanded_subgraphs`),
+            run one after the other once graph has run
         """
 
         if not isinstance(graph, nx.DiGraph):
@@ -32,30 +37,39 @@ class LinearPlugin(PluginBase):
         logger.info("Running serially.")
         old_wd = os.getcwd()
         notrun = []
-        donotrun = []
-        nodes, _ = topological_sort(graph)
-        for node in nodes:
-            try:
-                if node in donotrun:
-                    continue
-                if self._status_callback:
-                    self._status_callback(node, 'start')
-                node.run(updatehash=updatehash)
-                if self._status_callback:
-                    self._status_callback(node, 'end')
-            except:
-                os.chdir(old_wd)
-                if str2bool(config['execution']['stop_on_first_crash']):
-                    raise
-                # bare except, but i really don't know where a
-                # node might fail
-                crashfile = report_crash(node)
-                # remove dependencies from queue
-                subnodes = [s for s in dfs_preorder(graph, node)]
-                notrun.append(dict(node=node,
-                                   dependents=subnodes,
-                                   crashfile=crashfile))
-                donotrun.extend(subnodes)
-                if self._status_callback:
-                    self._status_callback(node, 'exception')
+        donotrun = set()
+        basenodes = set(graph.nodes())
+        for part in chain([graph], subgraphs or []):
+            nodes, _ = topological_sort(part)
+            if part is not graph:
+                nodes = [node for node in nodes if node not in basenodes]
+            for node in nodes:
+                try:
+                    if node in donotrun:
+                        continue
+                    if any(pred in donotrun
+                           for pred in part.predecessors_iter(node)):
+                        # depends on a shared node that crashed
+                        donotrun.add(node)
+                        continue
+                    if self._status_callback:
+                        self._status_callback(node, 'start')
+                    node.run(updatehash=updatehash)
+                    if self._status_callback:
+                        self._status_callback(node, 'end')
+                except:
+                    os.chdir(old_wd)
+                    if str2bool(config['execution']['stop_on_first_crash']):
+                        raise
+                    # bare except, but i really don't know where a
+                    # node might fail
+                    crashfile = report_crash(node)
+                    # remove dependencies from queue
+                    subnodes = [s for s in dfs_preorder(part, node)]
+                    notrun.append(dict(node=node,
+                                       dependents=subnodes,
+                                       crashfile=crashfile))
+                    donotrun.update(subnodes)
+                    if self._status_callback:
+                        self._status_callback(node, 'exception')
         report_nodes_not_run(notrun)
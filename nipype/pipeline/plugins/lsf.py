@@ -20,6 +20,10 @@ class LSFPlugin(SGELikeBatchManagerBase):
     - template : template to use for batch job submission
     - bsub_args : arguments to be prepended to the job execution script in the
                   bsub call
+    - request_resources : request the ``estimated_memory_gb`` and
+                          ``num_threads`` of each node with ``-M`` (in MB,
+                          as with ``LSF_UNIT_FOR_LIMITS=MB``) and ``-n`` on a
+                          single host, unless bsub_args already set them
 
     """
 
@@ -39,26 +43,40 @@ class LSFPlugin(SGELikeBatchManagerBase):
                 self._bsub_args = kwargs['plugin_args']['bsub_args']
         super(LSFPlugin, self).__init__(template, **kwargs)
 
-    def _is_pending(self, taskid):
+    def _query_pending(self, taskids):
         """LSF lists a status of 'PEND' when a job has been submitted but is waiting to be picked up,
-        and 'RUN' when it is actively being processed. But _is_pending should return True until a job has
-        finished and is ready to be checked for completeness. So return True if status is either 'PEND'
-        or 'RUN'"""
+        and 'RUN' when it is actively being processed. But a job is pending until it has
+        finished and is ready to be checked for completeness. So return the jobs whose status is
+        neither 'DONE' nor 'EXIT'"""
         cmd = CommandLine('bjobs',
                           terminal_output='allatonce')
-        cmd.inputs.args = '%d' % taskid
-        # check lsf task
+        cmd.inputs.args = ' '.join('%d' % taskid for taskid in taskids)
+        # check lsf tasks
         oldlevel = iflogger.level
         iflogger.setLevel(logging.getLevelName('CRITICAL'))
         result = cmd.run(ignore_exception=True)
         iflogger.setLevel(oldlevel)
         # logger.debug(result.runtime.stdout)
-        if 'DONE' in result.runtime.stdout or 'EXIT' in result.runtime.stdout:
-            return False
-        else:
-            return True
+        status = {}
+        for line in (result.runtime.stdout or '').splitlines():
+            fields = line.split()
+            if len(fields) > 2:
+                status[fields[0]] = fields[2]
+        # bjobs fails when it does not know any of the jobs, which are then
+        # finished, but also when the LSF master cannot be reached
+        if result.runtime.returncode != 0 and not status and \
+                'is not found' not in (result.runtime.stderr or ''):
+            return None
+        return [taskid for taskid in taskids
+                if status.get('%d' % taskid) not in (None, 'DONE', 'EXIT')]
+
+    def _resource_args(self, memory_mb, threads):
+        args = [(('-M ',), '-M %d' % memory_mb), (('-n ',), '-n %d' % threads)]
+        if threads > 1:
+            args.append((('span[',), '-R "span[hosts=1]"'))
+        return args
 
-    def _submit_batchtask(self, scriptfile, node):
+    def _submit_batchtask(self, scriptfile, node, procs=1):
         cmd = CommandLine('bsub', environ=dict(os.environ),
                           terminal_output='allatonce')
         path = os.path.dirname(scriptfile)
@@ -71,6 +89,7 @@ class LSFPlugin(SGELikeBatchManagerBase):
                 bsubargs = node.plugin_args['bsub_args']
             else:
                 bsubargs += (" " + node.plugin_args['bsub_args'])
+        bsubargs = self._add_resource_args(bsubargs, node, procs)
         if '-o' not in bsubargs:  # -o outfile
             bsubargs = '%s -o %s' % (bsubargs, scriptfile + ".log")
         if '-e' not in bsubargs:
@@ -13,14 +13,20 @@ from builtins import open
 from multiprocessing import Process, Pool, cpu_count, pool
 import threading
 from traceback import format_exception
+import os
+import shutil
 import sys
+from tempfile import mkdtemp
+from hashlib import md5
+from heapq import heappush
 
 from copy import deepcopy
-import numpy as np
 
 from ... import logging, config
-from ...utils.misc import str2bool
+from ...utils.filemanip import loadpkl, savepkl
+from ...utils.misc import str2bool, interface_name
 from ..engine import MapNode
+from ..engine.history import get_runtime_history
 from .base import (DistributedPluginBase, report_crash)
 
 # Init logger
@@ -59,6 +65,63 @@ def run_node(node, updatehash, taskid):
     return result
 
 
+# Configuration dictionaries already loaded by this worker process, indexed
+# by the file they were shipped in
+_worker_configs = {}
+
+
+def run_node_file(node_file, config_file, updatehash, taskid):
+    """Function to load a node shipped as a pickle file and execute it
+
+    The configuration of the node is shipped separately and is read only once
+    per worker process, so the task sent through the pool is just a couple
+    of file names.
+
+    Parameters
+    ----------
+    node_file : string
+        pickle file containing the node to run, without its config
+    config_file : string
+        pickle file containing the config dictionary of the node
+    updatehash : boolean
+        flag for updating hash
+
+    Returns
+    -------
+    result : dictionary
+        dictionary containing the node runtime results and stats. The
+        interface result is only sent back if the node crashed, otherwise
+        it is available from the node's results file.
+    """
+    try:
+        node = loadpkl(node_file)
+        if config_file not in _worker_configs:
+            _worker_configs[config_file] = loadpkl(config_file)
+        node.config = _worker_configs[config_file]
+        if hasattr(node.inputs, 'terminal_output'):
+            if node.inputs.terminal_output == 'stream':
+                node.inputs.terminal_output = 'allatonce'
+    except:
+        etype, eval, etr = sys.exc_info()
+        return dict(result=None, taskid=taskid,
+                    traceback=format_exception(etype, eval, etr))
+
+    result = run_node(node, updatehash, taskid)
+    if result['traceback'] is None:
+        result['result'] = None
+    return result
+
+
+def _config_key(node_config):
+    """Return a digest of a node config dictionary"""
+    items = []
+    for section, options in sorted(node_config.items()):
+        if isinstance(options, dict):
+            options = sorted(options.items())
+        items.append((section, options))
+    return md5(str(items).encode()).hexdigest()
+
+
 class NonDaemonProcess(Process):
     """A non-daemon process to support internal multiprocessing.
     """
@@ -118,13 +181,31 @@ class MultiProcPlugin(DistributedPluginBase):
     memory_consuming_node.interface.estimated_memory_gb = 8
     thread_consuming_node.interface.num_threads = 16
 
-    The default number of threads and memory for a node is 1.
+    The default number of threads and memory for a node is 1. A MapNode
+    running its subnodes in a pool of ``mapnode_procs`` processes (see
+    :class:`~nipype.pipeline.engine.MapNode`) uses that many threads.
 
     Currently supported options are:
 
     - non_daemon : boolean flag to execute as non-daemon processes
     - n_procs: maximum number of threads to be executed in parallel
     - memory_gb: maximum memory (in GB) that can be used at once.
+    - ship_nodes_by_file: boolean flag to send nodes to the workers as
+      pickle files instead of copying them through the pool. Workers then
+      receive a pair of file names per task and load each distinct config
+      only once, which reduces the per-task overhead of workflows with many
+      small nodes.
+    - scheduler: order in which ready nodes are started. ``resources``
+      (default) starts the nodes requiring the least memory and threads
+      first. ``critical_path`` starts first the nodes with the longest
+      expected runtime until the end of the workflow (their upward rank),
+      computed from the ``estimated_runtime`` (in seconds) of the
+      interfaces; nodes without an estimate count as ``default_runtime``
+      seconds (default 1).
+
+    With the ``runtime_history`` option of the ``[execution]`` section, the
+    ``estimated_memory_gb`` and ``estimated_runtime`` of interfaces not set
+    by hand are learned from their previous runs.
 
     """
 
@@ -141,26 +222,44 @@ class MultiProcPlugin(DistributedPluginBase):
 
         self._timeout=2.0
         self._event = threading.Event()
-
-
+        self._ship_by_file = False
+        self._ship_dir = None
+        self._ship_files = {}
+        self._config_files = {}
+        self._scheduler = 'resources'
+        self._default_runtime = 1.0
+        self._ranks = {}
 
         # Check plugin args
         if self.plugin_args:
             if 'non_daemon' in self.plugin_args:
                 non_daemon = plugin_args['non_daemon']
+            if 'ship_nodes_by_file' in self.plugin_args:
+                self._ship_by_file = str2bool(
+                    self.plugin_args['ship_nodes_by_file'])
             if 'n_procs' in self.plugin_args:
                 self.processors = self.plugin_args['n_procs']
             if 'memory_gb' in self.plugin_args:
                 self.memory_gb = self.plugin_args['memory_gb']
+            if 'scheduler' in self.plugin_args:
+                self._scheduler = self.plugin_args['scheduler']
+            if 'default_runtime' in self.plugin_args:
+                self._default_runtime = float(
+                    self.plugin_args['default_runtime'])
+        if self._scheduler not in ('resources', 'critical_path'):
+            raise ValueError('Unknown scheduler %s, expected resources or '
+                             'critical_path' % self._scheduler)
 
         logger.debug("MultiProcPlugin starting %d threads in pool"%(self.processors))
+        self.pool = self._create_pool(non_daemon)
 
+    def _create_pool(self, non_daemon):
+        """Instantiate the pool of worker processes"""
         # Instantiate different thread pools for non-daemon processes
         if non_daemon:
             # run the execution using the non-daemon pool subclass
-            self.pool = NonDaemonPool(processes=self.processors)
-        else:
-            self.pool = Pool(processes=self.processors)
+            return NonDaemonPool(processes=self.processors)
+        return Pool(processes=self.processors)
 
     def _wait(self):
         if len(self.pending_tasks) > 0:
@@ -193,81 +292,213 @@ class MultiProcPlugin(DistributedPluginBase):
 
     def _clear_task(self, taskid):
         del self._task_obj[taskid]
+        self._taskresult.pop(taskid, None)
+        if taskid in self._ship_files:
+            os.remove(self._ship_files.pop(taskid))
 
-    def _submit_job(self, node, updatehash=False):
-        self._taskid += 1
+    def _ship_node(self, node):
+        """Save a node and its config to the shipping directory
+
+        Returns the names of the node and config files.
+        """
+        if self._ship_dir is None:
+            self._ship_dir = mkdtemp(prefix='nipype_multiproc_')
+        key = _config_key(node.config)
+        if key not in self._config_files:
+            config_file = os.path.join(self._ship_dir, 'config_%s.pkl' % key)
+            savepkl(config_file, node.config)
+            self._config_files[key] = config_file
+        node_file = os.path.join(self._ship_dir, 'node_%d.pkl' % self._taskid)
+        node_config = node.config
+        node.config = None
+        try:
+            savepkl(node_file, node)
+        finally:
+            node.config = node_config
+        return node_file, self._config_files[key]
+
+    def _task_args(self, node, updatehash):
+        """Return the function and arguments that execute a node in a worker
+        """
+        if self._ship_by_file:
+            node_file, config_file = self._ship_node(node)
+            self._ship_files[self._taskid] = node_file
+            return run_node_file, (node_file, config_file, updatehash,
+                                   self._taskid)
         if hasattr(node.inputs, 'terminal_output'):
             if node.inputs.terminal_output == 'stream':
                 node.inputs.terminal_output = 'allatonce'
+        return run_node, (node, updatehash, self._taskid)
 
+    def _submit_job(self, node, updatehash=False):
+        self._taskid += 1
+        func, args = self._task_args(node, updatehash)
         self._task_obj[self._taskid] = \
-            self.pool.apply_async(run_node,
-                                  (node, updatehash, self._taskid),
-                                  callback=self._async_callback)
+            self.pool.apply_async(func, args, callback=self._async_callback)
         return self._taskid
 
+    def _remove_ship_dir(self):
+        if self._ship_dir is not None:
+            shutil.rmtree(self._ship_dir, ignore_errors=True)
+            self._ship_dir = None
+            self._config_files = {}
+
     def _close(self):
         self.pool.close()
+        # the pool can be closed without running a workflow
+        execution = (getattr(self, '_config', None) or {}).get('execution', {})
+        if str2bool(execution.get('report_async', False)) or str2bool(
+                execution.get('report_database', False)):
+            # workers flush their queued reports when they exit
+            self.pool.join()
+        self._remove_ship_dir()
         return True
 
+    def _job_threads(self, jobid):
+        """Number of threads used by a job: those of its interface, or the
+        processes of the subnode pool of a MapNode"""
+        node = self.procs[jobid]
+        threads = node._interface.num_threads
+        if isinstance(node, MapNode):
+            threads = max(threads,
+                          int(node.plugin_args.get('mapnode_procs', 1)))
+        return threads
+
+    def _ready_key(self, jobid):
+        """Ready jobs are sorted first by memory and then by number of
+        threads, after their upward rank with the critical_path scheduler"""
+        key = (self.procs[jobid]._interface.estimated_memory_gb,
+               self._job_threads(jobid),
+               jobid)
+        if self._scheduler == 'critical_path':
+            key = (-self._upward_rank(jobid),) + key
+        return key
+
+    def _estimate_resources(self, jobid):
+        """Learned memory estimates never exceed the memory of the plugin"""
+        estimate = super(MultiProcPlugin, self)._estimate_resources(jobid)
+        interface = self.procs[jobid]._interface
+        if estimate and (interface.learned_memory_gb or 0) > self.memory_gb:
+            interface.learned_memory_gb = self.memory_gb
+        return estimate
+
+    def _generate_dependency_list(self, graph):
+        self._ranks = {}
+        self._interface_runtimes = {}
+        super(MultiProcPlugin, self)._generate_dependency_list(graph)
+
+    def _runtime_estimate(self, jobid):
+        """Return the expected runtime of a job in seconds
+
+        The runtime of a job that is not estimated yet, as it is not ready,
+        is the mean runtime of its interface in the runtime history.
+        """
+        runtime = getattr(self.procs[jobid]._interface, 'estimated_runtime',
+                          None)
+        if runtime is None:
+            runtime = self._interface_runtime(jobid)
+        if runtime is None:
+            return self._default_runtime
+        return float(runtime)
+
+    def _interface_runtime(self, jobid):
+        """Return the mean runtime of the interface of a job in the runtime
+        history, on inputs of any size, or None"""
+        node = self.procs[jobid]
+        history = get_runtime_history(node.config)
+        if history is None:
+            return None
+        name = interface_name(node._interface)
+        if name not in self._interface_runtimes:
+            estimate = history.estimate(name)
+            self._interface_runtimes[name] = estimate and estimate['duration']
+        return self._interface_runtimes[name]
+
+    def _upward_rank(self, jobid):
+        """Return the expected runtime of the longest path from a job to the
+        end of the workflow, including the job itself
+
+        Ranks are computed when jobs become ready, while the dependents of
+        the job and of its successors are all still known, and are memoized.
+        """
+        stack = [jobid]
+        while stack:
+            top = stack[-1]
+            if top in self._ranks:
+                stack.pop()
+                continue
+            dependents = self._dependents.get(top, [])
+            missing = [depid for depid in dependents
+                       if depid not in self._ranks]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            self._ranks[top] = self._runtime_estimate(top) + max(
+                [self._ranks[depid] for depid in dependents] or [0])
+        return self._ranks[jobid]
+
     def _send_procs_to_workers(self, updatehash=False, graph=None):
         """ Sends jobs to workers when system resources are available.
             Check memory (gb) and cores usage before running jobs.
         """
         executing_now = []
 
-        # Check to see if a job is available
-        currently_running_jobids = np.flatnonzero((self.proc_pending == True) & \
-                                (self.depidx.sum(axis=0) == 0).__array__())
-
         # Check available system resources by summing all threads and memory used
         busy_memory_gb = 0
         busy_processors = 0
-        for jobid in currently_running_jobids:
+        for _, jobid in self.pending_tasks:
             if self.procs[jobid]._interface.estimated_memory_gb <= self.memory_gb and \
-                            self.procs[jobid]._interface.num_threads <= self.processors:
+                            self._job_threads(jobid) <= self.processors:
 
                 busy_memory_gb += self.procs[jobid]._interface.estimated_memory_gb
-                busy_processors += self.procs[jobid]._interface.num_threads
+                busy_processors += self._job_threads(jobid)
 
             else:
                 raise ValueError("Resources required by jobid %d (%f GB, %d threads)"
                                  "exceed what is available on the system (%f GB, %d threads)"%(jobid,
-                    self.procs[jobid].__interface.estimated_memory_gb,
-                    self.procs[jobid].__interface.num_threads,
+                    self.procs[jobid]._interface.estimated_memory_gb,
+                    self._job_threads(jobid),
                     self.memory_gb,self.processors))
 
         free_memory_gb = self.memory_gb - busy_memory_gb
         free_processors = self.processors - busy_processors
-
-        # Check all jobs without dependency not run
-        jobids = np.flatnonzero((self.proc_done == False) & \
-                                (self.depidx.sum(axis=0) == 0).__array__())
-
-        # Sort jobs ready to run first by memory and then by number of threads
-        # The most resource consuming jobs run first
-        jobids = sorted(jobids,
-                        key=lambda item: (self.procs[item]._interface.estimated_memory_gb,
-                                          self.procs[item]._interface.num_threads))
+        self._metrics.set('nipype_free_memory_gb', free_memory_gb)
+        self._metrics.set('nipype_free_processors', free_processors)
 
         if str2bool(config.get('execution', 'profile_runtime')):
             logger.debug('Free memory (GB): %d, Free processors: %d',
                          free_memory_gb, free_processors)
 
         # While have enough memory and processors for first job
-        # Submit first job on the list
-        for jobid in jobids:
+        # Submit first job on the ready queue
+        requeue = []
+        while True:
+            jobid = self._peek_ready()
+            if jobid is None:
+                break
             if str2bool(config.get('execution', 'profile_runtime')):
                 logger.debug('Next Job: %d, memory (GB): %d, threads: %d' \
                              % (jobid,
                                 self.procs[jobid]._interface.estimated_memory_gb,
-                                self.procs[jobid]._interface.num_threads))
+                                self._job_threads(jobid)))
 
             if self.procs[jobid]._interface.estimated_memory_gb <= free_memory_gb and \
-               self.procs[jobid]._interface.num_threads <= free_processors:
+               self._job_threads(jobid) <= free_processors:
+                self._pop_ready()
                 logger.info('Executing: %s ID: %d' %(self.procs[jobid]._id, jobid))
                 executing_now.append(self.procs[jobid])
 
+                try:
+                    self._load_inputs(jobid)
+                except Exception:
+                    etype, eval, etr = sys.exc_info()
+                    traceback = format_exception(etype, eval, etr)
+                    report_crash(self.procs[jobid], traceback=traceback)
+                    self._clean_queue(jobid, graph)
+                    self.proc_pending[jobid] = False
+                    continue
+
                 if isinstance(self.procs[jobid], MapNode):
                     try:
                         num_subnodes = self.procs[jobid].num_subnodes()
@@ -287,21 +518,20 @@ class MultiProcPlugin(DistributedPluginBase):
                 self.proc_done[jobid] = True
                 self.proc_pending[jobid] = True
 
-                free_memory_gb -= self.procs[jobid]._interface.estimated_memory_gb
-                free_processors -= self.procs[jobid]._interface.num_threads
-
                 # Send job to task manager and add to pending tasks
                 if self._status_callback:
                     self._status_callback(self.procs[jobid], 'start')
                 if str2bool(self.procs[jobid].config['execution']['local_hash_check']):
                     logger.debug('checking hash locally')
                     try:
-                        hash_exists, _, _, _ = self.procs[
-                            jobid].hash_exists()
+                        with self._metrics.timer('nipype_hash_check_seconds'):
+                            hash_exists, _, _, _ = self.procs[
+                                jobid].hash_exists()
                         logger.debug('Hash exists %s' % str(hash_exists))
                         if (hash_exists and (self.procs[jobid].overwrite == False or
                                              (self.procs[jobid].overwrite == None and
                                               not self.procs[jobid]._interface.always_run))):
+                            self._metrics.inc('nipype_nodes_cached_total')
                             self._task_finished_cb(jobid)
                             self._remove_node_dirs()
                             continue
@@ -323,17 +553,36 @@ class MultiProcPlugin(DistributedPluginBase):
                         etype, eval, etr = sys.exc_info()
                         traceback = format_exception(etype, eval, etr)
                         report_crash(self.procs[jobid], traceback=traceback)
-                    self._task_finished_cb(jobid)
+                    self._task_finished_cb(jobid,
+                                           result=self.procs[jobid]._result)
                     self._remove_node_dirs()
 
                 else:
                     logger.debug('MultiProcPlugin submitting %s' % str(jobid))
-                    tid = self._submit_job(deepcopy(self.procs[jobid]),
-                                           updatehash=updatehash)
+                    node = self.procs[jobid]
+                    if not self._ship_by_file:
+                        # pickling the node to a file already takes a copy
+                        node = deepcopy(node)
+                    tid = self._submit_job(node, updatehash=updatehash)
                     if tid is None:
                         self.proc_done[jobid] = False
                         self.proc_pending[jobid] = False
+                        requeue.append(jobid)
                     else:
+                        self._observe_submission(jobid)
                         self.pending_tasks.insert(0, (tid, jobid))
+                        free_memory_gb -= self.procs[jobid]._interface.estimated_memory_gb
+                        free_processors -= self._job_threads(jobid)
+                        self._metrics.set('nipype_free_memory_gb',
+                                          free_memory_gb)
+                        self._metrics.set('nipype_free_processors',
+                                          free_processors)
             else:
-                break
+                # leave the job queued and try the next ones, which may fit
+                # in the remaining resources
+                self._pop_ready()
+                requeue.append(jobid)
+                if free_processors <= 0:
+                    break
+        for jobid in requeue:
+            heappush(self._ready, (self._ready_key(jobid), jobid))
@@ -24,6 +24,9 @@ class OARPlugin(SGELikeBatchManagerBase):
     - oarsub_args : arguments to be prepended to the job execution
                     script in the oarsub call
     - max_jobname_len: maximum length of the job name.  Default 15.
+    - request_resources: request the ``num_threads`` of each node as cores
+      of a single node with ``-l``, unless oarsub_args already set ``-l``.
+      OAR has no standard memory request.
 
     """
 
@@ -50,23 +53,36 @@ class OARPlugin(SGELikeBatchManagerBase):
                     kwargs['plugin_args']['max_jobname_len']
         super(OARPlugin, self).__init__(template, **kwargs)
 
-    def _is_pending(self, taskid):
+    def _query_pending(self, taskids):
         #  subprocess.Popen requires taskid to be a string
+        args = ['oarstat', '-J', '-s']
+        for taskid in taskids:
+            args.extend(['-j', str(taskid)])
         proc = subprocess.Popen(
-            ['oarstat', '-J', '-s',
-             '-j', taskid],
+            args,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+            stderr=subprocess.PIPE,
+            universal_newlines=True
         )
         o, e = proc.communicate()
-        parsed_result = json.loads(o)[taskid].lower()
-        is_pending = (
-            ('error' not in parsed_result) and
-            ('terminated' not in parsed_result)
-        )
-        return is_pending
-
-    def _submit_batchtask(self, scriptfile, node):
+        try:
+            states = json.loads(o)
+        except ValueError:
+            return None
+        pending = []
+        for taskid in taskids:
+            parsed_result = states.get(str(taskid), 'terminated').lower()
+            if ('error' not in parsed_result and
+                    'terminated' not in parsed_result):
+                pending.append(taskid)
+        return pending
+
+    def _resource_args(self, memory_mb, threads):
+        if threads > 1:
+            return [(('-l',), '-l /nodes=1/core=%d' % threads)]
+        return []
+
+    def _submit_batchtask(self, scriptfile, node, procs=1):
         cmd = CommandLine('oarsub', environ=dict(os.environ),
                           terminal_output='allatonce')
         path = os.path.dirname(scriptfile)
@@ -81,6 +97,7 @@ class OARPlugin(SGELikeBatchManagerBase):
                 oarsubargs = node.plugin_args['oarsub_args']
             else:
                 oarsubargs += (" " + node.plugin_args['oarsub_args'])
+        oarsubargs = self._add_resource_args(oarsubargs, node, procs)
 
         if node._hierarchy:
             jobname = '.'.join((dict(os.environ)['LOGNAME'],
@@ -5,6 +5,7 @@ from __future__ import print_function, division, unicode_literals, absolute_impo
 from builtins import str, open
 
 import os
+import re
 from time import sleep
 import subprocess
 
@@ -23,11 +24,19 @@ class PBSPlugin(SGELikeBatchManagerBase):
     - qsub_args : arguments to be prepended to the job execution script in the
                   qsub call
     - max_jobname_len: maximum length of the job name.  Default 15.
+    - request_resources: request the ``estimated_memory_gb`` and
+      ``num_threads`` of each node with ``-l mem=`` and ``-l nodes=1:ppn=``,
+      unless qsub_args already set them
+
+    Nodes can be submitted in bundles, as Torque array jobs with
+    ``bundle_mode`` set to ``array`` (see :class:`SGELikeBatchManagerBase`).
 
     """
 
     # Addtional class variables
     _max_jobname_len = 15
+    _array_directive = '#PBS -t 1-%d'
+    _array_index = 'PBS_ARRAYID'
 
     def __init__(self, **kwargs):
         template = """
@@ -45,16 +54,26 @@ class PBSPlugin(SGELikeBatchManagerBase):
                 self._max_jobname_len = kwargs['plugin_args']['max_jobname_len']
         super(PBSPlugin, self).__init__(template, **kwargs)
 
-    def _is_pending(self, taskid):
+    def _query_pending(self, taskids):
         #  subprocess.Popen requires taskid to be a string
-        proc = subprocess.Popen(["qstat", str(taskid)],
+        proc = subprocess.Popen(["qstat"] + [str(taskid) for taskid in taskids],
                                 stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
+                                stderr=subprocess.PIPE,
+                                universal_newlines=True)
         _, e = proc.communicate()
-        errmsg = 'Unknown Job Id'  # %s' % taskid
-        return errmsg not in e
+        # qstat reports each job it does not know on its own line
+        unknown = set(jobid.split('.')[0] for jobid in
+                      re.findall(r'Unknown Job Id(?: Error)? (\S+)', e))
+        # qstat also fails when the server cannot be reached
+        if proc.returncode and not unknown:
+            return None
+        return [taskid for taskid in taskids if str(taskid) not in unknown]
+
+    def _resource_args(self, memory_mb, threads):
+        return [(('mem=',), '-l mem=%dmb' % memory_mb),
+                (('ppn=',), '-l nodes=1:ppn=%d' % threads)]
 
-    def _submit_batchtask(self, scriptfile, node):
+    def _submit_batchtask(self, scriptfile, node, procs=1):
         cmd = CommandLine('qsub', environ=dict(os.environ),
                           terminal_output='allatonce')
         path = os.path.dirname(scriptfile)
@@ -67,6 +86,7 @@ class PBSPlugin(SGELikeBatchManagerBase):
                 qsubargs = node.plugin_args['qsub_args']
             else:
                 qsubargs += (" " + node.plugin_args['qsub_args'])
+        qsubargs = self._add_resource_args(qsubargs, node, procs)
         if '-o' not in qsubargs:
             qsubargs = '%s -o %s' % (qsubargs, path)
         if '-e' not in qsubargs:
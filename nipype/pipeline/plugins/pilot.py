@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Parallel workflow execution with a pool of long-lived pilot workers
+
+The master and the workers share a queue directory, which must be on a file
+system visible to all of them::
+
+    tasks/      pyscripts of the nodes waiting for a worker
+    running/    tasks claimed by a worker, as <worker>.<task>
+    done/       finished tasks
+    workers/    heartbeat file of every live worker
+    exited/     workers that have stopped
+    stop        created by the master when the workflow is done
+
+Workers claim tasks by atomically renaming them, and run their pyscript in
+their own interpreter, so that the cost of starting python, importing nipype
+and waiting in the queue of the batch system is paid once per worker rather
+than once per node.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+from builtins import open, str
+
+import os
+import os.path as op
+import subprocess
+import sys
+import threading
+import uuid
+from runpy import run_path
+from time import sleep, time
+from traceback import print_exc
+
+from .base import (SGELikeBatchManagerBase, create_pyscript, logger)
+
+
+def _touch(filename):
+    with open(filename, 'a'):
+        os.utime(filename, None)
+
+
+def _claim_task(queue_dir, worker_id):
+    """Claim the oldest queued task, and return the path of the claimed task
+    file and its pyscript, or None if no task is queued"""
+    tasks_dir = op.join(queue_dir, 'tasks')
+    for name in sorted(os.listdir(tasks_dir)):
+        claimed = op.join(queue_dir, 'running', '%s.%s' % (worker_id, name))
+        try:
+            os.rename(op.join(tasks_dir, name), claimed)
+        except OSError:
+            # claimed by another worker
+            continue
+        with open(claimed, 'rt') as fp:
+            return claimed, fp.read().strip()
+    return None
+
+
+def run_worker(queue_dir, worker_id, idle_timeout=60., poll_interval=1.):
+    """Run the tasks of a pilot queue, until the master asks the workers to
+    stop or no task was queued for idle_timeout seconds"""
+    heartbeat = op.join(queue_dir, 'workers', worker_id)
+    stopfile = op.join(queue_dir, 'stop')
+    _touch(heartbeat)
+    stopped = threading.Event()
+
+    def beat():
+        while not stopped.wait(poll_interval):
+            _touch(heartbeat)
+
+    beater = threading.Thread(target=beat)
+    beater.daemon = True
+    beater.start()
+    idle_since = time()
+    try:
+        while not op.exists(stopfile):
+            task = _claim_task(queue_dir, worker_id)
+            if task is None:
+                if time() - idle_since > idle_timeout:
+                    break
+                sleep(poll_interval)
+                continue
+            claimed, pyscript = task
+            try:
+                run_path(pyscript, run_name='__main__')
+            except Exception:
+                print_exc()
+            name = op.basename(claimed)[len(worker_id) + 1:]
+            os.rename(claimed, op.join(queue_dir, 'done', name))
+            idle_since = time()
+    finally:
+        stopped.set()
+        os.rename(heartbeat, op.join(queue_dir, 'exited', worker_id))
+
+
+class PilotPlugin(SGELikeBatchManagerBase):
+    """Execute workflow with a pool of pilot workers pulling nodes from a
+    queue on a shared file system
+
+    Workers are started as the queue fills up, locally or through a batch
+    system, and each runs nodes until the workflow is done or it found no
+    node to run for ``idle_timeout`` seconds, which gives allocations back
+    as the workflow winds down.
+
+    The plugin_args input to run can be used to control the execution.
+    Currently supported options are:
+
+    - n_workers : maximum number of workers (default 4)
+    - launcher : command submitting a batch script starting a worker, e.g.
+      ``sbatch`` or ``qsub``. Workers are started as local processes by
+      default
+    - launcher_args : arguments of the launcher command
+    - template : template of the batch scripts starting the workers
+    - idle_timeout : seconds after which an idle worker stops (default 60)
+    - heartbeat_timeout : seconds after which a worker that did not report
+      is considered dead, and the node it was running failed (default 60)
+    - startup_timeout : seconds after which a worker that never reported
+      (e.g. a batch job still queued, cancelled or failing before it ran) is
+      considered dead, and replaced (default 3600)
+    - queue_dir : directory of the queue, on a file system shared with the
+      workers (default: a new directory in the batch directory of the
+      workflow)
+
+    After ``n_workers`` workers in a row failed to start, no worker is
+    started anymore and the queued nodes fail.
+
+    """
+
+    def __init__(self, **kwargs):
+        template = '#!/bin/sh'
+        self._n_workers = 4
+        self._launcher = None
+        self._launcher_args = ''
+        self._idle_timeout = 60.
+        self._heartbeat_timeout = 60.
+        self._startup_timeout = 3600.
+        self._queue_root = None
+        plugin_args = kwargs.get('plugin_args') or {}
+        if 'n_workers' in plugin_args:
+            self._n_workers = int(plugin_args['n_workers'])
+        if 'launcher' in plugin_args:
+            self._launcher = plugin_args['launcher']
+        if 'launcher_args' in plugin_args:
+            self._launcher_args = plugin_args['launcher_args']
+        if 'idle_timeout' in plugin_args:
+            self._idle_timeout = float(plugin_args['idle_timeout'])
+        if 'heartbeat_timeout' in plugin_args:
+            self._heartbeat_timeout = float(plugin_args['heartbeat_timeout'])
+        if 'startup_timeout' in plugin_args:
+            self._startup_timeout = float(plugin_args['startup_timeout'])
+        if 'queue_dir' in plugin_args:
+            self._queue_root = plugin_args['queue_dir']
+        self._queue_dir = None
+        self._taskid = 0
+        self._reset_workers()
+        super(PilotPlugin, self).__init__(template, **kwargs)
+
+    def _reset_workers(self):
+        self._workers = {}
+        self._launches = 0
+        self._launch_times = {}
+        self._dead = set()
+        self._startup_failures = 0
+        self._startup_error = None
+
+    def run(self, graph, config, updatehash=False, subgraphs=None):
+        self._queue_dir = None
+        self._reset_workers()
+        try:
+            super(PilotPlugin, self).run(graph, config, updatehash=updatehash,
+                                         subgraphs=subgraphs)
+        finally:
+            # workers also stop when the scheduler exits on an error
+            if self._queue_dir is not None:
+                _touch(op.join(self._queue_dir, 'stop'))
+
+    def _setup_queue(self, batch_dir):
+        root = self._queue_root or batch_dir
+        self._queue_dir = op.join(root, 'pilot_%s' % uuid.uuid4().hex[:8])
+        for subdir in ('tasks', 'running', 'done', 'workers', 'exited'):
+            os.makedirs(op.join(self._queue_dir, subdir))
+        poll_interval = min(
+            float(self._config['execution']['poll_sleep_duration']),
+            self._heartbeat_timeout / 10)
+        with open(op.join(self._queue_dir, 'worker.py'), 'wt') as fp:
+            fp.write("""import sys
+from nipype.pipeline.plugins.pilot import run_worker
+
+run_worker('%s', sys.argv[1], idle_timeout=%r, poll_interval=%r)
+""" % (self._queue_dir, self._idle_timeout, poll_interval))
+        logger.info('Pilot queue: %s' % self._queue_dir)
+
+    @staticmethod
+    def _task_name(taskid):
+        return 'task_%08d' % taskid
+
+    def _submit_job(self, node, updatehash=False):
+        """Queue the pyscript of a node for the workers"""
+        pyscript = create_pyscript(node, updatehash=updatehash)
+        if self._queue_dir is None:
+            self._setup_queue(op.dirname(pyscript))
+        self._taskid += 1
+        name = self._task_name(self._taskid)
+        # workers never see partially written task files
+        tmpfile = op.join(self._queue_dir, name)
+        with open(tmpfile, 'wt') as fp:
+            fp.write(pyscript)
+        os.rename(tmpfile, op.join(self._queue_dir, 'tasks', name))
+        self._pending[self._taskid] = node.output_dir()
+        return self._taskid
+
+    def _worker_alive(self, worker_id):
+        """Whether a launched worker has neither stopped nor missed its
+        heartbeats; workers waiting to start count as alive for
+        startup_timeout seconds"""
+        if op.exists(op.join(self._queue_dir, 'exited', worker_id)):
+            return False
+        worker = self._workers.get(worker_id)
+        if isinstance(worker, subprocess.Popen) and worker.poll() is not None:
+            return False
+        try:
+            last_beat = op.getmtime(op.join(self._queue_dir, 'workers',
+                                            worker_id))
+        except OSError:
+            return time() - self._launch_times.get(worker_id, time()) < \
+                self._startup_timeout
+        return time() - last_beat < self._heartbeat_timeout
+
+    def _worker_started(self, worker_id):
+        """Whether a worker has ever reported"""
+        return any(op.exists(op.join(self._queue_dir, subdir, worker_id))
+                   for subdir in ('workers', 'exited'))
+
+    def _get_result(self, taskid):
+        if self._startup_error is not None:
+            # no worker will ever run the queued nodes
+            try:
+                os.remove(op.join(self._queue_dir, 'tasks',
+                                  self._task_name(taskid)))
+            except OSError:
+                pass
+            else:
+                return {'result': None, 'hostname': 'unknown',
+                        'traceback': self._startup_error}
+        return super(PilotPlugin, self)._get_result(taskid)
+
+    def _is_pending(self, taskid):
+        name = self._task_name(taskid)
+        if op.exists(op.join(self._queue_dir, 'tasks', name)):
+            return True
+        for claimed in os.listdir(op.join(self._queue_dir, 'running')):
+            if claimed.endswith('.' + name):
+                # the node of a dead worker has failed
+                return self._worker_alive(claimed[:-len(name) - 1])
+        return False
+
+    def _send_procs_to_workers(self, updatehash=False, graph=None):
+        super(PilotPlugin, self)._send_procs_to_workers(
+            updatehash=updatehash, graph=graph)
+        if self._queue_dir is not None:
+            self._scale_workers()
+
+    def _scale_workers(self):
+        """Start workers until there is one per queued or running node, up to
+        n_workers"""
+        if self._startup_error is not None:
+            return
+        alive = []
+        for worker_id in list(self._workers):
+            if self._worker_alive(worker_id):
+                alive.append(worker_id)
+                if self._worker_started(worker_id):
+                    self._startup_failures = 0
+            elif worker_id not in self._dead:
+                self._dead.add(worker_id)
+                if not self._worker_started(worker_id):
+                    self._startup_failed(worker_id, 'did not start')
+        busy = len(os.listdir(op.join(self._queue_dir, 'tasks'))) + \
+            len(os.listdir(op.join(self._queue_dir, 'running')))
+        for _ in range(min(self._n_workers, busy) - len(alive)):
+            if self._startup_error is not None:
+                break
+            self._launch_worker()
+
+    def _startup_failed(self, worker_id, reason):
+        """Count a worker that failed to start, and give up starting workers
+        after n_workers failures in a row"""
+        self._startup_failures += 1
+        logfile = op.join(self._queue_dir, '%s.log' % worker_id)
+        logger.warning('Pilot worker %s %s, see %s' % (worker_id, reason,
+                                                       logfile))
+        if self._startup_failures >= self._n_workers:
+            self._startup_error = (
+                '%d pilot workers in a row failed to start, the last one '
+                '(%s) %s. See the logs of the workers in %s' % (
+                    self._startup_failures, worker_id, reason,
+                    self._queue_dir))
+            logger.error(self._startup_error)
+
+    def _launch_worker(self):
+        self._launches += 1
+        worker_id = 'worker%03d' % self._launches
+        workerfile = op.join(self._queue_dir, 'worker.py')
+        logfile = op.join(self._queue_dir, '%s.log' % worker_id)
+        if self._launcher is None:
+            with open(logfile, 'wb') as log:
+                self._workers[worker_id] = subprocess.Popen(
+                    [sys.executable, workerfile, worker_id],
+                    stdout=log, stderr=subprocess.STDOUT)
+        else:
+            batchscript = op.join(self._queue_dir, '%s.sh' % worker_id)
+            with open(batchscript, 'wt') as fp:
+                fp.write('\n'.join((self._template, '%s %s %s > %s 2>&1' % (
+                    sys.executable, workerfile, worker_id, logfile))))
+            proc = subprocess.Popen(
+                '%s %s %s' % (self._launcher, self._launcher_args,
+                              batchscript),
+                shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True)
+            out, err = proc.communicate()
+            if proc.returncode:
+                # retried at the next scheduling round
+                self._startup_failed(worker_id, 'could not be submitted:\n%s'
+                                     % err.strip())
+                return
+            self._workers[worker_id] = out.strip()
+        self._launch_times[worker_id] = time()
+        logger.info('Started pilot worker %s' % worker_id)
+
+    def _close(self):
+        if self._queue_dir is not None:
+            _touch(op.join(self._queue_dir, 'stop'))
+        for worker in self._workers.values():
+            if isinstance(worker, subprocess.Popen):
+                worker.wait()
+        return True
@@ -5,6 +5,7 @@ from __future__ import print_function, division, unicode_literals, absolute_impo
 
 from builtins import object
 
+import math
 import os
 import pwd
 import re
@@ -151,7 +152,8 @@ class QstatSubstitute(object):
                 proc = subprocess.Popen(
                     [this_command, '-o', pwd.getpwuid(os.getuid())[0], '-j', str(taskid)],
                     stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE)
+                    stderr=subprocess.PIPE,
+                    universal_newlines=True)
                 qacct_result, _ = proc.communicate()
                 if qacct_result.find(str(taskid)):
                     is_complete = True
@@ -333,9 +335,21 @@ class SGEPlugin(SGELikeBatchManagerBase):
     - template : template to use for batch job submission
     - qsub_args : arguments to be prepended to the job execution script in the
                   qsub call
+    - request_resources : request the ``estimated_memory_gb`` and
+                          ``num_threads`` of each node with ``-l h_vmem``
+                          (per slot) and ``-pe``, unless qsub_args already
+                          set them
+    - parallel_environment : parallel environment of the jobs requesting
+                             several threads.  Default ``smp``.
+
+    Nodes can be submitted in bundles, as array jobs with ``bundle_mode`` set
+    to ``array`` (see :class:`SGELikeBatchManagerBase`).
 
     """
 
+    _array_directive = '#$ -t 1-%d'
+    _array_index = 'SGE_TASK_ID'
+
     def __init__(self, **kwargs):
         template = """
 #$ -V
@@ -343,6 +357,7 @@ class SGEPlugin(SGELikeBatchManagerBase):
         """
         self._retry_timeout = 2
         self._max_tries = 2
+        self._parallel_environment = 'smp'
         instant_qstat = 'qstat'
         cached_qstat = 'qstat'
 
@@ -355,6 +370,9 @@ class SGEPlugin(SGELikeBatchManagerBase):
                 instant_qstat = kwargs['plugin_args']['qstatProgramPath']
             if 'qstatCachedProgramPath' in kwargs['plugin_args']:
                 cached_qstat = kwargs['plugin_args']['qstatCachedProgramPath']
+            if 'parallel_environment' in kwargs['plugin_args']:
+                self._parallel_environment = \
+                    kwargs['plugin_args']['parallel_environment']
         self._refQstatSubstitute = QstatSubstitute(instant_qstat, cached_qstat)
 
         super(SGEPlugin, self).__init__(template, **kwargs)
@@ -362,7 +380,16 @@ class SGEPlugin(SGELikeBatchManagerBase):
     def _is_pending(self, taskid):
         return self._refQstatSubstitute.is_job_pending(int(taskid))
 
-    def _submit_batchtask(self, scriptfile, node):
+    def _resource_args(self, memory_mb, threads):
+        # h_vmem is a limit per slot
+        args = [(('h_vmem',),
+                 '-l h_vmem=%dM' % int(math.ceil(memory_mb / threads)))]
+        if threads > 1:
+            args.append((('-pe',), '-pe %s %d' % (self._parallel_environment,
+                                                  threads)))
+        return args
+
+    def _submit_batchtask(self, scriptfile, node, procs=1):
         cmd = CommandLine('qsub', environ=dict(os.environ),
                           terminal_output='allatonce')
         path = os.path.dirname(scriptfile)
@@ -375,6 +402,7 @@ class SGEPlugin(SGELikeBatchManagerBase):
                 qsubargs = node.plugin_args['qsub_args']
             else:
                 qsubargs += (" " + node.plugin_args['qsub_args'])
+        qsubargs = self._add_resource_args(qsubargs, node, procs)
         if '-o' not in qsubargs:
             qsubargs = '%s -o %s' % (qsubargs, path)
         if '-e' not in qsubargs:
@@ -415,8 +443,8 @@ class SGEPlugin(SGELikeBatchManagerBase):
         iflogger.setLevel(oldlevel)
         # retrieve sge taskid
         lines = [line for line in result.runtime.stdout.split('\n') if line]
-        taskid = int(re.match("Your job ([0-9]*) .* has been submitted",
-                              lines[-1]).groups()[0])
+        taskid = int(re.match("Your job(?:-array)? ([0-9]+)[ .].* has been "
+                              "submitted", lines[-1]).groups()[0])
         self._pending[taskid] = node.output_dir()
         self._refQstatSubstitute.add_startup_job(taskid, cmd.cmdline)
         logger.debug('submitted sge task: %d for node %s with %s' %
@@ -118,7 +118,7 @@ class SGEGraphPlugin(GraphPluginBase):
                     with open(batchscriptfile, 'wt') as batchfp:
                         batchfp.writelines(batchscript)
                         batchfp.close()
-                    os.chmod(batchscriptfile, 0744)
+                    os.chmod(batchscriptfile, 0o744)
                     deps = ''
                     if idx in dependencies:
                         values = ' '
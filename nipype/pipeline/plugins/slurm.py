@@ -10,6 +10,7 @@ from builtins import open
 
 import os
 import re
+import subprocess
 from time import sleep
 
 from ...interfaces.base import CommandLine
@@ -28,9 +29,21 @@ class SLURMPlugin(SGELikeBatchManagerBase):
 
     - sbatch_args: arguments to pass prepend to the sbatch call
 
+    - request_resources: request the ``estimated_memory_gb`` and
+      ``num_threads`` of the interface of each node with ``--mem`` and
+      ``--cpus-per-task``, unless sbatch_args already set them (see
+      :class:`SGELikeBatchManagerBase`). Serial bundles request the
+      resources of the ``bundle_procs`` nodes they run at once.
+
+
+    Nodes can be submitted in bundles, as array jobs with ``bundle_mode``
+    set to ``array`` (see :class:`SGELikeBatchManagerBase`).
 
     '''
 
+    _array_directive = '#SBATCH --array=1-%d'
+    _array_index = 'SLURM_ARRAY_TASK_ID'
+
     def __init__(self, **kwargs):
 
         template = "#!/bin/bash"
@@ -58,14 +71,39 @@ class SLURMPlugin(SGELikeBatchManagerBase):
         self._pending = {}
         super(SLURMPlugin, self).__init__(self._template, **kwargs)
 
-    def _is_pending(self, taskid):
+    def _query_pending(self, taskids):
         #  subprocess.Popen requires taskid to be a string
-        res = CommandLine('squeue',
-                          args=' '.join(['-j', '%s' % taskid]),
-                          terminal_output='allatonce').run()
-        return res.runtime.stdout.find(str(taskid)) > -1
-
-    def _submit_batchtask(self, scriptfile, node):
+        proc = subprocess.Popen(
+            ['squeue', '-h', '-o', '%i',
+             '-j', ','.join('%s' % taskid for taskid in taskids)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        o, e = proc.communicate()
+        if proc.returncode:
+            if 'Invalid job id' not in e:
+                logger.warning('squeue failed: %s', e.strip())
+                return None
+            # squeue fails when asked about a job it no longer knows: ask
+            # about each job
+            if len(taskids) == 1:
+                return []
+            pending = []
+            for taskid in taskids:
+                job_pending = self._query_pending([taskid])
+                if job_pending is None:
+                    return None
+                pending.extend(job_pending)
+            return pending
+        # the tasks of array jobs are listed as <jobid>_<index>
+        listed = set(jobid.split('_')[0] for jobid in o.split())
+        return [taskid for taskid in taskids if str(taskid) in listed]
+
+    def _resource_args(self, memory_mb, threads):
+        return [(('--mem',), '--mem=%dM' % memory_mb),
+                (('--cpus-per-task', '-c '),
+                 '--cpus-per-task=%d' % threads)]
+
+    def _submit_batchtask(self, scriptfile, node, procs=1):
         """
         This is more or less the _submit_batchtask from sge.py with flipped
         variable names, different command line switches, and different output
@@ -84,6 +122,7 @@ class SLURMPlugin(SGELikeBatchManagerBase):
                 sbatch_args = node.plugin_args['sbatch_args']
             else:
                 sbatch_args += (" " + node.plugin_args['sbatch_args'])
+        sbatch_args = self._add_resource_args(sbatch_args, node, procs)
         if '-o' not in sbatch_args:
             sbatch_args = '%s -o %s' % (sbatch_args, os.path.join(path, 'slurm-%j.out'))
         if '-e' not in sbatch_args:
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+import nipype.interfaces.base as nib
+import nipype.pipeline.engine as pe
+from nipype.interfaces.utility import Function
+
+
+class InputSpec(nib.TraitedSpec):
+    input1 = nib.traits.Int(desc='a random int')
+    input2 = nib.traits.Int(desc='a random int')
+
+
+class OutputSpec(nib.TraitedSpec):
+    output1 = nib.traits.List(nib.traits.Int, desc='outputs')
+
+
+class AsyncTestInterface(nib.BaseInterface):
+    input_spec = InputSpec
+    output_spec = OutputSpec
+
+    def _run_interface(self, runtime):
+        runtime.returncode = 0
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['output1'] = [1, self.inputs.input1]
+        return outputs
+
+
+@pytest.mark.parametrize('ship_nodes_by_file', [False, True])
+def test_run_asyncmultiproc(tmpdir, ship_nodes_by_file):
+    os.chdir(str(tmpdir))
+
+    pipe = pe.Workflow(name='pipe')
+    mod1 = pe.Node(interface=AsyncTestInterface(), name='mod1')
+    mod2 = pe.MapNode(interface=AsyncTestInterface(),
+                      iterfield=['input1'],
+                      name='mod2')
+    pipe.connect([(mod1, mod2, [('output1', 'input1')])])
+    pipe.base_dir = os.getcwd()
+    mod1.inputs.input1 = 1
+    execgraph = pipe.run(plugin="AsyncMultiProc",
+                         plugin_args={'n_procs': 2,
+                                      'ship_nodes_by_file': ship_nodes_by_file})
+    names = ['.'.join((node._hierarchy, node.name)) for node in execgraph.nodes()]
+    node = execgraph.nodes()[names.index('pipe.mod2')]
+    result = node.get_output('output1')
+    assert result == [[1, 1], [1, 1]]
+
+
+def fail_on_two(arg1):
+    if arg1 == 2:
+        raise Exception('arg cannot be ' + str(arg1))
+    return arg1
+
+
+def test_asyncmultiproc_crash(tmpdir):
+    os.chdir(str(tmpdir))
+
+    pipe = pe.Workflow(name='pipe', base_dir=os.getcwd())
+    pipe.config['execution']['crashdump_dir'] = os.getcwd()
+    failing = pe.Node(Function(function=fail_on_two, input_names=['arg1'],
+                               output_names=['out']), name='failing')
+    failing.inputs.arg1 = 2
+    after = pe.Node(Function(function=fail_on_two, input_names=['arg1'],
+                             output_names=['out']), name='after')
+    other = pe.Node(Function(function=fail_on_two, input_names=['arg1'],
+                             output_names=['out']), name='other')
+    other.inputs.arg1 = 1
+    pipe.connect(failing, 'out', after, 'arg1')
+    pipe.add_nodes([other])
+    with pytest.raises(RuntimeError):
+        pipe.run(plugin='AsyncMultiProc', plugin_args={'n_procs': 2})
+    assert os.path.exists(os.path.join(os.getcwd(), 'pipe', 'other',
+                                       'result_other.pklz'))
+    assert not os.path.exists(os.path.join(os.getcwd(), 'pipe', 'after'))
@@ -8,6 +8,7 @@ import scipy.sparse as ssp
 import re
 
 import mock
+import pytest
 
 import nipype.pipeline.plugins.base as pb
 
@@ -62,3 +63,122 @@ wf.base_dir = '/tmp'
 
 wf.run(plugin='MultiProc')
 '''
+
+
+class DummyNode(object):
+    def __init__(self, name):
+        self._id = name
+        self.name = name
+        self._hierarchy = 'wf'
+        self.config = {'execution': {'local_hash_check': 'false',
+                                     'stop_on_first_crash': 'false'}}
+        self.run_without_submitting = False
+        self._got_inputs = False
+
+    def _get_inputs(self, results_cache=None):
+        pass
+
+    def output_dir(self):
+        return '/wf/%s' % self.name
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class InstantPlugin(pb.DistributedPluginBase):
+    """Plugin that completes every submitted job before the next tick"""
+
+    def __init__(self, fail=None, **kwargs):
+        super(InstantPlugin, self).__init__(**kwargs)
+        self.fail = fail or []
+        self.submitted = []
+
+    def _submit_job(self, node, updatehash=False):
+        self.submitted.append(node._id)
+        return len(self.submitted)
+
+    def _get_result(self, taskid):
+        traceback = None
+        if self.submitted[taskid - 1] in self.fail:
+            traceback = ['failed']
+        return dict(result=None, traceback=traceback)
+
+    def _report_crash(self, node, result=None):
+        return None
+
+    def _clear_task(self, taskid):
+        pass
+
+    def _wait(self):
+        pass
+
+
+def _diamond_graph():
+    import networkx as nx
+    nodes = dict((name, DummyNode(name)) for name in 'abcde')
+    graph = nx.DiGraph()
+    graph.add_edges_from([(nodes['a'], nodes['b']), (nodes['a'], nodes['c']),
+                          (nodes['b'], nodes['d']), (nodes['c'], nodes['d'])])
+    graph.add_node(nodes['e'])
+    return graph
+
+
+def _run_config():
+    return {'execution': {'poll_sleep_duration': 0,
+                          'stop_on_first_crash': 'false',
+                          'remove_node_directories': 'false'}}
+
+
+def test_scheduler_dependency_order():
+    plugin = InstantPlugin(plugin_args={'max_jobs': 1})
+    plugin.run(_diamond_graph(), _run_config())
+    order = plugin.submitted
+    assert sorted(order) == ['a', 'b', 'c', 'd', 'e']
+    assert order.index('a') < order.index('b') < order.index('d')
+    assert order.index('a') < order.index('c') < order.index('d')
+    assert not plugin.depcount.any()
+    assert plugin.proc_done.all() and not plugin.proc_pending.any()
+
+
+def test_scheduler_crash_skips_dependents():
+    plugin = InstantPlugin(fail=['b'])
+    with pytest.raises(RuntimeError):
+        plugin.run(_diamond_graph(), _run_config())
+    assert 'd' not in plugin.submitted
+    assert sorted(plugin.submitted) == ['a', 'b', 'c', 'e']
+
+
+def test_results_cache(tmpdir):
+    from nipype.interfaces.base import Bunch, InterfaceResult
+    from nipype.utils.filemanip import loadpkl, savepkl
+
+    def make_node(name):
+        node = mock.MagicMock(name=name)
+        node.name = name
+        node.output_dir.return_value = tmpdir.join(name).strpath
+        node.config = {'execution': {'use_relative_paths': 'false'}}
+        tmpdir.mkdir(name)
+        return node
+
+    node_a, node_b = make_node('a'), make_node('b')
+    file_a = pb.ResultsCache.results_file(node_a)
+    file_b = pb.ResultsCache.results_file(node_b)
+    savepkl(file_a, InterfaceResult(None, Bunch(), outputs=Bunch(out=1)))
+
+    cache = pb.ResultsCache(maxsize=1)
+    with mock.patch('nipype.pipeline.plugins.base.loadpkl',
+                    mock.MagicMock(side_effect=loadpkl)) as mock_loadpkl:
+        assert cache.get_outputs(file_a).out == 1
+        assert cache.get_outputs(file_a).out == 1
+        assert mock_loadpkl.call_count == 1
+        # outputs of finished nodes are cached without reading their file
+        cache.add(node_b, InterfaceResult(None, Bunch(),
+                                          outputs=Bunch(out=2)))
+        assert cache.get_outputs(file_b).out == 2
+        assert mock_loadpkl.call_count == 1
+        # the least recently used entry was evicted
+        assert cache.get_outputs(file_a).out == 1
+        assert mock_loadpkl.call_count == 2
+        cache.discard(node_a)
+        assert cache.get_outputs(file_a).out == 1
+        assert mock_loadpkl.call_count == 3
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Submission of bundles of nodes by the SGE-like batch plugins"""
+import os
+import stat
+import sys
+
+import pytest
+
+import nipype
+import nipype.pipeline.engine as pe
+from nipype.interfaces.utility import Function
+from nipype.pipeline.plugins.base import _add_directive
+from nipype.pipeline.plugins.slurm import SLURMPlugin
+from nipype.pipeline.plugins.sge import SGEPlugin
+from nipype.pipeline.plugins.pbs import PBSPlugin
+from nipype.pipeline.plugins.lsf import LSFPlugin
+from nipype.pipeline.plugins.oar import OARPlugin
+from nipype.pipeline.plugins.condor import CondorPlugin
+
+# The fake submit command runs the batch script right away, once per task
+# of an array job, and prints the job id
+FAKE_SUBMIT = """#!%(python)s
+import os, re, subprocess, sys
+log = %(log)r
+with open(log, 'a') as fp:
+    fp.write(' '.join(sys.argv[1:]) + '\\n')
+with open(log) as fp:
+    jobid = len(fp.readlines())
+script = sys.argv[-1]
+with open(script) as fp:
+    array = re.search(r'^%(directive)s', fp.read(), re.M)
+for index in range(1, int(array.group(1)) + 1 if array else 2):
+    env = dict(os.environ)
+    if array:
+        env[%(index_var)r] = str(index)
+    with open(script + '.out', 'a') as out:
+        subprocess.check_call(['sh', script], env=env, stdout=out,
+                              stderr=subprocess.STDOUT)
+print(%(output)r %% jobid)
+"""
+
+# plugin, submit command, output, status commands and their fake output (no
+# job is ever pending), array directive pattern and task index variable
+FAKE_BATCH = {
+    'SLURM': ('sbatch', 'Submitted batch job %d', {'squeue': 'true'},
+              r'#SBATCH --array=1-(\d+)', 'SLURM_ARRAY_TASK_ID'),
+    'PBS': ('qsub', '%d.server', {'qstat':
+            'for id in "$@"; do echo "Unknown Job Id Error $id" >&2; done\n'
+            'exit 153'}, r'#PBS -t 1-(\d+)', 'PBS_ARRAYID'),
+    'SGE': ('qsub', 'Your job %d ("bundle") has been submitted',
+            {'qstat': "echo \"<?xml version='1.0'?><job_info><job_info>"
+                      "</job_info></job_info>\"",
+             'qacct': 'echo "jobnumber $5"'}, r'#\$ -t 1-(\d+)', 'SGE_TASK_ID'),
+}
+
+
+def fake_batch_system(tmpdir, monkeypatch, plugin):
+    submit, output, status, directive, index_var = FAKE_BATCH[plugin]
+    log = tmpdir.join(submit + '.log')
+    scripts = dict((name, '#!/bin/sh\n%s\n' % body)
+                   for name, body in status.items())
+    scripts[submit] = FAKE_SUBMIT % dict(
+        python=sys.executable, log=str(log), directive=directive,
+        index_var=index_var, output=output)
+    for name, body in scripts.items():
+        script = tmpdir.join(name)
+        script.write(body)
+        os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', '%s%s%s' % (tmpdir, os.pathsep,
+                                           os.environ['PATH']))
+    monkeypatch.setenv('PYTHONPATH', os.path.dirname(
+        os.path.dirname(nipype.__file__)))
+    monkeypatch.setenv('LOGNAME', 'user')
+    return log
+
+
+def add_one(x):
+    return x + 1
+
+
+def identity(x):
+    return x
+
+
+def total(x):
+    return sum(x)
+
+
+def make_workflow(base_dir, num_nodes):
+    wf = pe.Workflow(name='bundled', base_dir=str(base_dir))
+    wf.config['execution'] = {'poll_sleep_duration': 0.1}
+    sink = pe.Node(Function(input_names=['x'], output_names=['y'],
+                            function=total), name='sink')
+    merge = pe.JoinNode(Function(input_names=['x'], output_names=['x'],
+                                 function=identity),
+                        joinsource='source', joinfield='x', name='merge')
+    source = pe.Node(Function(input_names=['x'], output_names=['y'],
+                              function=add_one), name='source')
+    source.iterables = ('x', list(range(num_nodes)))
+    wf.connect([(source, merge, [('y', 'x')]), (merge, sink, [('x', 'x')])])
+    return wf
+
+
+@pytest.mark.parametrize('plugin', sorted(FAKE_BATCH))
+@pytest.mark.parametrize('mode', ['serial', 'array'])
+def test_bundles(tmpdir, monkeypatch, plugin, mode):
+    log = fake_batch_system(tmpdir, monkeypatch, plugin)
+    wf = make_workflow(tmpdir.join('work'), 5)
+    wf.run(plugin=plugin, plugin_args={'bundle_size': 3, 'bundle_mode': mode,
+                                       'bundle_procs': 2})
+    # the 5 source nodes in bundles of 3 and 2, then merge and sink
+    submitted = log.read().splitlines()
+    assert len(submitted) == 4
+    result = tmpdir.join('work', 'bundled', 'sink', 'result_sink.pklz')
+    assert nipype.utils.filemanip.loadpkl(str(result)).outputs.y == 15
+
+
+def test_bundle_resources(tmpdir, monkeypatch):
+    log = fake_batch_system(tmpdir, monkeypatch, 'SLURM')
+    wf = make_workflow(tmpdir.join('work'), 5)
+    wf.run(plugin='SLURM', plugin_args={'bundle_size': 3, 'bundle_procs': 2,
+                                        'request_resources': True})
+    # the bundles run 2 nodes at once, the other jobs a single node
+    submitted = log.read().splitlines()
+    assert ['--mem=2048M --cpus-per-task=2' in args
+            for args in submitted] == [True, True, False, False]
+    assert all('--mem=1024M --cpus-per-task=1' in args
+               for args in submitted[2:])
+
+
+@pytest.mark.parametrize('plugin, requested', [
+    (SGEPlugin, ' -l h_vmem=1536M -pe smp 4'),
+    (PBSPlugin, ' -l mem=6144mb -l nodes=1:ppn=4'),
+    (LSFPlugin, ' -M 6144 -n 4 -R "span[hosts=1]"'),
+    (OARPlugin, ' -l /nodes=1/core=4'),
+    (SLURMPlugin, ' --mem=6144M --cpus-per-task=4'),
+    (CondorPlugin, ''),
+])
+def test_request_resources(tmpdir, monkeypatch, plugin, requested):
+    if plugin is SGEPlugin:
+        # SGEPlugin retries a missing qstat for about a minute
+        fake_batch_system(tmpdir, monkeypatch, 'SGE')
+    node = pe.Node(Function(input_names=['x'], output_names=['y'],
+                            function=add_one), name='node')
+    node.interface.estimated_memory_gb = 3
+    node.interface.num_threads = 2
+    assert plugin()._add_resource_args('', node, procs=2) == ''
+    runner = plugin(plugin_args={'request_resources': True})
+    assert runner._add_resource_args('', node, procs=2) == requested
+    # resources set in the submission arguments are kept
+    assert runner._add_resource_args(requested, node, procs=2) == requested
+
+
+def test_bundle_arguments():
+    with pytest.raises(ValueError):
+        SLURMPlugin(plugin_args={'bundle_mode': 'parallel'})
+    with pytest.raises(ValueError):
+        LSFPlugin(plugin_args={'bundle_mode': 'array'})
+    assert _add_directive('#!/bin/bash\n#SBATCH -p short', '#SBATCH -a 1') == \
+        '#!/bin/bash\n#SBATCH -a 1\n#SBATCH -p short'
+    assert _add_directive('\n#$ -V\n', '#$ -t 1-2') == '#$ -t 1-2\n#$ -V\n'
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Batched job status queries of the SGE-like batch plugins"""
+import os
+import stat
+
+import pytest
+
+from nipype.pipeline.plugins.slurm import SLURMPlugin
+from nipype.pipeline.plugins.pbs import PBSPlugin
+from nipype.pipeline.plugins.lsf import LSFPlugin
+from nipype.pipeline.plugins.oar import OARPlugin
+from nipype.pipeline.plugins.condor import CondorPlugin
+
+# Each fake command logs its arguments and reports jobs 1 and 3 as queued
+# or running, and job 2 as finished or unknown
+FAKE_COMMANDS = {
+    SLURMPlugin: ('squeue', 'echo 1; echo 3'),
+    PBSPlugin: ('qstat', 'echo "1.server  job1  user  0  R  batch"\n'
+                         'echo "3.server  job3  user  0  Q  batch"\n'
+                         'echo "qstat: Unknown Job Id Error 2.server" >&2\n'
+                         'exit 153'),
+    LSFPlugin: ('bjobs', 'echo "JOBID USER STAT QUEUE"\n'
+                         'echo "1 user RUN normal"\n'
+                         'echo "2 user DONE normal"\n'
+                         'echo "3 user PEND normal"'),
+    OARPlugin: ('oarstat', 'echo \'{"1": "Running", "2": "Terminated", '
+                           '"3": "Waiting"}\''),
+    CondorPlugin: ('condor_q', 'echo "-- Schedd: host"\n'
+                               'echo " ID OWNER"\n'
+                               'echo "1.0 user"\n'
+                               'echo "3.0 user"'),
+}
+
+
+def fake_command(tmpdir, monkeypatch, name, body):
+    """Put an executable script on the PATH that logs its invocations"""
+    script = tmpdir.join(name)
+    script.write('#!/bin/sh\necho "$@" >> %s\n%s\n' %
+                 (tmpdir.join(name + '.log'), body))
+    os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', '%s%s%s' % (tmpdir, os.pathsep,
+                                           os.environ['PATH']))
+    return tmpdir.join(name + '.log')
+
+
+def calls(log):
+    return log.read().splitlines() if log.check() else []
+
+
+def taskid(plugin, value):
+    # PBS and OAR keep job ids as returned by the submit command
+    return str(value) if plugin in (PBSPlugin, OARPlugin) else value
+
+
+@pytest.mark.parametrize('plugin', sorted(FAKE_COMMANDS,
+                                          key=lambda cls: cls.__name__))
+def test_batched_status(tmpdir, monkeypatch, plugin):
+    name, body = FAKE_COMMANDS[plugin]
+    log = fake_command(tmpdir, monkeypatch, name, body)
+    runner = plugin(plugin_args={'status_ttl': 60})
+    for value in (1, 2, 3):
+        runner._pending[taskid(plugin, value)] = str(tmpdir)
+
+    pending = [runner._is_pending(taskid(plugin, value))
+               for value in (1, 2, 3)]
+    assert pending == [True, False, True]
+    assert len(calls(log)) == 1
+
+    # a task submitted after the last query triggers a new query
+    runner._pending[taskid(plugin, 4)] = str(tmpdir)
+    runner._is_pending(taskid(plugin, 4))
+    assert runner._is_pending(taskid(plugin, 1))
+    assert len(calls(log)) == 2
+
+
+def test_status_ttl(tmpdir, monkeypatch):
+    log = fake_command(tmpdir, monkeypatch, 'squeue', 'echo 1')
+    runner = SLURMPlugin(plugin_args={'status_ttl': 0})
+    runner._pending[1] = str(tmpdir)
+    runner._is_pending(1)
+    runner._status_time -= 1
+    runner._is_pending(1)
+    assert len(calls(log)) == 2
+
+
+def test_slurm_status_fallback(tmpdir, monkeypatch):
+    # squeue fails if any of the jobs has been purged: ask about each job
+    log = fake_command(tmpdir, monkeypatch, 'squeue',
+                       'case "$5" in\n'
+                       '  1|3) echo $5 ;;\n'
+                       '  *) echo "Invalid job id specified" >&2; exit 1 ;;\n'
+                       'esac')
+    runner = SLURMPlugin(plugin_args={'status_ttl': 60})
+    for value in (1, 2, 3):
+        runner._pending[value] = str(tmpdir)
+    assert [runner._is_pending(value) for value in (1, 2, 3)] == \
+        [True, False, True]
+    assert calls(log) == ['-h -o %i -j 1,2,3', '-h -o %i -j 1',
+                          '-h -o %i -j 2', '-h -o %i -j 3']
+
+
+# Each fake command fails as when the batch system cannot be reached
+FAILED_COMMANDS = {
+    SLURMPlugin: 'echo "squeue: error: Socket timed out" >&2; exit 1',
+    PBSPlugin: 'echo "qstat: cannot connect to server" >&2; exit 2',
+    LSFPlugin: 'echo "LSF is down. Please wait ..." >&2; exit 255',
+    OARPlugin: 'echo "Cannot connect to the database" >&2; exit 1',
+    CondorPlugin: 'echo "-- Failed to fetch ads from: schedd" >&2; exit 1',
+}
+
+
+@pytest.mark.parametrize('plugin', sorted(FAKE_COMMANDS,
+                                          key=lambda cls: cls.__name__))
+def test_status_query_failure(tmpdir, monkeypatch, plugin):
+    # a controller timeout does not mark the running jobs as finished
+    name, body = FAKE_COMMANDS[plugin]
+    fake_command(tmpdir, monkeypatch, name, body)
+    runner = plugin(plugin_args={'status_ttl': 0})
+    for value in (1, 2, 3):
+        runner._pending[taskid(plugin, value)] = str(tmpdir)
+    assert [runner._is_pending(taskid(plugin, value))
+            for value in (1, 2, 3)] == [True, False, True]
+    fake_command(tmpdir, monkeypatch, name, FAILED_COMMANDS[plugin])
+    runner._pending[taskid(plugin, 4)] = str(tmpdir)
+    runner._status_time -= 1
+    assert [runner._is_pending(taskid(plugin, value))
+            for value in (1, 2, 3, 4)] == [True, False, True, True]
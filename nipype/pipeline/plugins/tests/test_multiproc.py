@@ -2,13 +2,16 @@
 import logging
 import os, sys
 from multiprocessing import cpu_count
+from heapq import heappush, heappop
 
+import networkx as nx
 import nipype.interfaces.base as nib
 from nipype.utils import draw_gantt_chart
 import pytest
 import nipype.pipeline.engine as pe
 from nipype.pipeline.plugins.callback_log import log_nodes_cb
-from nipype.pipeline.plugins.multiproc import get_system_total_memory_gb
+from nipype.pipeline.plugins.multiproc import (get_system_total_memory_gb,
+                                               MultiProcPlugin, run_node_file)
 
 class InputSpec(nib.TraitedSpec):
     input1 = nib.traits.Int(desc='a random int')
@@ -51,6 +54,46 @@ def test_run_multiproc(tmpdir):
     assert result == [1, 1]
 
 
+def test_run_multiproc_ship_nodes_by_file(tmpdir, monkeypatch):
+    os.chdir(str(tmpdir))
+    # record what is sent to the workers, and where the nodes are shipped
+    shipped = []
+    task_args = MultiProcPlugin._task_args
+
+    def record_task_args(self, node, updatehash):
+        func, args = task_args(self, node, updatehash)
+        shipped.append((func, args[0], os.path.isfile(args[0]),
+                        self._ship_dir))
+        return func, args
+    monkeypatch.setattr(MultiProcPlugin, '_task_args', record_task_args)
+
+    pipe = pe.Workflow(name='pipe')
+    mod1 = pe.Node(interface=MultiprocTestInterface(), name='mod1')
+    mod2 = pe.MapNode(interface=MultiprocTestInterface(),
+                      iterfield=['input1'],
+                      name='mod2')
+    pipe.connect([(mod1, mod2, [('output1', 'input1')])])
+    pipe.base_dir = os.getcwd()
+    mod1.inputs.input1 = 1
+    pipe.config['execution']['poll_sleep_duration'] = 2
+    execgraph = pipe.run(plugin="MultiProc",
+                         plugin_args={'ship_nodes_by_file': True})
+    names = ['.'.join((node._hierarchy, node.name)) for node in execgraph.nodes()]
+    node = execgraph.nodes()[names.index('pipe.mod2')]
+    result = node.get_output('output1')
+    assert result == [[1, 1], [1, 1]]
+    # the workers were sent the pickles of the nodes, not the nodes
+    assert shipped
+    for func, node_file, pickled, ship_dir in shipped:
+        assert func is run_node_file
+        assert pickled
+        assert os.path.dirname(node_file) == ship_dir
+    # and the shipping directory is removed when the plugin is closed
+    ship_dirs = set(ship_dir for _, _, _, ship_dir in shipped)
+    assert len(ship_dirs) == 1
+    assert not os.path.exists(ship_dirs.pop())
+
+
 class InputSpecSingleNode(nib.TraitedSpec):
     input1 = nib.traits.Int(desc='a random int')
     input2 = nib.traits.Int(desc='a random int')
@@ -226,3 +269,160 @@ def test_no_more_threads_than_specified():
         "using more memory than system has (memory is not specified by user)"
 
     os.remove(LOG_FILENAME)
+
+
+class SimulatedNode(object):
+    """Stand-in for a node, with just what the MultiProc scheduler uses"""
+
+    def __init__(self, name, runtime, memory_gb=0.5, estimated=True):
+        self._id = name
+        self.name = name
+        self._hierarchy = 'sim'
+        self.runtime = runtime
+        self._interface = nib.Bunch(
+            estimated_memory_gb=memory_gb, learned_memory_gb=None,
+            num_threads=1, estimated_runtime=runtime if estimated else None)
+        self.inputs = nib.Bunch(get_traitsfree=dict)
+        self.config = {'execution': {'local_hash_check': 'false',
+                                     'stop_on_first_crash': 'false'}}
+        self.run_without_submitting = False
+        self._got_inputs = True
+
+    def output_dir(self):
+        return '/sim/%s' % self.name
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class SimulatedPlugin(MultiProcPlugin):
+    """MultiProc plugin running nodes on a simulated clock"""
+
+    def _create_pool(self, non_daemon):
+        self.clock = 0.0
+        self.started = {}
+        self._running = []
+        return None
+
+    def _submit_job(self, node, updatehash=False):
+        self._taskid += 1
+        self.started[node.name] = self.clock
+        heappush(self._running, (self.clock + node.runtime, self._taskid))
+        return self._taskid
+
+    def _wait(self):
+        if self._running:
+            self.clock, taskid = heappop(self._running)
+            self._taskresult[taskid] = dict(result=None, traceback=None,
+                                            taskid=taskid)
+
+    def _clear_task(self, taskid):
+        self._taskresult.pop(taskid, None)
+
+    def _close(self):
+        return True
+
+
+def run_config():
+    return {'execution': {'poll_sleep_duration': 0,
+                          'stop_on_first_crash': 'false',
+                          'remove_node_directories': 'false'}}
+
+
+def simulate(graph, n_procs, scheduler):
+    """Return the makespan of a graph of SimulatedNodes and the plugin"""
+    plugin = SimulatedPlugin(plugin_args={'n_procs': n_procs,
+                                          'memory_gb': n_procs,
+                                          'scheduler': scheduler})
+    plugin.run(graph, run_config())
+    return plugin.clock, plugin
+
+
+def chains_graph(num_chains=2, chain_length=10, chain_runtime=10.,
+                 num_short=200, short_runtime=1.):
+    """Long dependent chains of memory hungry nodes (e.g., FreeSurfer
+    steps) that start after a short preparation node, next to many short
+    independent nodes, all joined by a final node"""
+    graph = nx.DiGraph()
+    sink = SimulatedNode('sink', short_runtime)
+    for idx in range(num_short):
+        node = SimulatedNode('short%03d' % idx, short_runtime)
+        graph.add_edge(node, sink)
+    for chain in range(num_chains):
+        prev = SimulatedNode('prep%d' % chain, short_runtime)
+        for idx in range(chain_length):
+            node = SimulatedNode('chain%d_%02d' % (chain, idx), chain_runtime,
+                                 memory_gb=1)
+            graph.add_edge(prev, node)
+            prev = node
+        graph.add_edge(prev, sink)
+    return graph
+
+
+def test_critical_path_scheduler():
+    graph = chains_graph(num_chains=1, chain_length=3, num_short=8)
+    resources, _ = simulate(graph, 2, 'resources')
+    critical, plugin = simulate(graph, 2, 'critical_path')
+    # the chain starts as soon as its preparation node finishes
+    assert plugin.started['chain0_00'] == 1
+    assert critical == 1 + 3 * 10 + 1
+    assert critical < resources
+
+
+def test_critical_path_default_runtime():
+    # without estimates, the longest chain of nodes starts first
+    graph = nx.DiGraph()
+    graph.add_edge(SimulatedNode('a0', 1, estimated=False),
+                   SimulatedNode('a1', 1, estimated=False))
+    graph.add_node(SimulatedNode('b0', 1, estimated=False))
+    plugin = SimulatedPlugin(plugin_args={'n_procs': 1, 'memory_gb': 1,
+                                          'scheduler': 'critical_path'})
+    plugin.run(graph, run_config())
+    assert plugin.started['a0'] == 0
+    assert plugin.started['b0'] > 0
+    with pytest.raises(ValueError):
+        SimulatedPlugin(plugin_args={'scheduler': 'fastest'})
+
+
+def test_critical_path_runtime_history(tmpdir):
+    from nipype.pipeline.engine.history import RuntimeHistory
+    from nipype.utils.misc import interface_name
+
+    class LongInterface(nib.Bunch):
+        pass
+
+    history_file = tmpdir.join('history.sqlite').strpath
+    RuntimeHistory(history_file).record(interface_name(LongInterface), 0,
+                                        duration=10.)
+    nodes = dict((name, SimulatedNode(name, 1, estimated=False))
+                 for name in ['a0', 'a1', 'a2', 'a3', 'b0', 'b1'])
+    nodes['b1']._interface = LongInterface(**nodes['b1']._interface.__dict__)
+    for node in nodes.values():
+        node.config['execution'].update(runtime_history='true',
+                                        runtime_history_file=history_file)
+    graph = nx.DiGraph()
+    graph.add_edges_from([(nodes['a0'], nodes['a1']),
+                          (nodes['a1'], nodes['a2']),
+                          (nodes['a2'], nodes['a3']),
+                          (nodes['b0'], nodes['b1'])])
+    plugin = SimulatedPlugin(plugin_args={'n_procs': 1, 'memory_gb': 1,
+                                          'scheduler': 'critical_path'})
+    plugin.run(graph, run_config())
+    # the chain with a long node in the history starts first
+    assert plugin.started['b0'] == 0
+    assert plugin.started['a0'] > 0
+
+
+def test_mapnode_procs_threads():
+    # a MapNode running its subnodes in a process pool uses its processes
+    node = pe.Node(MultiprocTestInterface(), name='node')
+    mapnode = pe.MapNode(MultiprocTestInterface(), iterfield=['input1'],
+                         name='mapnode', serial=True)
+    mapnode.plugin_args = {'mapnode_procs': 4}
+    plugin = MultiProcPlugin(plugin_args={'n_procs': 8})
+    plugin.procs = [node, mapnode]
+    assert plugin._job_threads(0) == 1
+    assert plugin._job_threads(1) == 4
+    mapnode.interface.num_threads = 6
+    assert plugin._job_threads(1) == 6
+    plugin._close()
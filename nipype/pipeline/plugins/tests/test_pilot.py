@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Tests for the pilot worker pool plugin"""
+import os
+import stat
+from time import sleep
+
+import pytest
+
+import nipype
+import nipype.pipeline.engine as pe
+from nipype.interfaces.utility import Function
+from nipype.utils.filemanip import loadpkl
+from nipype.pipeline.plugins.pilot import PilotPlugin, run_worker
+
+
+def add_one(x):
+    return x + 1
+
+
+def total(x):
+    return sum(x)
+
+
+@pytest.mark.parametrize('launcher', [None, 'submit'])
+def test_pilot(tmpdir, monkeypatch, launcher):
+    monkeypatch.setenv('PYTHONPATH', os.path.dirname(
+        os.path.dirname(nipype.__file__)))
+    plugin_args = {'n_workers': 2, 'idle_timeout': 30,
+                   'queue_dir': str(tmpdir)}
+    if launcher:
+        # fake batch system starting the job in the background
+        script = tmpdir.join(launcher)
+        script.write('#!/bin/sh\nsh "$1" > /dev/null 2>&1 &\necho 1\n')
+        os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+        plugin_args['launcher'] = str(script)
+    wf = pe.Workflow(name='piloted', base_dir=str(tmpdir))
+    wf.config['execution'] = {'poll_sleep_duration': 0.1}
+    source = pe.Node(Function(input_names=['x'], output_names=['y'],
+                              function=add_one), name='source')
+    source.iterables = ('x', list(range(6)))
+    sink = pe.JoinNode(Function(input_names=['x'], output_names=['y'],
+                                function=total),
+                       joinsource='source', joinfield='x', name='sink')
+    wf.connect(source, 'y', sink, 'x')
+    wf.run(plugin='Pilot', plugin_args=plugin_args)
+
+    result = tmpdir.join('piloted', 'sink', 'result_sink.pklz')
+    assert loadpkl(str(result)).outputs.y == 21
+    queue_dir, = tmpdir.listdir('pilot_*')
+    # all the nodes ran on the two workers, which stopped with the workflow
+    assert len(queue_dir.join('done').listdir()) == 7
+    for _ in range(100):
+        if not queue_dir.join('workers').listdir():
+            break
+        sleep(0.1)
+    assert sorted(path.basename
+                  for path in queue_dir.join('exited').listdir()) == \
+        ['worker001', 'worker002']
+    assert not queue_dir.join('workers').listdir()
+
+
+def test_pilot_worker_failure(tmpdir):
+    plugin = PilotPlugin(plugin_args={'heartbeat_timeout': 10})
+    plugin._config = {'execution': {'poll_sleep_duration': 1}}
+    plugin._setup_queue(str(tmpdir))
+    queue_dir = plugin._queue_dir
+    plugin._workers = {'worker001': None, 'worker002': None}
+    for taskid, worker_id in ((1, 'worker001'), (2, 'worker002')):
+        name = plugin._task_name(taskid)
+        open(os.path.join(queue_dir, 'running',
+                          '%s.%s' % (worker_id, name)), 'w').close()
+    open(os.path.join(queue_dir, 'workers', 'worker001'), 'w').close()
+    heartbeat = os.path.join(queue_dir, 'workers', 'worker002')
+    open(heartbeat, 'w').close()
+    os.utime(heartbeat, (0, 0))
+    # the node of the worker that stopped reporting has failed
+    assert plugin._is_pending(1)
+    assert not plugin._is_pending(2)
+
+
+def test_pilot_idle_worker(tmpdir):
+    plugin = PilotPlugin()
+    plugin._config = {'execution': {'poll_sleep_duration': 0.01}}
+    plugin._setup_queue(str(tmpdir))
+    run_worker(plugin._queue_dir, 'worker001', idle_timeout=0.05,
+               poll_interval=0.01)
+    assert os.listdir(os.path.join(plugin._queue_dir, 'exited')) == \
+        ['worker001']
+
+
+def _queue_tasks(plugin, count):
+    for taskid in range(1, count + 1):
+        open(os.path.join(plugin._queue_dir, 'tasks',
+                          plugin._task_name(taskid)), 'w').close()
+        plugin._pending[taskid] = plugin._queue_dir
+
+
+def _launcher(tmpdir, body):
+    script = tmpdir.join('submit')
+    script.write('#!/bin/sh\n%s\n' % body)
+    os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+    return str(script)
+
+
+@pytest.mark.parametrize('failure', ['crash', 'submit', 'queued'])
+def test_pilot_startup_failure(tmpdir, failure):
+    plugin_args = {'n_workers': 2, 'startup_timeout': 0}
+    if failure == 'submit':
+        plugin_args['launcher'] = _launcher(tmpdir, 'echo "denied" >&2\n'
+                                                    'exit 1')
+    elif failure == 'queued':
+        # the batch job never starts
+        plugin_args['launcher'] = _launcher(tmpdir, 'echo 1')
+    plugin = PilotPlugin(plugin_args=plugin_args)
+    plugin._config = {'execution': {'poll_sleep_duration': 0.01}}
+    plugin._setup_queue(str(tmpdir))
+    if failure == 'crash':
+        # e.g. nipype cannot be imported by the workers
+        with open(os.path.join(plugin._queue_dir, 'worker.py'), 'w') as fp:
+            fp.write('import sys\nsys.exit(1)\n')
+    _queue_tasks(plugin, 3)
+    for _ in range(3):
+        plugin._scale_workers()
+        for worker in plugin._workers.values():
+            if not isinstance(worker, str):
+                worker.wait()
+    # workers are not started again and again, and the nodes fail
+    assert plugin._startup_error is not None
+    assert plugin._launches == 2
+    result = plugin._get_result(1)
+    assert 'failed to start' in result['traceback']
+    assert not os.path.exists(os.path.join(plugin._queue_dir, 'tasks',
+                                           plugin._task_name(1)))
@@ -91,6 +91,82 @@ def show(pklz_file):
     pprint(pkl_data)
 
 
+@cli.command(context_settings=CONTEXT_SETTINGS)
+@click.option('-f', '--file', 'history_file', type=ExistingFilePath,
+              help='Runtime history database (default: the runtime_history_file '
+                   'of the configuration).')
+@click.option('-i', '--interface', type=str,
+              help='Only show (or clear) the runs of this interface class.')
+@click.option('--clear', is_flag=True, flag_value=True,
+              help='Forget the recorded runs.')
+def history(history_file, interface, clear):
+    """Show the runtime history of interfaces.
+
+    Lists the number of recorded runs, mean duration, peak memory and threads
+    of each interface class and input size class.
+
+    Examples:\n
+    nipype history\n
+    nipype history -i nipype.interfaces.fsl.preprocess.BET --clear
+    """
+    from .. import config
+    from ..pipeline.engine.history import RuntimeHistory, get_runtime_history
+
+    if history_file:
+        runtime_history = RuntimeHistory(history_file)
+    else:
+        runtime_history = get_runtime_history({'execution': {
+            'runtime_history': True,
+            'runtime_history_file': config.get('execution',
+                                               'runtime_history_file')}})
+        if runtime_history is None:
+            raise click.ClickException('Cannot create the runtime history')
+    if clear:
+        runtime_history.clear(interface)
+        return
+
+    def fmt(value, spec):
+        return '-' if value is None else spec % value
+
+    click.echo('%-50s %5s %5s %10s %10s %7s' % (
+        'interface', 'size', 'runs', 'time (s)', 'mem (GB)', 'threads'))
+    for name, size_class, runs, duration, memory_gb, threads in \
+            runtime_history.summary(interface):
+        click.echo('%-50s %5d %5d %10s %10s %7s' % (
+            name, size_class, runs, fmt(duration, '%.1f'),
+            fmt(memory_gb, '%.2f'), fmt(threads, '%d')))
+
+
+@cli.command(context_settings=CONTEXT_SETTINGS)
+@click.argument('base_dir', type=ExistingDirPath, callback=check_not_none)
+@click.option('-i', '--interface', type=str,
+              help='Only report the profiles of this interface class.')
+@click.option('-s', '--sort', type=str, default='cumulative',
+              help='Sort the functions of cProfile profiles by this key '
+                   '(default: cumulative).')
+@click.option('-n', '--limit', type=int, default=20,
+              help='Number of functions reported per interface class '
+                   '(default: 20).')
+@click.option('-o', '--output-dir', type=click.Path(file_okay=False),
+              help='Write the merged profiles of each interface class to '
+                   'this directory.')
+def profile(base_dir, interface, sort, limit, output_dir):
+    """Report the Python profiles of the nodes of a workflow.
+
+    Merges the profiles written by the nodes run with the profile option of
+    the monitoring configuration, per interface class.
+
+    Examples:\n
+    nipype profile work/my_workflow\n
+    nipype profile work/my_workflow -i CompCor -o profiles
+    """
+    from ..utils.profiler import profile_report
+
+    report = profile_report(base_dir, interface=interface, sort=sort,
+                            limit=limit, output_dir=output_dir)
+    click.echo(report or 'No profile found in %s' % base_dir)
+
+
 @cli.command(context_settings=UNKNOWN_OPTIONS)
 @click.argument('module', type=PythonModule(), required=False,
                 callback=check_not_none)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Writing of reports and provenance off the execution path of nodes
+
+With ``report_async`` enabled, the node reports and the provenance files of
+interfaces are written by a background thread, in the order they were
+submitted, while the process goes on running nodes. The writes of a process
+are flushed when it exits (including the worker processes of MultiProc) and
+when a workflow finishes running.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+from builtins import object
+
+from future import standard_library
+standard_library.install_aliases()
+
+import atexit
+import os
+import threading
+from queue import Queue
+from multiprocessing.util import Finalize
+
+from .. import logging
+
+logger = logging.getLogger('workflow')
+
+
+class BackgroundWriter(object):
+    """Run write functions in order in a daemon thread
+
+    Examples
+    --------
+
+    >>> from nipype.utils.asyncwriter import BackgroundWriter
+    >>> written = []
+    >>> writer = BackgroundWriter()
+    >>> writer.submit(written.append, 'report')
+    >>> writer.flush()
+    >>> written # doctest: +ALLOW_UNICODE
+    ['report']
+
+    """
+
+    def __init__(self):
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            func, args, kwargs = self._queue.get()
+            try:
+                func(*args, **kwargs)
+            except Exception as err:
+                logger.warning('Background write failed: %s', err)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue a call of func(*args, **kwargs)"""
+        self._queue.put((func, args, kwargs))
+
+    def flush(self):
+        """Wait until all the queued writes are done"""
+        self._queue.join()
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Return the background writer of the current process"""
+    global _writer, _writer_pid
+    with _writer_lock:
+        # the thread of a parent process does not survive a fork
+        if _writer is None or _writer_pid != os.getpid():
+            _writer = BackgroundWriter()
+            _writer_pid = os.getpid()
+            atexit.register(flush_writes)
+            # worker processes of multiprocessing skip atexit handlers
+            Finalize(None, flush_writes, exitpriority=100)
+    return _writer
+
+
+def flush_writes():
+    """Wait until the background writes of the current process are done"""
+    if _writer is not None and _writer_pid == os.getpid():
+        _writer.flush()
+
+
+def write(background, func, *args, **kwargs):
+    """Call func(*args, **kwargs) in the background writer of the process if
+    background is true, else right away"""
+    if background:
+        get_writer().submit(func, *args, **kwargs)
+    else:
+        func(*args, **kwargs)
@@ -46,6 +46,11 @@ create_report = true
 crashdump_dir = %s
 display_variable = :1
 hash_method = timestamp
+hash_algorithm = md5
+hash_threads = 1
+hash_index = false
+hash_cache_size = 1000
+hash_cache_file =
 job_finished_timeout = 5
 keep_inputs = false
 local_hash_check = true
@@ -53,6 +58,7 @@ matplotlib_backend = Agg
 plugin = Linear
 remove_node_directories = false
 remove_unnecessary_outputs = true
+result_format = pklz
 try_hard_link_datasink = true
 single_thread_matlab = true
 crashfile_format = pklz
@@ -60,11 +66,29 @@ stop_on_first_crash = false
 stop_on_first_rerun = false
 use_relative_paths = false
 stop_on_unknown_version = false
+stream_expansion = false
 write_provenance = false
 parameterize_dirs = true
 poll_sleep_duration = 2
 xvfb_max_wait = 10
 profile_runtime = false
+profile_interval = 0.5
+runtime_history = false
+runtime_history_file =
+report_async = false
+report_database = false
+report_environ = true
+report_output_lines =
+
+[monitoring]
+trace = false
+trace_file =
+metrics = false
+metrics_port =
+metrics_file =
+profile = false
+profiler = cprofile
+profiler_interval = 0.01
 
 [check]
 interval = 1209600
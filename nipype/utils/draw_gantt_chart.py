@@ -16,7 +16,9 @@ from builtins import str, range, open
 # Py2 compat: http://python-future.org/compatible_idioms.html#collections-counter-and-ordereddict
 from future import standard_library
 standard_library.install_aliases()
-from collections import OrderedDict
+from collections import deque
+
+import numpy as np
 
 # Pandas
 try:
@@ -28,59 +30,31 @@ except ImportError:
 
 PY3 = sys.version_info[0] > 2
 
-def create_event_dict(start_time, nodes_list):
+def _parse_time(value):
     '''
-    Function to generate a dictionary of event (start/finish) nodes
-    from the nodes list
-
-    Parameters
-    ----------
-    start_time : datetime.datetime
-        a datetime object of the pipeline start time
-    nodes_list : list
-        a list of the node dictionaries that were run in the pipeline
-
-    Returns
-    -------
-    events : dictionary
-        a dictionary where the key is the timedelta from the start of
-        the pipeline execution to the value node it accompanies
+    Parse the time of an event of a callback log: seconds since the epoch
+    in execution logs, or ``str(datetime.datetime.now())`` in the logs of
+    log_nodes_cb
     '''
-
-    # Import packages
-    import copy
-
-    events = {}
-    for node in nodes_list:
-        # Format node fields
-        estimated_threads = node.get('num_threads', 1)
-        estimated_memory_gb = node.get('estimated_memory_gb', 1.0)
-        runtime_threads = node.get('runtime_threads', 0)
-        runtime_memory_gb = node.get('runtime_memory_gb', 0.0)
-
-        # Init and format event-based nodes
-        node['estimated_threads'] = estimated_threads
-        node['estimated_memory_gb'] = estimated_memory_gb
-        node['runtime_threads'] = runtime_threads
-        node['runtime_memory_gb'] = runtime_memory_gb
-        start_node = node
-        finish_node = copy.deepcopy(node)
-        start_node['event'] = 'start'
-        finish_node['event'] = 'finish'
-
-        # Get dictionary key
-        start_delta = (node['start'] - start_time).total_seconds()
-        finish_delta = (node['finish'] - start_time).total_seconds()
-
-        # Populate dictionary
-        if events.get(start_delta) or events.get(finish_delta):
-            err_msg = 'Event logged twice or events started at exact same time!'
-            raise KeyError(err_msg)
-        events[start_delta] = start_node
-        events[finish_delta] = finish_node
-
-    # Return events dictionary
-    return events
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value)
+    # 'YYYY-MM-DD HH:MM:SS[.ffffff]', much faster than a generic parser
+    if len(value) in (19, 26) and value[10] == ' ':
+        try:
+            return datetime.datetime(
+                int(value[:4]), int(value[5:7]), int(value[8:10]),
+                int(value[11:13]), int(value[14:16]), int(value[17:19]),
+                int(value[20:] or 0))
+        except ValueError:
+            pass
+    return parser.parse(value)
+
+
+def _format_time(value):
+    '''
+    Format a time to the second, like strftime('%Y-%m-%d %H:%M:%S')
+    '''
+    return str(value)[:19]
 
 
 def log_to_dict(logfile):
@@ -92,86 +66,133 @@ def log_to_dict(logfile):
     ----------
     logfile : string
         path to the json-formatted log file generated from a nipype
-        workflow execution
+        workflow execution, by log_nodes_cb or an ExecutionLog
 
     Returns
     -------
     nodes_list : list
         a list of python dictionaries containing the runtime info
-        for each nipype node
+        for each nipype node, in the order they finished
     '''
 
     # Init variables
-    #keep track of important vars
-    nodes_list = [] #all the parsed nodes
-    unifinished_nodes = [] #all start nodes that dont have a finish yet
+    nodes_list = []
+    # start events without a finish yet, by node
+    unfinished = {}
 
     with open(logfile, 'r') as content:
-        #read file separating each line
-        content = content.read()
-        lines = content.split('\n')
-
-        for l in lines:
-            #try to parse each line and transform in a json dict.
-            #if the line has a bad format, just skip
-            node = None
+        for line in content:
+            # skip the lines with a bad format
             try:
-                node = json.loads(l)
+                node = json.loads(line)
             except ValueError:
-                pass
-
+                continue
             if not node:
                 continue
 
-            #if it is a start node, add to unifinished nodes
+            # records of an ExecutionLog
+            event = node.pop('event', None)
+            if event is not None:
+                if event == 'start':
+                    node['start'] = node.pop('time')
+                else:
+                    node['finish'] = node.pop('time')
+                    if event == 'error':
+                        node['error'] = True
+
+            key = (node['id'], node['name'])
+            # start events wait for their finish
             if 'start' in node:
-                node['start'] = parser.parse(node['start'])
-                unifinished_nodes.append(node)
-
-            #if it is end node, look in uninished nodes for matching start
-            #remove from unifinished list and add to node list
+                node['start'] = _parse_time(node['start'])
+                unfinished.setdefault(key, deque()).append(node)
+            # finish events complete the earliest start of the node
             elif 'finish' in node:
-                node['finish'] = parser.parse(node['finish'])
-                #because most nodes are small, we look backwards in the unfinished list
-                for s in range(len(unifinished_nodes)):
-                    aux = unifinished_nodes[s]
-                    #found the end for node start, copy over info
-                    if aux['id'] == node['id'] and aux['name'] == node['name'] \
-                       and aux['start'] < node['finish']:
-                        node['start'] = aux['start']
-                        node['duration'] = \
-                            (node['finish'] - node['start']).total_seconds()
-
-                        unifinished_nodes.remove(aux)
-                        nodes_list.append(node)
-                        break
-
-        #finished parsing
-        #assume nodes without finish didn't finish running.
-        #set their finish to last node run
-        last_node = nodes_list[-1]
-        for n in unifinished_nodes:
-            n['finish'] = last_node['finish']
-            n['duration'] = (n['finish'] - n['start']).total_seconds()
-            nodes_list.append(n)
-
-        # Return list of nodes
-        return nodes_list
-
-
-def calculate_resource_timeseries(events, resource):
+                node['finish'] = _parse_time(node['finish'])
+                starts = unfinished.get(key)
+                if starts and starts[0]['start'] < node['finish']:
+                    finished = starts.popleft()
+                    finished.update(node)
+                    finished['duration'] = \
+                        (node['finish'] - finished['start']).total_seconds()
+                    nodes_list.append(finished)
+
+    # assume nodes without finish didn't finish running,
+    # set their finish to last node run
+    unfinished = sorted((node for starts in unfinished.values()
+                         for node in starts), key=lambda node: node['start'])
+    if unfinished:
+        last_finish = nodes_list[-1]['finish'] if nodes_list else \
+            unfinished[-1]['start']
+        for node in unfinished:
+            node['finish'] = max(last_finish, node['start'])
+            node['duration'] = (node['finish'] - node['start']).total_seconds()
+            nodes_list.append(node)
+
+    # Return list of nodes
+    return nodes_list
+
+
+# Defaults of the resources of the nodes, and the fields they come from
+RESOURCE_FIELDS = {
+    'estimated_memory_gb': ('estimated_memory_gb', 1.0),
+    'estimated_threads': ('num_threads', 1),
+    'runtime_memory_gb': ('runtime_memory_gb', 0.0),
+    'runtime_threads': ('runtime_threads', 0),
+}
+
+
+def _resource_value(node, resource):
+    '''
+    Return the amount of a resource used by a node, 0 if it is unknown
+    '''
+    field, default = RESOURCE_FIELDS.get(resource, (resource, 0))
+    value = node.get(field, default)
+    if value in ('Unknown', 'N/A', None):
+        return 0.0
+    return float(value)
+
+
+def _timeline(start, times, deltas):
     '''
-    Given as event dictionary, calculate the resources used
-    as a timeseries
+    Accumulate the changes of a resource, at times in seconds from start,
+    into a pandas Series, sorting the changes once
+    '''
+
+    # Import packages
+    import pandas as pd
+
+    times = np.asarray(times, dtype=float)
+    deltas = np.asarray(deltas, dtype=float)
+    if not len(times):
+        return pd.Series([])
+    order = np.argsort(times, kind='mergesort')
+    times = times[order]
+    levels = np.cumsum(deltas[order])
+    # keep the level after the last change at each time
+    last = np.append(times[1:] != times[:-1], True)
+    times, levels = times[last], levels[last]
+    levels[np.abs(levels) < 1e-9] = 0.0
+    # and only the times where the level changes
+    changed = np.append(True, levels[1:] != levels[:-1])
+    times, levels = times[changed], levels[changed]
+    index = pd.Timestamp(start) + pd.to_timedelta(times, unit='s')
+    return pd.Series(data=levels, index=index)
+
+
+def calculate_timeline(nodes_list, resource, start=None):
+    '''
+    Given the list of nodes, calculate the resources used as a timeseries,
+    from the start and finish of every node, in O(n log n)
 
     Parameters
     ----------
-    events : dictionary
-        a dictionary of event-based node dictionaries of the workflow
-        execution statistics
+    nodes_list : list
+        a list of the node dictionaries that were run in the pipeline
     resource : string
         the resource of interest to return the time-series of;
         e.g. 'runtime_memory_gb', 'estimated_threads', etc
+    start : datetime.datetime (optional)
+        the start of the pipeline, by default the first node start
 
     Returns
     -------
@@ -179,34 +200,67 @@ def calculate_resource_timeseries(events, resource):
         a pandas Series object that contains timestamps as the indices
         and the resource amount as values
     '''
+    if start is None:
+        start = min(node['start'] for node in nodes_list)
+    times = []
+    deltas = []
+    for node in nodes_list:
+        value = _resource_value(node, resource)
+        if value:
+            times.append((node['start'] - start).total_seconds())
+            times.append((node['finish'] - start).total_seconds())
+            deltas.append(value)
+            deltas.append(-value)
+    return _timeline(start, times, deltas)
 
-    # Import packages
-    import pandas as pd
 
-    # Init variables
-    res = OrderedDict()
-    all_res = 0.0
-
-    # Iterate through the events
-    for _, event in sorted(events.items()):
-        if event['event'] == "start":
-            if resource in event and event[resource] != 'Unknown':
-                all_res += float(event[resource])
-            current_time = event['start']
-        elif event['event'] == "finish":
-            if resource in event and event[resource] != 'Unknown':
-                all_res -= float(event[resource])
-            current_time = event['finish']
-        res[current_time] = all_res
-
-    # Formulate the pandas timeseries
-    time_series = pd.Series(data=list(res.values()), index=list(res.keys()))
-    # Downsample where there is only value-diff
-    ts_diff = time_series.diff()
-    time_series = time_series[ts_diff != 0]
-
-    # Return the new time series
-    return time_series
+def calculate_sampled_timeseries(nodes_list, resource, start=None):
+    '''
+    Given the list of nodes, calculate the resources used as a timeseries
+    from the resource samples recorded by the runtime profiler, falling
+    back to the peak values for the nodes without samples
+
+    Parameters
+    ----------
+    nodes_list : list
+        a list of the node dictionaries that were run in the pipeline
+    resource : string
+        the resource of interest to return the time-series of;
+        'runtime_memory_gb' or 'runtime_threads'
+    start : datetime.datetime (optional)
+        the start of the pipeline, by default the first node start
+
+    Returns
+    -------
+    time_series : pandas Series
+        a pandas Series object that contains timestamps as the indices
+        and the resource amount as values
+    '''
+    if start is None:
+        start = min(node['start'] for node in nodes_list)
+
+    # Position of the resource in the (seconds, memory, cpu, threads) samples
+    column = {'runtime_memory_gb': 1, 'runtime_threads': 3}[resource]
+
+    # Changes of the total resource at every sample, start and finish
+    times = []
+    deltas = []
+    for node in nodes_list:
+        offset = (node['start'] - start).total_seconds()
+        finish = (node['finish'] - start).total_seconds()
+        samples = node.get('runtime_samples')
+        if not samples:
+            value = _resource_value(node, resource)
+            samples = [(0, value, 0, value)]
+        current = 0.0
+        for sample in samples:
+            value = float(sample[column])
+            times.append(min(offset + sample[0], finish))
+            deltas.append(value - current)
+            current = value
+        times.append(finish)
+        deltas.append(-current)
+    return _timeline(start, times, deltas)
 
 
 def draw_lines(start, total_duration, minute_scale, scale):
@@ -291,7 +345,7 @@ def draw_nodes(start, nodes_list, cores, minute_scale, space_between_minutes,
     '''
 
     # Init variables
-    result = ''
+    result = []
     scale = space_between_minutes / minute_scale
     space_between_minutes = space_between_minutes / scale
     end_times = [datetime.datetime(start.year, start.month, start.day,
@@ -336,8 +390,8 @@ def draw_nodes(start, nodes_list, cores, minute_scale, space_between_minutes,
                      'color' : color,
                      'node_name' : node['name'],
                      'node_dur' : node['duration'] / 60.0,
-                     'node_start' : node_start.strftime("%Y-%m-%d %H:%M:%S"),
-                     'node_finish' : node_finish.strftime("%Y-%m-%d %H:%M:%S")}
+                     'node_start' : _format_time(node_start),
+                     'node_finish' : _format_time(node_finish)}
         # Create new node string
         new_node = "<div class='node' style='left:%(left)spx;top:%(offset)spx;"\
                    "height:%(scale_duration)spx;background-color:%(color)s;'"\
@@ -346,10 +400,10 @@ def draw_nodes(start, nodes_list, cores, minute_scale, space_between_minutes,
                    node_dict
 
         # Append to output result
-        result += new_node
+        result.append(new_node)
 
     # Return html string for nodes
-    return result
+    return ''.join(result)
 
 def draw_resource_bar(start_time, finish_time, time_series, space_between_minutes,
                       minute_scale, color, left, resource):
@@ -357,24 +411,29 @@ def draw_resource_bar(start_time, finish_time, time_series, space_between_minute
     '''
 
     # Memory header
-    result = "<p class='time' style='top:198px;left:%dpx;'>%s</p>" \
-             % (left, resource)
+    result = ["<p class='time' style='top:198px;left:%dpx;'>%s</p>"
+              % (left, resource)]
     # Image scaling factors
     scale = space_between_minutes / minute_scale
     space_between_minutes = space_between_minutes / scale
 
     # Iterate through time series
-    if PY3:
-        ts_items = time_series.items()
-    else:
-        ts_items = time_series.iteritems()
-
-    ts_len = len(time_series)
-    for idx, (ts_start, amount) in enumerate(ts_items):
-        if idx < ts_len-1:
-            ts_end = time_series.index[idx+1]
-        else:
-            ts_end = finish_time
+    ts_starts = time_series.index
+    if hasattr(ts_starts, 'to_pydatetime'):
+        # datetime arithmetic is much faster than with pandas timestamps
+        ts_starts = ts_starts.to_pydatetime()
+    ts_starts = list(ts_starts)
+    amounts = np.asarray(time_series.values, dtype=float)
+    if len(amounts):
+        # Merge the steps starting within the same pixel, keeping their peak
+        seconds_per_pixel = 60.0 / (scale * space_between_minutes)
+        pixels = np.floor([(ts_start - start_time).total_seconds() /
+                           seconds_per_pixel for ts_start in ts_starts])
+        first = np.flatnonzero(np.append(True, pixels[1:] != pixels[:-1]))
+        amounts = np.maximum.reduceat(amounts, first)
+        ts_starts = [ts_starts[idx] for idx in first]
+    ts_ends = ts_starts[1:] + [finish_time]
+    for ts_start, ts_end, amount in zip(ts_starts, ts_ends, amounts):
         # Calculate offset from start at top
         offset = ((ts_start-start_time).total_seconds() / 60.0) * scale * \
                  space_between_minutes + 220
@@ -402,8 +461,8 @@ def draw_resource_bar(start_time, finish_time, time_series, space_between_minute
                     'left' : left,
                     'label' : label,
                     'duration' : duration_mins,
-                    'start' : ts_start.strftime('%Y-%m-%d %H:%M:%S'),
-                    'finish' : ts_end.strftime('%Y-%m-%d %H:%M:%S')}
+                    'start' : _format_time(ts_start),
+                    'finish' : _format_time(ts_end)}
 
         bar_html = "<div class='bar' style='background-color:%(color)s;"\
                    "height:%(height).3fpx;width:%(width).3fpx;"\
@@ -411,10 +470,10 @@ def draw_resource_bar(start_time, finish_time, time_series, space_between_minute
                    "title='%(label)s\nduration:%(duration).3f\n"\
                    "start:%(start)s\nend:%(finish)s'></div>"
         # Add another bar to html line
-        result += bar_html % bar_dict
+        result.append(bar_html % bar_dict)
 
     # Return bar-formatted html string
-    return result
+    return ''.join(result)
 
 
 def generate_gantt_chart(logfile, cores, minute_scale=10,
@@ -541,47 +600,48 @@ def generate_gantt_chart(logfile, cores, minute_scale=10,
     nodes_list = log_to_dict(logfile)
 
     # Create the header of the report with useful information
-    start_node = nodes_list[0]
-    last_node = nodes_list[-1]
-    duration = (last_node['finish'] - start_node['start']).total_seconds()
-
-    # Get events based dictionary of node run stats
-    events = create_event_dict(start_node['start'], nodes_list)
+    start = min(node['start'] for node in nodes_list)
+    finish = max(node['finish'] for node in nodes_list)
+    duration = (finish - start).total_seconds()
 
     # Summary strings of workflow at top
-    html_string += '<p>Start: ' + start_node['start'].strftime("%Y-%m-%d %H:%M:%S") + '</p>'
-    html_string += '<p>Finish: ' + last_node['finish'].strftime("%Y-%m-%d %H:%M:%S") + '</p>'
+    html_string += '<p>Start: ' + start.strftime("%Y-%m-%d %H:%M:%S") + '</p>'
+    html_string += '<p>Finish: ' + finish.strftime("%Y-%m-%d %H:%M:%S") + '</p>'
     html_string += '<p>Duration: ' + "{0:.2f}".format(duration / 60) + ' minutes</p>'
     html_string += '<p>Nodes: ' + str(len(nodes_list))+'</p>'
     html_string += '<p>Cores: ' + str(cores) + '</p>'
     html_string += close_header
     # Draw nipype nodes Gantt chart and runtimes
-    html_string += draw_lines(start_node['start'], duration, minute_scale,
+    html_string += draw_lines(start, duration, minute_scale,
                               space_between_minutes)
-    html_string += draw_nodes(start_node['start'], nodes_list, cores, minute_scale,
+    html_string += draw_nodes(start, nodes_list, cores, minute_scale,
                               space_between_minutes, colors)
 
     # Get memory timeseries
-    estimated_mem_ts = calculate_resource_timeseries(events, 'estimated_memory_gb')
-    runtime_mem_ts = calculate_resource_timeseries(events, 'runtime_memory_gb')
+    estimated_mem_ts = calculate_timeline(nodes_list, 'estimated_memory_gb',
+                                          start)
+    runtime_mem_ts = calculate_sampled_timeseries(nodes_list,
+                                                  'runtime_memory_gb', start)
     # Plot gantt chart
     resource_offset = 120 + 30*cores
     html_string += draw_resource_bar(
-        start_node['start'], last_node['finish'], estimated_mem_ts,
+        start, finish, estimated_mem_ts,
         space_between_minutes, minute_scale, '#90BBD7', resource_offset*2+120, 'Memory')
     html_string += draw_resource_bar(
-        start_node['start'], last_node['finish'], runtime_mem_ts,
+        start, finish, runtime_mem_ts,
         space_between_minutes, minute_scale, '#03969D', resource_offset*2+120, 'Memory')
 
     # Get threads timeseries
-    estimated_threads_ts = calculate_resource_timeseries(events, 'estimated_threads')
-    runtime_threads_ts = calculate_resource_timeseries(events, 'runtime_threads')
+    estimated_threads_ts = calculate_timeline(nodes_list, 'estimated_threads',
+                                              start)
+    runtime_threads_ts = calculate_sampled_timeseries(nodes_list,
+                                                      'runtime_threads', start)
     # Plot gantt chart
     html_string += draw_resource_bar(
-        start_node['start'], last_node['finish'], estimated_threads_ts,
+        start, finish, estimated_threads_ts,
         space_between_minutes, minute_scale, '#90BBD7', resource_offset, 'Threads')
     html_string += draw_resource_bar(
-        start_node['start'], last_node['finish'], runtime_threads_ts,
+        start, finish, runtime_threads_ts,
         space_between_minutes, minute_scale, '#03969D', resource_offset, 'Threads')
 
     #finish html
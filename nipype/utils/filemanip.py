@@ -12,6 +12,9 @@ standard_library.install_aliases()
 
 import sys
 import pickle
+import sqlite3
+import threading
+import time
 import subprocess
 import gzip
 import hashlib
@@ -20,6 +23,9 @@ import os
 import re
 import shutil
 import posixpath
+from collections import OrderedDict
+from functools import partial
+from multiprocessing.pool import ThreadPool
 import simplejson as json
 import numpy as np
 
@@ -27,8 +33,16 @@ from .. import logging, config
 from .misc import is_container
 from ..interfaces.traits_extension import isdefined
 
+xxhash_not_loaded = False
+try:
+    import xxhash
+except ImportError:
+    xxhash_not_loaded = True
+
 fmlogger = logging.getLogger("filemanip")
 
+HASH_CHUNK_LEN = 1024 * 1024
+
 
 related_filetype_sets = [
     ('.hdr', '.img', '.mat'),
@@ -211,21 +225,280 @@ def check_forhash(filename):
         return False, None
 
 
-def hash_infile(afile, chunk_len=8192, crypto=hashlib.md5):
-    """ Computes hash of a file using 'crypto' module"""
+class FileHashCache(object):
+    """Bounded LRU cache of file content hashes
+
+    Entries are keyed on the device, inode, size and modification time of a
+    file, so a file is only read again once it has been modified (or
+    replaced). Hashes can additionally be persisted to an SQLite sidecar
+    file, to be shared between processes and runs.
+
+    Files modified less than ``min_age`` seconds ago are not cached, because
+    a further modification within the resolution of the filesystem
+    timestamps would go unnoticed.
+
+    Examples
+    --------
+
+    >>> import os, tempfile
+    >>> from nipype.utils.filemanip import FileHashCache
+    >>> fname = os.path.join(tempfile.mkdtemp(), 'data.txt')
+    >>> with open(fname, 'w') as fp:
+    ...     _ = fp.write('some data')
+    >>> os.utime(fname, (1e9, 1e9))
+    >>> cache = FileHashCache(maxsize=10)
+    >>> cache.get(fname, 'md5', lambda: 'abc') # doctest: +ALLOW_UNICODE
+    'abc'
+    >>> cache.get(fname, 'md5', lambda: 'def') # doctest: +ALLOW_UNICODE
+    'abc'
+
+    """
+
+    _schema = ('CREATE TABLE IF NOT EXISTS hashes ('
+               'key TEXT PRIMARY KEY, hexdigest TEXT)')
+
+    def __init__(self, maxsize=1000, filename=None, min_age=2.0):
+        self.maxsize = maxsize
+        self.filename = filename
+        self.min_age = min_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._conn_lock = threading.Lock()
+
+    @staticmethod
+    def file_key(afile):
+        """Return the key identifying the current contents of a file"""
+        stat = os.stat(afile)
+        mtime_ns = getattr(stat, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = int(stat.st_mtime * 1e9)
+        return (stat.st_dev, stat.st_ino, stat.st_size, mtime_ns)
+
+    def _key(self, afile, crypto_name):
+        key = self.file_key(afile)
+        if time.time() - key[3] / 1e9 < self.min_age:
+            return None
+        return key + (crypto_name,)
+
+    def _lookup(self, key):
+        with self._lock:
+            hexdigest = self._entries.pop(key, None)
+            if hexdigest is not None:
+                self._entries[key] = hexdigest
+                return hexdigest
+        return self._load(key)
+
+    def lookup(self, afile, crypto_name):
+        """Return the cached hash of ``afile``, or None"""
+        key = self._key(afile, crypto_name)
+        if key is None:
+            return None
+        return self._lookup(key)
+
+    def get(self, afile, crypto_name, compute):
+        """Return the hash of ``afile``, calling ``compute()`` on a miss"""
+        key = self._key(afile, crypto_name)
+        if key is None:
+            return compute()
+        hexdigest = self._lookup(key)
+        if hexdigest is None:
+            hexdigest = compute()
+            self._store(key, hexdigest)
+        with self._lock:
+            self._entries[key] = hexdigest
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return hexdigest
+
+    def clear(self):
+        """Forget all the hashes held in memory"""
+        with self._lock:
+            self._entries.clear()
+
+    def _connect(self):
+        # a connection inherited through a fork cannot be used
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.filename, timeout=30,
+                                   check_same_thread=False)
+            with conn:
+                conn.execute(self._schema)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _execute(self, query, args=()):
+        with self._conn_lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute(query, args).fetchall()
+
+    def _load(self, key):
+        if not self.filename:
+            return None
+        try:
+            rows = self._execute('SELECT hexdigest FROM hashes WHERE key = ?',
+                                 (':'.join(str(k) for k in key),))
+        except sqlite3.Error as err:
+            fmlogger.debug('Cannot read hash cache %s: %s', self.filename, err)
+            return None
+        if rows:
+            return rows[0][0]
+        return None
+
+    def _store(self, key, hexdigest):
+        if not self.filename:
+            return
+        try:
+            self._execute('INSERT OR REPLACE INTO hashes VALUES (?, ?)',
+                          (':'.join(str(k) for k in key), hexdigest))
+        except sqlite3.Error as err:
+            fmlogger.debug('Cannot update hash cache %s: %s', self.filename,
+                           err)
+
+
+_hash_cache = None
+
+
+def get_hash_cache():
+    """Return the process-wide content hash cache, or None if it is disabled
+    by the ``hash_cache_size`` option"""
+    global _hash_cache
+    maxsize = int(config.get('execution', 'hash_cache_size'))
+    filename = config.get('execution', 'hash_cache_file') or None
+    if maxsize <= 0:
+        return None
+    if _hash_cache is None or _hash_cache.filename != filename:
+        _hash_cache = FileHashCache(maxsize=maxsize, filename=filename)
+    _hash_cache.maxsize = maxsize
+    return _hash_cache
+
+
+def get_hash_algorithm(name=None):
+    """Return the constructor of the digest used to hash file contents
+
+    Parameters
+    ----------
+    name : str
+        any algorithm provided by :mod:`hashlib` (e.g. ``md5``, ``sha1``,
+        ``blake2b``) or ``xxhash``; by default, the ``hash_algorithm`` option
+        of the ``execution`` section of the config
+    """
+    if name is None:
+        name = config.get('execution', 'hash_algorithm')
+    name = name.lower()
+    if name in ('xxhash', 'xxh64'):
+        if xxhash_not_loaded:
+            raise ImportError('Please install xxhash to use the %s hash '
+                              'algorithm.' % name)
+        return xxhash.xxh64
+    if name not in hashlib.algorithms_available:
+        raise ValueError('Unknown hash algorithm: %s' % name)
+    if hasattr(hashlib, name):
+        return getattr(hashlib, name)
+    return partial(hashlib.new, name)
+
+
+def _digest_name(crypto_obj, crypto):
+    return getattr(crypto_obj, 'name', None) or getattr(crypto, '__name__',
+                                                        repr(crypto))
+
+
+def _hash_file(afile, chunk_len, crypto_obj):
+    buf = bytearray(chunk_len)
+    view = memoryview(buf)
+    with open(afile, 'rb', buffering=0) as fp:
+        while True:
+            nbytes = fp.readinto(buf)
+            if not nbytes:
+                break
+            crypto_obj.update(view[:nbytes])
+    return crypto_obj.hexdigest()
+
+
+def hash_infile(afile, chunk_len=HASH_CHUNK_LEN, crypto=None):
+    """ Computes hash of a file using 'crypto' module
+
+    By default, files are hashed with the algorithm selected by the
+    ``hash_algorithm`` config option. Hashes are memoized in the cache
+    returned by :func:`get_hash_cache`.
+    """
     hex = None
     if os.path.isfile(afile):
+        if crypto is None:
+            crypto = get_hash_algorithm()
         crypto_obj = crypto()
-        with open(afile, 'rb') as fp:
-            while True:
-                data = fp.read(chunk_len)
-                if not data:
-                    break
-                crypto_obj.update(data)
-        hex = crypto_obj.hexdigest()
+        cache = get_hash_cache()
+        if cache is None:
+            return _hash_file(afile, chunk_len, crypto_obj)
+        hex = cache.get(afile, _digest_name(crypto_obj, crypto),
+                        lambda: _hash_file(afile, chunk_len, crypto_obj))
     return hex
 
 
+def hash_infiles(filenames, chunk_len=HASH_CHUNK_LEN, crypto=None,
+                 nthreads=None):
+    """ Computes the hashes of several files concurrently
+
+    Parameters
+    ----------
+    filenames : list of str
+        files to hash
+    nthreads : int
+        number of threads reading and hashing files; by default, the
+        ``hash_threads`` option of the ``execution`` section of the config
+
+    Returns
+    -------
+    hashes : dict
+        the hash of each file, as returned by :func:`hash_infile`
+    """
+    if crypto is None:
+        crypto = get_hash_algorithm()
+    if nthreads is None:
+        nthreads = int(config.get('execution', 'hash_threads'))
+    filenames = list(OrderedDict.fromkeys(filenames))
+    hashes = {}
+    cache = get_hash_cache()
+    if cache is not None:
+        crypto_name = _digest_name(crypto(), crypto)
+        for afile in filenames:
+            if os.path.isfile(afile):
+                hexdigest = cache.lookup(afile, crypto_name)
+                if hexdigest is not None:
+                    hashes[afile] = hexdigest
+    # only the files missing from the cache are read
+    misses = [afile for afile in filenames if afile not in hashes]
+    nthreads = min(nthreads, len(misses))
+    hashfn = partial(hash_infile, chunk_len=chunk_len, crypto=crypto)
+    if nthreads <= 1:
+        hashes.update(zip(misses, map(hashfn, misses)))
+    else:
+        hashes.update(zip(misses, _get_hash_pool(nthreads).map(hashfn,
+                                                               misses)))
+    return hashes
+
+
+_hash_pool = None
+_hash_pool_pid = None
+_hash_pool_lock = threading.Lock()
+
+
+def _get_hash_pool(nthreads):
+    """Return the thread pool hashing files in the current process, with at
+    least ``nthreads`` threads"""
+    global _hash_pool, _hash_pool_pid
+    with _hash_pool_lock:
+        # the threads of a parent process do not survive a fork
+        if (_hash_pool is None or _hash_pool_pid != os.getpid() or
+                _hash_pool._processes < nthreads):
+            if _hash_pool is not None and _hash_pool_pid == os.getpid():
+                _hash_pool.close()
+            _hash_pool = ThreadPool(nthreads)
+            _hash_pool_pid = os.getpid()
+        return _hash_pool
+
+
 def hash_timestamp(afile):
     """ Computes md5 hash of the timestamp of a file """
     md5hex = None
@@ -568,19 +841,61 @@ def loadcrash(infile, *args):
         raise ValueError('Only pickled crashfiles are supported')
 
 
-def loadpkl(infile):
-    """Load a zipped or plain cPickled file
-    """
-    fmlogger.debug('Loading pkl: %s', infile)
-    if infile.endswith('pklz'):
-        pkl_file = gzip.open(infile, 'rb')
-    else:
-        pkl_file = open(infile, 'rb')
+# First record of the files written by savepkl with ``split_attr``, followed
+# by the name of the attribute pickled ahead of the rest of the record
+_SPLIT_MARKER = 'nipype-split-record-1'
 
+
+def _open_pkl(infile):
+    """Open a pickle file, detecting gzip compression from its content"""
+    with open(infile, 'rb') as fp:
+        magic = fp.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(infile, 'rb')
+    return open(infile, 'rb')
+
+
+def _load_pickle(pkl_file):
+    pos = pkl_file.tell()
     try:
-        unpkl = pickle.load(pkl_file)
+        return pickle.load(pkl_file)
     except UnicodeDecodeError:
-        unpkl = pickle.load(pkl_file, fix_imports=True, encoding='utf-8')
+        pkl_file.seek(pos)
+        return pickle.load(pkl_file, fix_imports=True, encoding='utf-8')
+
+
+def _is_split_header(record):
+    return (type(record) is tuple and len(record) == 2 and
+            isinstance(record[0], str) and record[0] == _SPLIT_MARKER)
+
+
+def loadpkl(infile, attr=None):
+    """Load a zipped or plain cPickled file
+
+    Compression is detected from the content of the file, so uncompressed
+    records saved under a ``.pklz`` name load as well.
+
+    Parameters
+    ----------
+    infile : str
+        file written by :func:`savepkl`
+    attr : str
+        return this attribute of the record instead of the record. If the
+        file was saved with ``split_attr=attr``, the rest of the record is
+        not deserialized.
+    """
+    fmlogger.debug('Loading pkl: %s', infile)
+    with _open_pkl(infile) as pkl_file:
+        unpkl = _load_pickle(pkl_file)
+        if _is_split_header(unpkl):
+            split_attr = unpkl[1]
+            value = _load_pickle(pkl_file)
+            if attr == split_attr:
+                return value
+            unpkl = _load_pickle(pkl_file)
+            setattr(unpkl, split_attr, value)
+    if attr is not None:
+        return getattr(unpkl, attr)
     return unpkl
 
 
@@ -596,13 +911,44 @@ def crash2txt(filename, record):
         fp.write(''.join(record['traceback']))
 
 
-def savepkl(filename, record):
-    if filename.endswith('pklz'):
+def savepkl(filename, record, compress=None, protocol=None,
+            split_attr=None):
+    """Pickle a record to a file
+
+    Parameters
+    ----------
+    filename : str
+        file to write
+    record : object
+        object to pickle
+    compress : bool
+        gzip the file (default: whether ``filename`` ends with ``pklz``)
+    protocol : int
+        pickle protocol (default: the default protocol of :mod:`pickle`)
+    split_attr : str
+        pickle this attribute of ``record`` ahead of the rest of the record,
+        so that ``loadpkl(filename, attr=split_attr)`` only deserializes it
+    """
+    if compress is None:
+        compress = filename.endswith('pklz')
+    if protocol is None:
+        protocol = getattr(pickle, 'DEFAULT_PROTOCOL', 0)
+    if compress:
         pkl_file = gzip.open(filename, 'wb')
     else:
         pkl_file = open(filename, 'wb')
-    pickle.dump(record, pkl_file)
-    pkl_file.close()
+    with pkl_file:
+        if split_attr is None:
+            pickle.dump(record, pkl_file, protocol)
+            return
+        value = getattr(record, split_attr)
+        pickle.dump((_SPLIT_MARKER, split_attr), pkl_file, protocol)
+        pickle.dump(value, pkl_file, protocol)
+        setattr(record, split_attr, None)
+        try:
+            pickle.dump(record, pkl_file, protocol)
+        finally:
+            setattr(record, split_attr, value)
 
 rst_levels = ['=', '-', '~', '+']
 
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Lazy attributes of packages
+
+Packages re-exporting the classes of many submodules make importing any of
+their modules pay for importing all of them. With :func:`lazy_attributes`,
+the submodule defining an attribute is only imported the first time the
+attribute is accessed, e.g.::
+
+    lazy_attributes(__name__, {'Node': ('.pipeline', 'Node'),
+                               'pipeline': ('.pipeline', None)})
+
+makes ``nipype.Node`` import ``nipype.pipeline`` when first used, and
+``nipype.pipeline`` available without an explicit import. Packages
+re-exporting whole lists of names, like the interface packages, use
+:func:`lazy_imports` instead::
+
+    lazy_imports(__name__, {'.preprocess': ('BET', 'FLIRT'),
+                            '.utils': ('Merge', 'Split')})
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import sys
+import types
+from importlib import import_module
+
+
+class LazyModule(types.ModuleType):
+    """Module importing its lazy attributes on first access"""
+
+    def __getattr__(self, name):
+        lazy = self.__dict__.get('_lazy_attributes', {})
+        if name not in lazy:
+            raise AttributeError('module %r has no attribute %r' %
+                                 (self.__name__, name))
+        value = _load(self.__name__, *lazy[name])
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) |
+                      set(self.__dict__.get('_lazy_attributes', {})))
+
+
+def _load(package, module, attribute):
+    module = import_module(module, package)
+    if attribute is None:
+        return module
+    return getattr(module, attribute)
+
+
+def lazy_attributes(package, attributes):
+    """Make attributes of a package import their module on first access
+
+    Parameters
+    ----------
+    package : string
+        name of the package, usually ``__name__``
+    attributes : dict
+        maps the names of the attributes to ``(module, attribute)``, where
+        module is relative to the package and attribute is None for the
+        module itself
+
+    On python versions that cannot change the class of a module (before
+    3.5), the attributes are imported right away.
+    """
+    module = sys.modules[package]
+    if sys.version_info < (3, 5):
+        for name, (source, attribute) in attributes.items():
+            setattr(module, name, _load(package, source, attribute))
+        return
+    lazy = module.__dict__.setdefault('_lazy_attributes', {})
+    lazy.update(attributes)
+    # star imports only see the attributes listed in __all__
+    if '__all__' not in module.__dict__:
+        module.__all__ = [name for name in module.__dict__
+                          if not name.startswith('_')]
+    module.__all__ += sorted(set(attributes) - set(module.__all__))
+    if not isinstance(module, LazyModule):
+        module.__class__ = LazyModule
+
+
+def lazy_imports(package, imports):
+    """Lazy equivalent of ``from .module import name1, name2`` statements
+
+    Parameters
+    ----------
+    package : string
+        name of the package, usually ``__name__``
+    imports : dict
+        maps modules, relative to the package, to the names they export.
+        The modules themselves are lazy attributes of the package too.
+    """
+    attributes = {}
+    for module, names in imports.items():
+        attributes[module.lstrip('.')] = (module, None)
+        for name in names:
+            attributes[name] = (module, name)
+    lazy_attributes(package, attributes)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Live metrics of running workflows
+
+With ``metrics`` enabled in the ``monitoring`` section of the configuration,
+the distributed plugins keep counters and gauges of the state of the nodes
+and of the scheduler (see :data:`METRICS`). They are served in the
+Prometheus text exposition format on ``http://127.0.0.1:<metrics_port>/metrics``
+while the workflow runs, and/or written as a JSON snapshot to
+``metrics_file`` after every iteration of the scheduler (at most once per
+second), which suits the batch plugins whose master runs on a login node.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+from builtins import object, open
+
+from future import standard_library
+standard_library.install_aliases()
+
+import os
+import os.path as op
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import time
+
+import simplejson as json
+
+from .. import logging
+from .misc import str2bool
+
+logger = logging.getLogger('workflow')
+
+# name: (type, help)
+METRICS = OrderedDict([
+    ('nipype_nodes_total', (
+        'gauge', 'Nodes of the execution graph, with the subnodes of '
+        'MapNodes')),
+    ('nipype_nodes_waiting', (
+        'gauge', 'Nodes waiting for their dependencies')),
+    ('nipype_nodes_ready', (
+        'gauge', 'Nodes ready to be submitted (depth of the ready queue)')),
+    ('nipype_nodes_running', (
+        'gauge', 'Nodes submitted and not finished')),
+    ('nipype_nodes_done', (
+        'gauge', 'Nodes finished, failed or skipped')),
+    ('nipype_nodes_submitted_total', (
+        'counter', 'Nodes submitted to the workers')),
+    ('nipype_nodes_finished_total', (
+        'counter', 'Nodes finished, including those whose results were up '
+        'to date')),
+    ('nipype_nodes_cached_total', (
+        'counter', 'Nodes whose results were up to date')),
+    ('nipype_nodes_failed_total', (
+        'counter', 'Nodes that crashed, or could not run because of a '
+        'crash')),
+    ('nipype_submission_latency_seconds', (
+        'summary', 'Time from a node being ready to its submission')),
+    ('nipype_hash_check_seconds', (
+        'summary', 'Time checking the hash of a node on the master')),
+    ('nipype_result_load_seconds', (
+        'summary', 'Time collecting the result of a node')),
+    ('nipype_scheduler_iterations_total', (
+        'counter', 'Iterations of the scheduler')),
+    ('nipype_scheduler_last_iteration_timestamp_seconds', (
+        'gauge', 'Time of the last iteration of the scheduler')),
+    ('nipype_free_memory_gb', (
+        'gauge', 'Memory not reserved by running nodes (MultiProc)')),
+    ('nipype_free_processors', (
+        'gauge', 'Processors not reserved by running nodes (MultiProc)')),
+])
+
+
+class Metrics(object):
+    """Counters, gauges and summaries of a running workflow
+
+    Examples
+    --------
+
+    >>> from nipype.utils.metrics import Metrics
+    >>> metrics = Metrics()
+    >>> metrics.inc('nipype_nodes_finished_total')
+    >>> metrics.observe('nipype_hash_check_seconds', 0.5)
+    >>> print(metrics.render().split('\\n')[2])
+    nipype_nodes_finished_total 1
+    >>> (metrics.snapshot()['metrics']['nipype_hash_check_seconds'] ==
+    ...  {'count': 1, 'sum': 0.5})
+    True
+
+    """
+
+    enabled = True
+
+    def __init__(self, filename=None, min_interval=1.):
+        self.filename = filename
+        self.min_interval = min_interval
+        self._values = {}
+        self._lock = threading.Lock()
+        self._last_write = 0.
+        self._server = None
+
+    def inc(self, name, value=1):
+        """Increment a counter"""
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def set(self, name, value):
+        """Set a gauge"""
+        with self._lock:
+            self._values[name] = value
+
+    def observe(self, name, value):
+        """Add an observation to a summary"""
+        with self._lock:
+            count, total = self._values.get(name, (0, 0.))
+            self._values[name] = (count + 1, total + value)
+
+    @contextmanager
+    def timer(self, name):
+        """Observe the time spent in a block"""
+        start = time()
+        try:
+            yield
+        finally:
+            self.observe(name, time() - start)
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        with self._lock:
+            values = dict(self._values)
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            if name not in values:
+                continue
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            if kind == 'summary':
+                count, total = values[name]
+                lines.append('%s_count %d' % (name, count))
+                lines.append('%s_sum %s' % (name, _number(total)))
+            else:
+                lines.append('%s %s' % (name, _number(values[name])))
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Return the metrics as a dictionary"""
+        with self._lock:
+            values = dict(self._values)
+        metrics = OrderedDict()
+        for name, (kind, _) in METRICS.items():
+            if name not in values:
+                continue
+            if kind == 'summary':
+                metrics[name] = {'count': values[name][0],
+                                 'sum': values[name][1]}
+            else:
+                metrics[name] = values[name]
+        return {'timestamp': time(), 'metrics': metrics}
+
+    def write(self, force=False):
+        """Write the JSON snapshot, at most every ``min_interval`` seconds
+        unless forced"""
+        if self.filename is None:
+            return
+        if not force and time() - self._last_write < self.min_interval:
+            return
+        self._last_write = time()
+        tmpfile = '%s.%d.tmp' % (self.filename, os.getpid())
+        try:
+            with open(tmpfile, 'wt') as fp:
+                fp.write(json.dumps(self.snapshot()))
+            # readers never see a partial snapshot
+            os.rename(tmpfile, self.filename)
+        except (IOError, OSError) as err:
+            logger.warning('Cannot write metrics to %s: %s', self.filename,
+                           err)
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve the metrics over HTTP, and return the port"""
+        server = _servers.get((host, port))
+        if server is None:
+            server = MetricsServer(port, host=host)
+            _servers[(host, server.port)] = server
+        server.metrics = self
+        self._server = server
+        logger.info('Serving metrics on http://%s:%d/metrics', host,
+                    server.port)
+        return server.port
+
+    def close(self):
+        """Write the last snapshot and stop serving the metrics"""
+        self.write(force=True)
+        server, self._server = self._server, None
+        if server is not None and server.metrics is self:
+            _servers.pop(server.address, None)
+            server.close()
+
+
+def _number(value):
+    """Format a value of a metric"""
+    value = float(value)
+    if value.is_integer():
+        return '%d' % value
+    return repr(value)
+
+
+class _NullMetrics(object):
+    """Metrics that are not recorded"""
+
+    enabled = False
+
+    def inc(self, name, value=1):
+        pass
+
+    def set(self, name, value):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    def timer(self, name):
+        return _NULL_TIMER
+
+    def write(self, force=False):
+        pass
+
+    def close(self):
+        pass
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+NULL_METRICS = _NullMetrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics_server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('Metrics request: ' + format, *args)
+
+
+class MetricsServer(object):
+    """HTTP server of the metrics, in a daemon thread
+
+    A server left running by a workflow that crashed is reused by the next
+    workflow on the same port.
+    """
+
+    def __init__(self, port, host='127.0.0.1'):
+        self.metrics = NULL_METRICS
+        self._server = HTTPServer((host, port), _MetricsHandler)
+        self._server.metrics_server = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+_servers = {}
+
+
+def start_metrics(config):
+    """Return the metrics of a workflow run from its configuration
+    dictionary, serving them if enabled"""
+    monitoring = config.get('monitoring', {})
+    if not str2bool(monitoring.get('metrics', False)):
+        return NULL_METRICS
+    filename = monitoring.get('metrics_file') or None
+    port = monitoring.get('metrics_port')
+    if filename is None and not port:
+        logger.warning('Metrics are enabled but neither metrics_port nor '
+                       'metrics_file is set')
+    metrics = Metrics(filename=filename and op.abspath(filename))
+    if port:
+        try:
+            metrics.serve(int(port))
+        except (IOError, OSError) as err:
+            logger.warning('Cannot serve metrics on port %s: %s', port, err)
+    return metrics
@@ -224,6 +224,22 @@ def str2bool(v):
         raise ValueError("%s cannot be converted to bool" % v)
 
 
+def interface_name(interface):
+    """Return the full name of the class of an interface, given the
+    interface or its class
+
+    >>> from nipype.interfaces.utility import IdentityInterface
+    >>> print(interface_name(IdentityInterface))
+    nipype.interfaces.utility.base.IdentityInterface
+    >>> interface_name(IdentityInterface(fields=['a'])) == interface_name(
+    ...     IdentityInterface)
+    True
+
+    """
+    cls = interface if isinstance(interface, type) else interface.__class__
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
 def flatten(S):
     if S == []:
         return S
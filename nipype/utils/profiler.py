@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Profiling of the Python code run by interfaces
+
+With ``profile`` set in the ``monitoring`` section of the configuration,
+either to ``true`` or to a list of interface classes or modules,
+:meth:`~nipype.interfaces.base.BaseInterface.run` records the Python
+functions called by the interfaces into their working directory, with
+cProfile (``_profile_<interface>.prof``, in the pstats format) or with a
+sampling profiler of lower overhead (``_profile_<interface>.stacks``, in the
+folded stacks format of flamegraph.pl and speedscope).
+
+The profiles of all the nodes of a workflow are merged per interface class
+by :func:`profile_report` and ``nipypecli profile``.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+from builtins import object, open
+
+import os
+import os.path as op
+import sys
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from io import StringIO
+
+from .. import logging
+from .misc import str2bool, interface_name
+
+logger = logging.getLogger('interface')
+
+PROFILERS = ('cprofile', 'sampling')
+PROFILE_PREFIX = '_profile_'
+PROFILE_EXTENSIONS = {'cprofile': '.prof', 'sampling': '.stacks'}
+
+_state = threading.local()
+
+
+def get_profiler(interface, config):
+    """Return the profiler an interface is run under (one of
+    :data:`PROFILERS`), from a configuration dictionary, or False
+
+    Examples
+    --------
+
+    >>> from nipype.interfaces.utility import IdentityInterface
+    >>> from nipype.utils.profiler import get_profiler
+    >>> interface = IdentityInterface(fields=['a'])
+    >>> get_profiler(interface, {'monitoring': {'profile': 'false'}})
+    False
+    >>> get_profiler(interface, {'monitoring': {
+    ...     'profile': 'Function, IdentityInterface',
+    ...     'profiler': 'sampling'}}) # doctest: +ALLOW_UNICODE
+    'sampling'
+    >>> get_profiler(interface, {'monitoring': {
+    ...     'profile': 'nipype.interfaces.utility'}}) # doctest: +ALLOW_UNICODE
+    'cprofile'
+
+    """
+    monitoring = config.get('monitoring', {})
+    profile = monitoring.get('profile', False)
+    if isinstance(profile, (list, tuple)):
+        patterns = profile
+    else:
+        try:
+            if not str2bool(profile or False):
+                return False
+            patterns = None
+        except ValueError:
+            patterns = profile.split(',')
+    if patterns is not None:
+        name = interface_name(interface)
+        patterns = [pattern.strip() for pattern in patterns]
+        if not any(pattern in (name, name.rsplit('.', 1)[1]) or
+                   name.startswith(pattern + '.')
+                   for pattern in patterns if pattern):
+            return False
+    profiler = (monitoring.get('profiler') or 'cprofile').lower()
+    if profiler not in PROFILERS:
+        logger.warning('Unknown profiler %s, using cprofile (possible '
+                       'values: %s)', profiler, ', '.join(PROFILERS))
+        profiler = 'cprofile'
+    return profiler
+
+
+class SamplingProfiler(object):
+    """Profiler recording the stack of the thread that started it every
+    ``interval`` seconds, from a thread of its own
+
+    Unlike cProfile, its overhead does not depend on the number of function
+    calls.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = Counter()
+        self._ident = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        self._ident = threading.current_thread().ident
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._ident)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                code = frame.f_code
+                labels.append('%s (%s:%d)' % (code.co_name, code.co_filename,
+                                              code.co_firstlineno))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(labels))] += 1
+
+    def dump_stats(self, filename):
+        write_stacks(filename, self.stacks)
+
+
+def write_stacks(filename, stacks):
+    """Write sampled stacks in the folded stacks format"""
+    with open(filename, 'wt') as fp:
+        for stack, count in stacks.most_common():
+            fp.write('%s %d\n' % (stack, count))
+
+
+def read_stacks(filename):
+    """Read sampled stacks in the folded stacks format"""
+    stacks = Counter()
+    with open(filename, 'rt') as fp:
+        for line in fp:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            try:
+                stacks[stack] += int(count)
+            except ValueError:
+                continue
+    return stacks
+
+
+@contextmanager
+def profiled(interface, profiler, directory=None, interval=0.01):
+    """Profile the block with ``profiler`` ('cprofile' or 'sampling'), and
+    write the profile of the interface to ``directory`` (default: the
+    current directory)
+
+    Yields the name of the profile file, or None if another interface is
+    already profiled by this thread (the outer profile includes it).
+    """
+    if getattr(_state, 'active', False):
+        yield None
+        return
+    if profiler == 'sampling':
+        prof = SamplingProfiler(interval)
+    else:
+        import cProfile
+        prof = cProfile.Profile()
+    filename = op.join(directory or os.getcwd(), '%s%s%s' % (
+        PROFILE_PREFIX, interface_name(interface),
+        PROFILE_EXTENSIONS[profiler]))
+    _state.active = True
+    prof.enable()
+    try:
+        yield filename
+    finally:
+        prof.disable()
+        _state.active = False
+        try:
+            prof.dump_stats(filename)
+        except (IOError, OSError) as err:
+            logger.warning('Cannot write profile %s: %s', filename, err)
+
+
+def find_profiles(base_dir):
+    """Return the profile files found under a directory, as a dictionary
+    of interface class name to profiler to list of files"""
+    profiles = defaultdict(lambda: defaultdict(list))
+    extensions = dict((ext, profiler)
+                      for profiler, ext in PROFILE_EXTENSIONS.items())
+    for dirpath, _, filenames in os.walk(base_dir):
+        for filename in filenames:
+            name, ext = op.splitext(filename)
+            if not name.startswith(PROFILE_PREFIX) or ext not in extensions:
+                continue
+            profiles[name[len(PROFILE_PREFIX):]][extensions[ext]].append(
+                op.join(dirpath, filename))
+    return profiles
+
+
+def merge_profiles(files, profiler):
+    """Merge the profile files of a profiler, into a :class:`pstats.Stats`
+    for cProfile or a :class:`collections.Counter` of stacks for the
+    sampling profiler"""
+    import pstats
+
+    merged = None if profiler == 'cprofile' else Counter()
+    for filename in files:
+        try:
+            if profiler == 'sampling':
+                merged.update(read_stacks(filename))
+            elif merged is None:
+                merged = pstats.Stats(filename, stream=StringIO())
+            else:
+                merged.add(filename)
+        except (IOError, OSError, EOFError, ValueError, TypeError) as err:
+            logger.warning('Cannot read profile %s: %s', filename, err)
+    return merged
+
+
+def _stacks_report(stacks, limit):
+    """Return the functions of sampled stacks with the most samples"""
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    samples = sum(stacks.values()) or 1
+    lines = ['%7s %7s  %s' % ('own %', 'total %', 'function')]
+    for frame, count in total.most_common(limit):
+        lines.append('%7.1f %7.1f  %s' % (100. * own[frame] / samples,
+                                          100. * count / samples, frame))
+    return lines
+
+
+def profile_report(base_dir, interface=None, sort='cumulative', limit=20,
+                   output_dir=None):
+    """Return a report of the profiles of the nodes under a directory,
+    merged per interface class
+
+    Parameters
+    ----------
+    base_dir : str
+        the working directory of a workflow
+    interface : str
+        only report the interface classes with this name, full or not
+    sort : str
+        the key the functions of cProfile profiles are sorted by
+    limit : int
+        the number of functions reported per interface class
+    output_dir : str
+        a directory the merged profiles are written to, to be read by other
+        tools (snakeviz, flamegraph.pl...)
+    """
+    profiles = find_profiles(base_dir)
+    if output_dir is not None and not op.exists(output_dir):
+        os.makedirs(output_dir)
+    lines = []
+    for name in sorted(profiles):
+        if interface and interface not in (name, name.rsplit('.', 1)[1]):
+            continue
+        for profiler, files in sorted(profiles[name].items()):
+            merged = merge_profiles(files, profiler)
+            if not merged:
+                continue
+            lines.append('%s: %d node(s), %s' % (name, len(files), profiler))
+            lines.append('=' * len(lines[-1]))
+            if profiler == 'sampling':
+                lines.extend(_stacks_report(merged, limit))
+            else:
+                stream = StringIO()
+                merged.stream = stream
+                merged.sort_stats(sort).print_stats(limit)
+                lines.append(stream.getvalue().strip('\n'))
+            lines.append('')
+            if output_dir is not None:
+                filename = op.join(output_dir, name +
+                                   PROFILE_EXTENSIONS[profiler])
+                if profiler == 'sampling':
+                    write_stacks(filename, merged)
+                else:
+                    merged.dump_stats(filename)
+    return '\n'.join(lines)
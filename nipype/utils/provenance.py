@@ -19,6 +19,7 @@ import numpy as np
 import prov.model as pm
 
 from .. import get_info, logging, __version__
+from .asyncwriter import write as write_async
 from .filemanip import (md5, hashlib, hash_infile)
 
 iflogger = logging.getLogger('interface')
@@ -284,10 +285,17 @@ def prov_encode(graph, value, create_container=True):
     return entity
 
 
-def write_provenance(results, filename='provenance', format='all'):
+def write_provenance(results, filename='provenance', format='all',
+                     background=False):
     ps = ProvStore()
     ps.add_results(results)
-    return ps.write_provenance(filename=filename, format=format)
+    if not background:
+        return ps.write_provenance(filename=filename, format=format)
+    # the document is built right away, but serialized by the background
+    # writer, possibly after the current directory changed
+    write_async(True, ps.write_provenance, filename=os.path.abspath(filename),
+                format=format)
+    return ps.g
 
 
 class ProvStore(object):
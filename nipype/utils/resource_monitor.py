@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Sampling of the resources used by the processes running nodes
+
+A single :class:`ResourceSampler` thread per process samples the process
+trees of all the nodes it runs (with ``profile_runtime`` enabled), instead
+of every running interface polling its own process. On Linux a sample reads
+one ``/proc/<pid>/stat`` file per process of the tracked trees, without
+creating any psutil objects; elsewhere psutil is used.
+
+For every tracked process tree, the sampler records the peak memory (RSS
+in GB), the peak number of busy threads (estimated from the CPU time used
+between two samples), the CPU time and a time series of these values.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+from builtins import object, open
+
+import os
+import os.path as op
+import threading
+from glob import glob
+from time import time
+
+from .. import logging
+
+logger = logging.getLogger('interface')
+
+_GB = 1024. ** 3
+
+if op.exists('/proc/self/stat'):
+    _PAGE_GB = os.sysconf(str('SC_PAGE_SIZE')) / _GB
+    _CLOCK_TICKS = float(os.sysconf(str('SC_CLK_TCK')))
+else:
+    _PAGE_GB = _CLOCK_TICKS = None
+
+
+def _read_stat(pid):
+    """Return (ppid, cpu seconds, threads, rss in GB) of a process"""
+    with open('/proc/%d/stat' % pid, 'rb') as fp:
+        data = fp.read()
+    # the command name, in parentheses, may contain spaces
+    fields = data[data.rindex(b')') + 2:].split()
+    return (int(fields[1]), (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS,
+            int(fields[17]), int(fields[21]) * _PAGE_GB)
+
+
+def _read_peak_rss(pid):
+    """Return the peak RSS of a process over its lifetime, in GB"""
+    with open('/proc/%d/status' % pid, 'rb') as fp:
+        for line in fp:
+            if line.startswith(b'VmHWM:'):
+                return int(line.split()[1]) * 1024 / _GB
+    return 0.
+
+
+def _children(pid):
+    """Return the children of a process, or None if the kernel does not
+    list them"""
+    children = []
+    tasks = glob('/proc/%d/task/*/children' % pid)
+    if not tasks:
+        return None if op.exists('/proc/%d' % pid) else []
+    for task in tasks:
+        try:
+            with open(task, 'rb') as fp:
+                children.extend(int(child) for child in fp.read().split())
+        except (IOError, OSError):
+            pass
+    return children
+
+
+def _all_children():
+    """Map every process to its children, from the whole of /proc"""
+    children = {}
+    for stat in glob('/proc/[0-9]*/stat'):
+        pid = int(stat.split('/')[2])
+        try:
+            ppid = _read_stat(pid)[0]
+        except (IOError, OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(pid)
+    return children
+
+
+def _proc_tree_stats(pid, children_map=None):
+    """Return {pid: (cpu seconds, threads, rss in GB)} for a process and its
+    descendants, read from /proc"""
+    stats = {}
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            stats[current] = _read_stat(current)[1:]
+        except (IOError, OSError, ValueError, IndexError):
+            # the process exited
+            continue
+        if children_map is not None:
+            pending.extend(children_map.get(current, []))
+            continue
+        children = _children(current)
+        if children is None:
+            # the kernel does not list children, scan all the processes
+            return _proc_tree_stats(pid, _all_children())
+        pending.extend(children)
+    return stats
+
+
+def _psutil_tree_stats(pid):
+    """Return {pid: (cpu seconds, threads, rss in GB)} for a process and its
+    descendants, read with psutil"""
+    import psutil
+    stats = {}
+    try:
+        parent = psutil.Process(pid)
+        procs = [parent] + parent.children(recursive=True)
+    except psutil.Error:
+        return stats
+    for proc in procs:
+        try:
+            with proc.oneshot():
+                cpu = proc.cpu_times()
+                stats[proc.pid] = (cpu.user + cpu.system, proc.num_threads(),
+                                   proc.memory_info().rss / _GB)
+        except psutil.Error:
+            pass
+    return stats
+
+
+def tree_stats(pid):
+    """Return {pid: (cpu seconds, threads, rss in GB)} for the processes of
+    a process tree"""
+    if _PAGE_GB is not None:
+        return _proc_tree_stats(pid)
+    return _psutil_tree_stats(pid)
+
+
+def peak_rss(pid):
+    """Return the peak RSS of a process over its lifetime in GB, or None if
+    it is unknown"""
+    if _PAGE_GB is None:
+        return None
+    try:
+        return _read_peak_rss(pid)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def sampling_supported():
+    """Whether the resources of processes can be sampled on this system"""
+    if _PAGE_GB is not None:
+        return True
+    try:
+        import psutil
+    except ImportError:
+        return False
+    return True
+
+
+class ResourceRecord(object):
+    """Resources used by a process tree while it was tracked
+
+    Attributes
+    ----------
+    pid : int
+        root of the process tree
+    peak_memory_gb : float
+        largest RSS of the tree, in GB
+    peak_threads : int
+        largest number of busy threads of the tree, at least 1
+    cpu_seconds : float
+        CPU time used by the tree while tracked
+    samples : list
+        ``(seconds since tracking started, memory GB, CPU percent,
+        threads)`` tuples
+    """
+
+    def __init__(self, pid, pyfunc=False, max_samples=1000):
+        self.pid = pid
+        self.pyfunc = pyfunc
+        self.start = time()
+        self.peak_memory_gb = 0.
+        self.peak_threads = 1
+        self.cpu_seconds = 0.
+        self.samples = []
+        self._max_samples = max_samples
+        self._stride = 1
+        self._count = 0
+        self._last_time = self.start
+        self._last_cpu = {}
+
+    def update(self, stats, root_peak_gb=None, now=None):
+        """Add a sample of the processes of the tree, with the peak memory of
+        its root process if known, which catches the peaks between samples
+        of single process trees"""
+        if now is None:
+            now = time()
+        if not stats:
+            return
+        if root_peak_gb:
+            self.peak_memory_gb = max(self.peak_memory_gb, root_peak_gb)
+        memory_gb = sum(rss for _, _, rss in stats.values())
+        if self.pyfunc and self.pid in stats:
+            # forked python children also count the memory of their parent
+            memory_gb = max(memory_gb - (len(stats) - 1) * stats[self.pid][2],
+                            stats[self.pid][2])
+        cpu_delta = 0.
+        if self._count:
+            # processes started since the last sample count in full
+            for pid, (cpu, _, _) in stats.items():
+                cpu_delta += max(cpu - self._last_cpu.get(pid, 0.), 0.)
+        self._last_cpu = dict((pid, stat[0]) for pid, stat in stats.items())
+        elapsed = now - self._last_time
+        self._last_time = now
+        cpu_percent = 100. * cpu_delta / elapsed if elapsed > 0 else 0.
+        total_threads = sum(threads for _, threads, _ in stats.values())
+        threads = min(total_threads, max(1, int(round(cpu_percent / 100.))))
+        self.cpu_seconds += cpu_delta
+        self.peak_memory_gb = max(self.peak_memory_gb, memory_gb)
+        self.peak_threads = max(self.peak_threads, threads)
+        self._count += 1
+        if self._count % self._stride == 0:
+            self.samples.append((round(now - self.start, 3), memory_gb,
+                                 round(cpu_percent, 1), threads))
+            if len(self.samples) > self._max_samples:
+                # halve the resolution of the series, keeping it bounded
+                self.samples = self.samples[1::2]
+                self._stride *= 2
+
+
+class ResourceSampler(object):
+    """Thread sampling the process trees of all the running nodes of a
+    process at a fixed interval
+
+    Examples
+    --------
+
+    >>> import os
+    >>> from nipype.utils.resource_monitor import ResourceSampler
+    >>> sampler = ResourceSampler(interval=0.01)
+    >>> record = sampler.track(os.getpid())
+    >>> record = sampler.release(record)
+    >>> record.peak_memory_gb > 0
+    True
+
+    """
+
+    def __init__(self, interval=0.5, max_samples=1000):
+        self.interval = interval
+        self.max_samples = max_samples
+        self._records = []
+        self._lock = threading.Condition()
+        self._thread = None
+
+    def track(self, pid, pyfunc=False):
+        """Start sampling a process tree, and return its record"""
+        record = ResourceRecord(pid, pyfunc=pyfunc,
+                                max_samples=self.max_samples)
+        record.update(*self._sample(pid), now=record.start)
+        with self._lock:
+            self._records.append(record)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._lock.notify()
+        return record
+
+    def release(self, record):
+        """Stop sampling a process tree, taking a last sample if it is still
+        running, and return its record"""
+        with self._lock:
+            if record in self._records:
+                self._records.remove(record)
+        record.update(*self._sample(record.pid))
+        return record
+
+    def _sample(self, pid):
+        """Return the stats of a process tree and the peak memory of its
+        root process"""
+        try:
+            return tree_stats(pid), peak_rss(pid)
+        except Exception as exc:
+            logger.debug('Cannot sample process %d: %s', pid, exc)
+            return {}, None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._records:
+                    self._lock.wait()
+                records = list(self._records)
+            for record in records:
+                sample = self._sample(record.pid)
+                with self._lock:
+                    if record in self._records:
+                        record.update(*sample)
+            with self._lock:
+                self._lock.wait(self.interval)
+
+
+_sampler = None
+_sampler_pid = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler(interval=0.5):
+    """Return the resource sampler of the current process"""
+    global _sampler, _sampler_pid
+    with _sampler_lock:
+        # the thread of a parent process does not survive a fork
+        if _sampler is None or _sampler_pid != os.getpid():
+            _sampler = ResourceSampler(interval=interval)
+            _sampler_pid = os.getpid()
+        _sampler.interval = interval
+    return _sampler
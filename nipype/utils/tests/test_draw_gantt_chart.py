@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the execution logs and the gantt charts
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+import datetime
+
+import pytest
+import simplejson as json
+
+from .. import draw_gantt_chart
+from ...interfaces.base import Bunch
+from ...pipeline.plugins import callback_log
+from ...pipeline.plugins.callback_log import ExecutionLog
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+# (node, start, finish) in seconds, with two nodes starting at the same time
+RUNS = [('a', 0, 10), ('b', 0, 4), ('c', 4, 6), ('a', 12, 13)]
+EPOCH = 1500000000.
+
+
+def fake_node(name, memory_gb):
+    runtime = Bunch(runtime_memory_gb=memory_gb, runtime_threads=2)
+    return Bunch(_id=name, name=name, result=Bunch(runtime=runtime),
+                 _interface=Bunch(estimated_memory_gb=1, num_threads=1))
+
+
+def events():
+    events = []
+    for name, start, finish in RUNS:
+        events.append((start, 'start', name))
+        events.append((finish, 'end', name))
+    return sorted(events)
+
+
+def write_execution_log(filename, monkeypatch):
+    log = ExecutionLog(filename)
+    for seconds, status, name in events():
+        monkeypatch.setattr(callback_log, 'time', lambda: EPOCH + seconds)
+        log(fake_node(name, 0.5), status)
+    log.close()
+
+
+def write_callback_log(filename):
+    with open(filename, 'w') as fp:
+        for seconds, status, name in events():
+            when = datetime.datetime.fromtimestamp(EPOCH + seconds)
+            record = {'id': name, 'name': name, 'estimated_memory_gb': 1,
+                      'num_threads': 1}
+            if status == 'start':
+                record['start'] = str(when)
+            else:
+                record.update(finish=str(when), runtime_memory_gb=0.5,
+                              runtime_threads=2)
+            fp.write(json.dumps(record) + '\n')
+
+
+@pytest.mark.parametrize('log_format', ['execution', 'callback'])
+def test_log_to_dict(tmpdir, monkeypatch, log_format):
+    filename = str(tmpdir.join('run.log'))
+    if log_format == 'execution':
+        write_execution_log(filename, monkeypatch)
+    else:
+        write_callback_log(filename)
+    nodes = draw_gantt_chart.log_to_dict(filename)
+    # the nodes are listed in the order they finished
+    assert [(node['name'], node['duration']) for node in nodes] == [
+        ('b', 4), ('c', 2), ('a', 10), ('a', 1)]
+    assert all(node['estimated_memory_gb'] == 1 and
+               node['runtime_memory_gb'] == 0.5 for node in nodes)
+
+
+def test_log_to_dict_unfinished(tmpdir, monkeypatch):
+    filename = str(tmpdir.join('run.log'))
+    log = ExecutionLog(filename)
+    for seconds, status, name in [(0, 'start', 'a'), (1, 'start', 'b'),
+                                  (3, 'end', 'a'), (4, 'error', 'c')]:
+        monkeypatch.setattr(callback_log, 'time', lambda: EPOCH + seconds)
+        log(fake_node(name, 0.5), status)
+    log.close()
+    nodes = draw_gantt_chart.log_to_dict(filename)
+    assert [(node['name'], node['duration']) for node in nodes] == [
+        ('a', 3), ('b', 2)]
+
+
+@pytest.mark.skipif(pandas is None, reason='pandas is not installed')
+def test_timelines(tmpdir, monkeypatch):
+    filename = str(tmpdir.join('run.log'))
+    write_execution_log(filename, monkeypatch)
+    nodes = draw_gantt_chart.log_to_dict(filename)
+    start = min(node['start'] for node in nodes)
+
+    timeline = draw_gantt_chart.calculate_timeline(nodes, 'estimated_threads')
+    offsets = [(when - start).total_seconds() for when in timeline.index]
+    # b finishes when c starts
+    assert dict(zip(offsets, timeline.values)) == {
+        0: 2, 6: 1, 10: 0, 12: 1, 13: 0}
+
+    # samples of the first run of a
+    nodes[2]['runtime_samples'] = [[0, 0.25, 100, 1], [2, 1.5, 100, 1]]
+    sampled = draw_gantt_chart.calculate_sampled_timeseries(
+        nodes, 'runtime_memory_gb', start)
+    offsets = [(when - start).total_seconds() for when in sampled.index]
+    assert dict(zip(offsets, sampled.values)) == {
+        0: 0.75, 2: 2.0, 6: 1.5, 10: 0, 12: 0.5, 13: 0}
+
+    draw_gantt_chart.generate_gantt_chart(filename, cores=2)
+    html = tmpdir.join('run.log.html').read()
+    assert html.count("class='node'") == 4
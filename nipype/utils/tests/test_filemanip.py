@@ -18,7 +18,9 @@ from ...utils.filemanip import (save_json, load_json,
                                 _cifs_table, on_cifs,
                                 copyfile, copyfiles,
                                 filename_to_list, list_to_filename,
-                                check_depends,
+                                check_depends, hash_infile, hash_infiles,
+                                get_hash_algorithm, FileHashCache,
+                                loadpkl, savepkl,
                                 split_filename, get_related_files)
 
 import numpy as np
@@ -275,6 +277,96 @@ def test_list_to_filename(list, expected):
     assert x == expected
 
 
+def test_hash_infile_cache(tmpdir):
+    fname = tmpdir.join('data.txt')
+    fname.write('some data')
+    os.utime(fname.strpath, (1e9, 1e9))
+    cache = FileHashCache(maxsize=1, filename=tmpdir.join('cache.sqlite').strpath)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return hash_infile(fname.strpath)
+
+    first = cache.get(fname.strpath, 'md5', compute)
+    assert cache.get(fname.strpath, 'md5', compute) == first
+    assert len(calls) == 1
+    conn = cache._conn
+    # a different algorithm is a separate entry
+    cache.get(fname.strpath, 'sha1', compute)
+    assert len(calls) == 2
+    # evicted from memory, but read back from the sidecar file
+    assert cache.get(fname.strpath, 'md5', compute) == first
+    assert len(calls) == 2
+    # through the same connection
+    assert cache._conn is conn
+
+    # modifying the file invalidates the entry
+    fname.write('other data')
+    os.utime(fname.strpath, (1e9 + 1, 1e9 + 1))
+    assert cache.get(fname.strpath, 'md5', compute) != first
+    assert len(calls) == 3
+
+
+def test_hash_infile_recent_files_not_cached(tmpdir):
+    fname = tmpdir.join('data.txt')
+    fname.write('some data')
+    cache = FileHashCache()
+    assert cache.get(fname.strpath, 'md5', lambda: 'abc') == 'abc'
+    assert cache.get(fname.strpath, 'md5', lambda: 'def') == 'def'
+
+
+def test_hash_infile_default_md5(tmpdir):
+    # hashes of existing working directories must stay valid
+    fname = tmpdir.join('data.txt')
+    fname.write('some data')
+    assert hash_infile(fname.strpath) == '1e50210a0202497fb79bc38b6ade6c34'
+    assert hash_infile(fname.strpath, chunk_len=4) == hash_infile(fname.strpath)
+
+
+def test_hash_infiles(tmpdir):
+    filenames = []
+    for idx in range(5):
+        fname = tmpdir.join('data%d.txt' % idx)
+        fname.write('data %d' % idx)
+        filenames.append(fname.strpath)
+    expected = {fname: hash_infile(fname, crypto=get_hash_algorithm('sha1'))
+                for fname in filenames}
+    for nthreads in (1, 3):
+        assert hash_infiles(filenames + filenames[:2],
+                            crypto=get_hash_algorithm('sha1'),
+                            nthreads=nthreads) == expected
+
+
+def test_hash_infiles_cached(tmpdir, monkeypatch):
+    from ...utils import filemanip
+    filenames = []
+    for idx in range(3):
+        fname = tmpdir.join('data%d.txt' % idx)
+        fname.write('data %d' % idx)
+        os.utime(fname.strpath, (1e9, 1e9))
+        filenames.append(fname.strpath)
+    cache = FileHashCache()
+    monkeypatch.setattr(filemanip, 'get_hash_cache', lambda: cache)
+    expected = hash_infiles(filenames, nthreads=3)
+    pool = filemanip._hash_pool
+    assert filemanip._get_hash_pool(2) is pool
+
+    # cached hashes are not computed again, and no thread is used
+    def fail(*args, **kwargs):
+        raise AssertionError('hashed again')
+    monkeypatch.setattr(filemanip, '_hash_file', fail)
+    monkeypatch.setattr(filemanip, '_get_hash_pool', fail)
+    assert hash_infiles(filenames, nthreads=3) == expected
+
+
+def test_get_hash_algorithm():
+    import hashlib
+    assert get_hash_algorithm('MD5') is hashlib.md5
+    with pytest.raises(ValueError):
+        get_hash_algorithm('nohash')
+
+
 def test_check_depends():
     def touch(fname):
         with open(fname, 'a'):
@@ -320,6 +412,27 @@ def test_json():
     assert sorted(adict.items()) == sorted(new_dict.items())
 
 
+@pytest.mark.parametrize("kwargs", [
+        dict(),
+        dict(compress=False),
+        dict(compress=False, protocol=2),
+        dict(compress=False, split_attr='outputs'),
+        dict(compress=True, split_attr='outputs')
+        ])
+def test_pkl(tmpdir, kwargs):
+    from ...interfaces.base import Bunch
+    record = Bunch(outputs=Bunch(out=[1, 2]), runtime=Bunch(stdout='text'))
+    name = tmpdir.join('record.pklz').strpath
+    savepkl(name, record, **kwargs)
+    with open(name, 'rb') as fp:
+        assert (fp.read(2) == b'\x1f\x8b') == kwargs.get('compress', True)
+    assert record.outputs.out == [1, 2]
+    loaded = loadpkl(name)
+    assert loaded.outputs.out == [1, 2]
+    assert loaded.runtime.stdout == 'text'
+    assert loadpkl(name, attr='outputs').out == [1, 2]
+
+
 @pytest.mark.parametrize("file, length, expected_files", [
         ('/path/test.img',  3, ['/path/test.hdr', '/path/test.img', '/path/test.mat']),
         ('/path/test.hdr',  3, ['/path/test.hdr', '/path/test.img', '/path/test.mat']),
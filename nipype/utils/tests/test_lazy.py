@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+import nipype
+from nipype.utils.lazy import lazy_attributes
+
+
+def test_lazy_attributes(monkeypatch):
+    # a throwaway package, whose relative imports resolve in nipype.utils
+    package = types.ModuleType(str('nipype.utils.lazy_package'))
+    monkeypatch.setitem(sys.modules, package.__name__, package)
+    lazy_attributes(package.__name__, {
+        'lazy_misc': ('..misc', None),
+        'lazy_flatten': ('..misc', 'flatten')})
+    assert 'lazy_flatten' in dir(package)
+    from nipype.utils.misc import flatten
+    assert package.lazy_flatten is flatten
+    assert package.lazy_misc.flatten is flatten
+    with pytest.raises(AttributeError):
+        package.not_an_attribute
+
+
+# the only nipype modules imported by importing nipype and an interface
+# package, and slow third-party packages that must not be imported
+IMPORTED_NIPYPE = set([
+    'nipype', 'nipype.external', 'nipype.external.cloghandler',
+    'nipype.external.due', 'nipype.external.portalocker', 'nipype.info',
+    'nipype.interfaces', 'nipype.interfaces.fsl', 'nipype.pkg_info',
+    'nipype.refs', 'nipype.utils', 'nipype.utils.config', 'nipype.utils.lazy',
+    'nipype.utils.logger', 'nipype.utils.misc', 'nipype.utils.onetime',
+    'nipype.utils.tmpdirs'])
+NOT_IMPORTED = ['networkx', 'scipy', 'pandas', 'nibabel', 'traits', 'prov']
+
+
+def python_env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(nipype.__file__))
+    return env
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5),
+                    reason='attributes are imported right away')
+def test_lazy_nipype():
+    # neither the pipeline nor the interfaces are imported by importing
+    # nipype, nor all the interfaces of a package by importing the package
+    code = ('import sys, nipype, nipype.interfaces.fsl as fsl; '
+            'assert "nipype.pipeline.engine" not in sys.modules; '
+            'assert "nipype.interfaces.fsl.model" not in sys.modules; '
+            'assert nipype.Node.__module__ == "nipype.pipeline.engine.nodes"; '
+            'assert fsl.BET.__module__ == "nipype.interfaces.fsl.preprocess"')
+    subprocess.check_call([sys.executable, '-c', code], env=python_env())
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='needs -X importtime')
+def test_imported_modules():
+    imports = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c',
+         'import nipype.interfaces.fsl'],
+        env=python_env(), stderr=subprocess.STDOUT, universal_newlines=True)
+    # lines are "import time: self [us] | cumulative | package", with the
+    # packages imported by a package indented below it
+    packages = set()
+    for line in imports.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, package = line.split('|')
+            if cumulative.strip().isdigit():
+                packages.add(package.strip())
+    # the time taken depends on the machine, the modules imported do not
+    assert set(package for package in packages
+               if package.split('.')[0] == 'nipype') <= IMPORTED_NIPYPE
+    for package in NOT_IMPORTED:
+        assert package not in packages
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the live metrics of workflows
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+from future import standard_library
+standard_library.install_aliases()
+
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+import simplejson as json
+
+from ..metrics import Metrics, start_metrics, NULL_METRICS
+from ...pipeline import engine as pe
+from ...pipeline import plugins
+from ...interfaces.utility import Function
+
+
+def add_one(x):
+    return x + 1
+
+
+def test_metrics_render():
+    metrics = Metrics()
+    metrics.set('nipype_nodes_ready', 3)
+    metrics.inc('nipype_nodes_submitted_total')
+    metrics.inc('nipype_nodes_submitted_total')
+    with metrics.timer('nipype_result_load_seconds'):
+        pass
+    lines = metrics.render().splitlines()
+    assert '# TYPE nipype_nodes_ready gauge' in lines
+    assert 'nipype_nodes_ready 3' in lines
+    assert 'nipype_nodes_submitted_total 2' in lines
+    assert 'nipype_result_load_seconds_count 1' in lines
+    # metrics that were never set are not exported
+    assert not [line for line in lines if 'failed' in line]
+
+
+def test_metrics_server():
+    metrics = start_metrics({'monitoring': {'metrics': True,
+                                            'metrics_port': '0'}})
+    try:
+        metrics.inc('nipype_nodes_finished_total', 5)
+        url = 'http://127.0.0.1:%d' % metrics._server.port
+        response = urlopen(url + '/metrics')
+        assert response.headers['Content-Type'].startswith('text/plain')
+        body = response.read().decode('utf-8')
+        assert 'nipype_nodes_finished_total 5' in body.splitlines()
+        with pytest.raises(HTTPError):
+            urlopen(url + '/other')
+    finally:
+        metrics.close()
+    assert start_metrics({'monitoring': {'metrics': False}}) is NULL_METRICS
+
+
+@pytest.mark.parametrize('plugin', ['MultiProc', 'AsyncMultiProc'])
+def test_metrics_workflow(tmpdir, plugin):
+    metrics_file = str(tmpdir.join('metrics.json'))
+    wf = pe.Workflow(name='measured', base_dir=str(tmpdir))
+    wf.config['monitoring'] = {'metrics': True, 'metrics_file': metrics_file}
+    source = pe.MapNode(Function(input_names=['x'], output_names=['y'],
+                                 function=add_one),
+                        iterfield=['x'], name='source')
+    source.inputs.x = [1, 2, 3]
+    sink = pe.Node(Function(input_names=['x'], output_names=['y'],
+                            function=add_one), name='sink')
+    sink.inputs.x = 1
+    wf.add_nodes([source, sink])
+    wf.run(plugin=plugin, plugin_args={'n_procs': 2})
+
+    with open(metrics_file) as fp:
+        metrics = json.load(fp)['metrics']
+    # the mapnode, its 3 subnodes and the node, all run by the workers (the
+    # mapnode collates the results of its subnodes)
+    assert metrics['nipype_nodes_total'] == 5
+    assert metrics['nipype_nodes_done'] == 5
+    assert metrics['nipype_nodes_running'] == 0
+    assert metrics['nipype_nodes_waiting'] == 0
+    assert metrics['nipype_nodes_submitted_total'] == 5
+    assert metrics['nipype_nodes_finished_total'] == 5
+    assert metrics['nipype_submission_latency_seconds']['count'] == 5
+    assert metrics['nipype_result_load_seconds']['count'] == 5
+    assert metrics['nipype_hash_check_seconds']['count'] == 5
+    assert metrics['nipype_free_processors'] == 2
+
+    # nodes found up to date by a rerun are not left waiting for submission
+    runner = getattr(plugins, plugin + 'Plugin')(plugin_args={'n_procs': 2})
+    wf.run(plugin=runner)
+    assert runner._ready_times == {}
+    wf.config['monitoring'] = {'metrics': False}
+    wf.run(plugin=runner)
+    assert runner._ready_times == {}
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the Python profiling of interfaces
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+import os
+
+import pytest
+
+from .. import profiler
+from ...pipeline import engine as pe
+from ...interfaces.utility import Function, IdentityInterface
+
+
+def busy(x):
+    total = 0
+    for i in range(1000000):
+        total += i % 7
+    return x + 1
+
+
+def test_get_profiler():
+    interface = Function(input_names=['x'], output_names=['y'],
+                         function=busy)
+    config = {'monitoring': {'profile': 'nipype.algorithms, Function'}}
+    assert profiler.get_profiler(interface, config) == 'cprofile'
+    assert profiler.get_profiler(IdentityInterface(fields=['a']),
+                                 config) is False
+    assert profiler.get_profiler(interface, {}) is False
+    assert profiler.get_profiler(interface, {'monitoring': {
+        'profile': True, 'profiler': 'sampling'}}) == 'sampling'
+
+
+@pytest.mark.parametrize('kind', profiler.PROFILERS)
+def test_profiled_interface(tmpdir, kind):
+    os.chdir(str(tmpdir))
+    interface = Function(input_names=['x'], output_names=['y'],
+                         function=busy)
+    interface.profiler = kind
+    result = interface.run(x=1)
+    assert result.outputs.y == 2
+    assert result.runtime.profile == str(tmpdir.join(
+        '_profile_nipype.interfaces.utility.wrappers.Function' +
+        profiler.PROFILE_EXTENSIONS[kind]))
+    merged = profiler.merge_profiles([result.runtime.profile], kind)
+    if kind == 'sampling':
+        assert any('busy' in stack for stack in merged)
+    else:
+        assert any(func[2] == 'busy' for func in merged.stats)
+
+    # profiling can be disabled per interface
+    interface.profiler = False
+    os.remove(result.runtime.profile)
+    assert not hasattr(interface.run(x=1).runtime, 'profile')
+
+
+def test_profile_workflow(tmpdir):
+    wf = pe.Workflow(name='profiled', base_dir=str(tmpdir))
+    wf.config['monitoring'] = {'profile': 'Function'}
+    mapped = pe.MapNode(Function(input_names=['x'], output_names=['y'],
+                                 function=busy),
+                        iterfield=['x'], name='mapped')
+    mapped.inputs.x = [1, 2, 3]
+    single = pe.Node(Function(input_names=['x'], output_names=['y'],
+                              function=busy), name='single')
+    single.inputs.x = 1
+    # profiling can be disabled per node
+    single.config = {'monitoring': {'profile': False}}
+    identity = pe.Node(IdentityInterface(fields=['x']), name='identity')
+    wf.connect(mapped, 'y', identity, 'x')
+    wf.add_nodes([single])
+    wf.run()
+
+    profiles = profiler.find_profiles(str(tmpdir))
+    name = 'nipype.interfaces.utility.wrappers.Function'
+    assert list(profiles) == [name]
+    assert len(profiles[name]['cprofile']) == 3
+
+    output_dir = str(tmpdir.join('merged'))
+    report = profiler.profile_report(str(tmpdir), interface='Function',
+                                     limit=5, output_dir=output_dir)
+    assert report.startswith('%s: 3 node(s), cprofile' % name)
+    assert 'busy' in report
+    assert os.listdir(output_dir) == [name + '.prof']
+    assert profiler.profile_report(str(tmpdir), interface='Rename') == ''
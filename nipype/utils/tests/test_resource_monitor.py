@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the sampling of the resources used by nodes
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+import subprocess as sp
+import sys
+
+import pytest
+
+from ..resource_monitor import (ResourceRecord, ResourceSampler,
+                                sampling_supported)
+
+BUSY = ('import time\n'
+        'data = bytearray(200 * 1024 ** 2)\n'
+        'end = time.time() + 1\n'
+        'while time.time() < end:\n'
+        '    pass\n')
+
+
+def test_record_update():
+    record = ResourceRecord(1, max_samples=4)
+    record.update({1: (1., 1, 0.5)}, now=record.start)
+    # two processes, one of them busy for the whole second
+    record.update({1: (2., 1, 0.5), 2: (1., 4, 0.25)}, root_peak_gb=1.,
+                  now=record.start + 1)
+    assert record.cpu_seconds == pytest.approx(2.)
+    assert record.peak_threads == 2
+    assert record.peak_memory_gb == 1.
+    assert record.samples[-1] == (1., 0.75, 200., 2)
+    # the number of busy threads is bounded by the number of threads
+    record.update({1: (10., 1, 0.5)}, now=record.start + 2)
+    assert record.peak_threads == 2
+
+    for second in range(3, 10):
+        record.update({1: (10., 1, 0.5)}, now=record.start + second)
+    # the series is decimated to stay within its size
+    assert len(record.samples) <= 4
+    times = [sample[0] for sample in record.samples]
+    assert times == sorted(times) and times[-1] >= 7.
+
+
+def test_record_pyfunc():
+    record = ResourceRecord(1, pyfunc=True)
+    # forked children share the memory of their parent
+    record.update({1: (0., 1, 1.), 2: (0., 1, 1.5), 3: (0., 1, 1.2)})
+    assert record.peak_memory_gb == pytest.approx(1.7)
+
+
+@pytest.mark.skipif(not sampling_supported(),
+                    reason='resources cannot be sampled on this system')
+def test_sampler_subprocess():
+    sampler = ResourceSampler(interval=0.05, max_samples=8)
+    proc = sp.Popen([sys.executable, '-c', BUSY])
+    record = sampler.track(proc.pid)
+    proc.wait()
+    record = sampler.release(record)
+    assert record.peak_memory_gb > 0.15
+    assert record.cpu_seconds > 0.5
+    assert 1 < len(record.samples) <= 8
+    assert sampler._records == []
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the tracing of node execution
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+import os
+
+import pytest
+import simplejson as json
+
+from .. import tracing
+from ...pipeline import engine as pe
+from ...interfaces.utility import Function
+
+
+def add_one(x):
+    return x + 1
+
+
+def test_tracer_flush(tmpdir):
+    trace_file = str(tmpdir.join('trace.json'))
+    tracer = tracing.configure({'monitoring': {'trace': True,
+                                               'trace_file': trace_file}})
+    try:
+        assert tracing.get_tracer() is tracer
+        with tracing.span('phase', node='node'):
+            pass
+        tracer.flush()
+        assert tracer.events == []
+        with tracing.span('other'):
+            pass
+        tracing.merge_trace(trace_file)
+    finally:
+        tracing.configure({})
+    assert tracing.get_tracer() is None
+    # disabled spans are not recorded
+    with tracing.span('ignored'):
+        pass
+    with open(trace_file) as fp:
+        events = json.load(fp)['traceEvents']
+    assert [event['name'] for event in events] == [
+        'process_name', 'phase', 'other']
+    assert events[1]['args'] == {'node': 'node'}
+    assert not os.path.exists(tracing.trace_directory(trace_file))
+
+
+@pytest.mark.parametrize('plugin', ['Linear', 'MultiProc'])
+def test_trace_workflow(tmpdir, plugin):
+    wf = pe.Workflow(name='traced', base_dir=str(tmpdir))
+    wf.config['monitoring'] = {'trace': True}
+    source = pe.Node(Function(input_names=['x'], output_names=['y'],
+                              function=add_one), name='source')
+    source.inputs.x = 1
+    sink = pe.Node(Function(input_names=['x'], output_names=['y'],
+                            function=add_one), name='sink')
+    wf.connect(source, 'y', sink, 'x')
+    wf.run(plugin=plugin, plugin_args={'n_procs': 2})
+
+    with open(str(tmpdir.join('traced', 'trace.json'))) as fp:
+        events = json.load(fp)['traceEvents']
+    names = set(event['name'] for event in events)
+    assert set(['traced.source', 'traced.sink', 'hash', 'get_inputs',
+                'pickle', 'interface', 'report',
+                'save_results']) <= names
+    spans = [event for event in events if event['ph'] == 'X']
+    assert all(event['dur'] >= 0 for event in spans)
+    if plugin == 'MultiProc':
+        assert 'send_procs_to_workers' in names
+        # the nodes ran in the worker processes
+        pids = set(event['pid'] for event in spans
+                   if event['name'].startswith('traced.'))
+        assert os.getpid() not in pids
+    assert not tmpdir.join('traced', 'trace_parts').check()
+    assert tracing.get_tracer() is None
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tracing of the phases of node execution and of the scheduler
+
+With ``trace`` enabled in the ``monitoring`` section of the configuration,
+the phases of running nodes (loading their inputs, hashing, pickling,
+writing reports, running the interface, cleaning the working directory...)
+and the iterations of the scheduler of the distributed plugins are recorded
+as spans, in the Chrome trace event format displayed by chrome://tracing
+and Perfetto (https://ui.perfetto.dev).
+
+Every process buffers its spans and appends them, after each node, to its
+own file in a directory next to the trace file. The workflow merges these
+files into the trace file when it finishes.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+from builtins import object, open
+
+import os
+import os.path as op
+import socket
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from glob import glob
+from shutil import rmtree
+from time import time
+
+import simplejson as json
+
+from .. import logging
+from .misc import str2bool
+
+logger = logging.getLogger('workflow')
+
+# spans buffered by a process before they are written
+MAX_BUFFERED = 10000
+
+
+class Tracer(object):
+    """Spans of a process, appended to its file of the trace directory
+
+    Examples
+    --------
+
+    >>> import os
+    >>> from nipype.utils.tracing import Tracer
+    >>> tracer = Tracer(os.getcwd())
+    >>> with tracer.span('hash', node='wf.node'):
+    ...     pass
+    >>> [event['name'] for event in tracer.events] # doctest: +ALLOW_UNICODE
+    ['process_name', 'hash']
+
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.pid = os.getpid()
+        self.filename = op.join(directory, '%s-%d.json' % (
+            socket.gethostname(), self.pid))
+        self.events = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid,
+                        'args': {'name': '%s:%d' % (socket.gethostname(),
+                                                    self.pid)}}]
+
+    @contextmanager
+    def span(self, name, category='node', **args):
+        """Record the time spent in a block"""
+        start = time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time() - start, category, args)
+
+    def add(self, name, start, duration, category='node', args=None):
+        """Add a span, from its start time and duration in seconds"""
+        event = {'name': name, 'cat': category, 'ph': 'X',
+                 'ts': int(start * 1e6), 'dur': int(duration * 1e6),
+                 'pid': self.pid, 'tid': threading.current_thread().ident}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+        if len(self.events) >= MAX_BUFFERED:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered spans to the file of the process"""
+        events, self.events = self.events, []
+        if not events:
+            return
+        try:
+            if not op.exists(self.directory):
+                os.makedirs(self.directory)
+            with open(self.filename, 'at') as fp:
+                fp.write(''.join('%s\n' % json.dumps(event)
+                                 for event in events))
+        except (IOError, OSError) as err:
+            logger.warning('Cannot write trace %s: %s', self.filename, err)
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def trace_directory(trace_file):
+    """Return the directory of the per process files of a trace"""
+    return op.splitext(trace_file)[0] + '_parts'
+
+
+def configure(config):
+    """Start or stop tracing in the current process, from a configuration
+    dictionary, and return the tracer or None"""
+    global _tracer
+    monitoring = config.get('monitoring', {})
+    trace_file = monitoring.get('trace_file')
+    enabled = str2bool(monitoring.get('trace', False)) and trace_file
+    with _tracer_lock:
+        tracer = _tracer if _tracer is not None and \
+            _tracer.pid == os.getpid() else None
+        if not enabled:
+            if tracer is not None:
+                tracer.flush()
+            _tracer = None
+            return None
+        directory = trace_directory(op.abspath(trace_file))
+        if tracer is None or tracer.directory != directory:
+            if tracer is not None:
+                tracer.flush()
+            # the spans of a parent process are not inherited by a fork
+            _tracer = Tracer(directory)
+        return _tracer
+
+
+def get_tracer():
+    """Return the tracer of the current process, or None"""
+    tracer = _tracer
+    if tracer is None or tracer.pid != os.getpid():
+        return None
+    return tracer
+
+
+def span(name, category='node', **args):
+    """Return a context manager recording a span if tracing is enabled"""
+    tracer = get_tracer()
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, category, **args)
+
+
+def traced(name):
+    """Decorate a node method to record its calls as spans"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            tracer = get_tracer()
+            if tracer is None:
+                return func(self, *args, **kwargs)
+            with tracer.span(name, node=self._id):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def flush_trace():
+    """Write the buffered spans of the current process"""
+    tracer = get_tracer()
+    if tracer is not None:
+        tracer.flush()
+
+
+def reset_trace(trace_file):
+    """Remove the per process files left by a previous run of a trace"""
+    rmtree(trace_directory(op.abspath(trace_file)), ignore_errors=True)
+
+
+def merge_trace(trace_file):
+    """Merge the per process files of a trace into the trace file, in the
+    Chrome trace JSON object format, and return its path"""
+    flush_trace()
+    directory = trace_directory(op.abspath(trace_file))
+    events = []
+    for filename in sorted(glob(op.join(directory, '*.json'))):
+        with open(filename, 'rt') as fp:
+            for line in fp:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # the process was killed while writing
+                    continue
+    if not op.exists(op.dirname(op.abspath(trace_file))):
+        os.makedirs(op.dirname(op.abspath(trace_file)))
+    with open(trace_file, 'wt') as fp:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+    rmtree(directory, ignore_errors=True)
+    return trace_file
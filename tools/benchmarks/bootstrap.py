@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Benchmark of the start up cost of batch jobs
+
+Every node submitted by the batch plugins runs in a new interpreter, which
+imports nipype and unpickles the node before running it. Reports the time
+taken by a cold import of the modules involved, each in a new interpreter,
+and by running the pyscript of a node doing nothing.
+
+Usage::
+
+    python tools/benchmarks/bootstrap.py --repeat 5
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import argparse
+from copy import deepcopy
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import time
+
+from nipype import config, logging
+import nipype.pipeline.engine as pe
+from nipype.interfaces.utility import IdentityInterface
+from nipype.pipeline.plugins.base import create_pyscript
+
+# the directory containing this copy of nipype
+ROOT = os.path.abspath(__file__)
+for _ in range(5):
+    ROOT = os.path.dirname(ROOT)
+MODULES = ['nipype', 'nipype.utils.filemanip', 'nipype.pipeline.engine',
+           'nipype.pipeline.plugins', 'nipype.interfaces.utility']
+
+
+def python_env():
+    """Environment of the interpreters, importing this copy of nipype"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] +
+        [path for path in [env.get('PYTHONPATH')] if path])
+    return env
+
+
+def timed(args, repeat):
+    """Return the best wall time of running a python command"""
+    times = []
+    for _ in range(repeat):
+        start = time()
+        subprocess.check_call([sys.executable] + args, env=python_env())
+        times.append(time() - start)
+    return min(times)
+
+
+def imported(module):
+    """Return the number of modules loaded by importing a module"""
+    return int(subprocess.check_output([
+        sys.executable, '-c',
+        'import sys; import %s; print(len(sys.modules))' % module],
+        env=python_env()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    config.set('logging', 'workflow_level', 'WARNING')
+    logging.update_logging(config)
+    baseline = timed(['-c', 'pass'], args.repeat)
+    print('%-28s %10s %10s' % ('module', 'time (s)', 'modules'))
+    print('%-28s %10.3f %10s' % ('(interpreter)', baseline, '-'))
+    for module in MODULES:
+        print('%-28s %10.3f %10d' % (
+            module, timed(['-c', 'import %s' % module], args.repeat),
+            imported(module)))
+
+    base_dir = tempfile.mkdtemp()
+    try:
+        node = pe.Node(IdentityInterface(fields=['x']), name='noop',
+                       base_dir=base_dir)
+        node.inputs.x = 1
+        node.config = deepcopy(config._sections)
+        pyscript = create_pyscript(node)
+        print('%-28s %10.3f %10s' % ('(pyscript)',
+                                     timed([pyscript], args.repeat), '-'))
+    finally:
+        shutil.rmtree(base_dir)
+
+
+if __name__ == '__main__':
+    main()
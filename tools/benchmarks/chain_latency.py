@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Measure the latency between dependent short nodes
+
+Runs chains of trivial Function nodes with the MultiProc and AsyncMultiProc
+plugins and reports, for every edge of the chain, the time between the end
+of the upstream interface and the start of the downstream one. This covers
+result saving, scheduling, submission and node loading.
+
+Usage::
+
+    python tools/benchmarks/chain_latency.py --length 50 --width 8
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import argparse
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+import numpy as np
+from dateutil.parser import parse as parseutc
+
+from nipype import config, logging
+import nipype.pipeline.engine as pe
+from nipype.interfaces.utility import Function
+
+
+def add_one(value):
+    return value + 1
+
+
+def make_chains(length, width, base_dir):
+    wf = pe.Workflow(name='chain', base_dir=base_dir)
+    for chain in range(width):
+        prev = None
+        for idx in range(length):
+            node = pe.Node(Function(input_names=['value'],
+                                    output_names=['value'],
+                                    function=add_one),
+                           name='c%02d_add%03d' % (chain, idx))
+            if prev is None:
+                node.inputs.value = 0
+            else:
+                wf.connect(prev, 'value', node, 'value')
+            prev = node
+    return wf
+
+
+def hop_latencies(execgraph):
+    latencies = []
+    for prev, nxt in execgraph.edges():
+        latencies.append((parseutc(nxt.result.runtime.startTime) -
+                          parseutc(prev.result.runtime.endTime)
+                          ).total_seconds())
+    return latencies
+
+
+def run_chain(length, width, n_procs, plugin, poll):
+    base_dir = mkdtemp()
+    wf = make_chains(length, width, base_dir)
+    wf.config['execution'] = {'poll_sleep_duration': poll}
+    t0 = time()
+    execgraph = wf.run(plugin=plugin, plugin_args={'n_procs': n_procs})
+    elapsed = time() - t0
+    latencies = 1e3 * np.array(hop_latencies(execgraph))
+    rmtree(base_dir)
+    print('%-15s total %7.2f s  hop latency (ms): p50 %7.1f  p95 %7.1f  '
+          'max %7.1f' % (plugin, elapsed, np.percentile(latencies, 50),
+                         np.percentile(latencies, 95), latencies.max()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--length', type=int, default=50,
+                        help='number of nodes of each chain')
+    parser.add_argument('--width', type=int, default=1,
+                        help='number of independent chains')
+    parser.add_argument('--n-procs', type=int, default=2)
+    parser.add_argument('--poll', type=float, default=2,
+                        help='poll_sleep_duration used by MultiProc')
+    args = parser.parse_args()
+    config.set('logging', 'workflow_level', 'WARNING')
+    logging.update_logging(config)
+    os.chdir(mkdtemp())
+    for plugin in ('MultiProc', 'AsyncMultiProc'):
+        run_chain(args.length, args.width, args.n_procs, plugin, args.poll)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Benchmark of the MultiProc schedulers on synthetic workflows
+
+Runs the scheduling logic of the MultiProc plugin on a simulated clock: no
+process is started, a submitted node finishes once its runtime has elapsed.
+Reports the makespan of the ``resources`` and ``critical_path`` schedulers,
+with exact runtime estimates, together with the two lower bounds (longest
+chain, and total work divided by the number of processors).
+
+Usage::
+
+    python tools/benchmarks/critical_path.py --procs 8
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import argparse
+import random
+
+import networkx as nx
+
+from nipype import config, logging
+from nipype.pipeline.plugins.tests.test_multiproc import (
+    SimulatedNode, chains_graph, simulate)
+
+
+def layered_graph(seed, num_layers=8, width=20, max_runtime=20., p_edge=0.15):
+    """Random layered DAG with runtimes spread over two orders of
+    magnitude"""
+    rng = random.Random(seed)
+    graph = nx.DiGraph()
+    layers = []
+    for layer in range(num_layers):
+        nodes = [SimulatedNode('l%d_%02d' % (layer, idx),
+                               max_runtime ** rng.random())
+                 for idx in range(rng.randint(1, width))]
+        graph.add_nodes_from(nodes)
+        for node in nodes:
+            for prev in [n for lay in layers for n in lay]:
+                if rng.random() < p_edge / (len(layers) or 1):
+                    graph.add_edge(prev, node)
+        layers.append(nodes)
+    return graph
+
+
+def lower_bounds(graph, n_procs):
+    longest = {}
+    for node in nx.topological_sort(graph):
+        longest[node] = node.runtime + max(
+            [longest[pred] for pred in graph.predecessors(node)] or [0])
+    work = sum(node.runtime for node in graph.nodes())
+    return max(longest.values()), work / n_procs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--procs', type=int, nargs='+', default=[4, 8])
+    parser.add_argument('--seeds', type=int, default=5,
+                        help='number of random layered graphs')
+    args = parser.parse_args()
+
+    config.set('logging', 'workflow_level', 'WARNING')
+    logging.update_logging(config)
+    graphs = [('chains', chains_graph)]
+    graphs += [('layered%d' % seed, lambda seed=seed: layered_graph(seed))
+               for seed in range(args.seeds)]
+    print('%-10s %5s %10s %10s %10s %10s' % (
+        'graph', 'procs', 'resources', 'critical', 'path LB', 'work LB'))
+    for name, make_graph in graphs:
+        for n_procs in args.procs:
+            graph = make_graph()
+            resources, _ = simulate(graph, n_procs, 'resources')
+            critical, _ = simulate(graph, n_procs, 'critical_path')
+            path_lb, work_lb = lower_bounds(graph, n_procs)
+            print('%-10s %5d %10.1f %10.1f %10.1f %10.1f' % (
+                name, n_procs, resources, critical, path_lb, work_lb))
+
+
+if __name__ == '__main__':
+    main()
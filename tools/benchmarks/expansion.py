@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Benchmark the expansion of iterables into the execution graph
+
+Builds a typical study workflow: subjects x sessions x parameters iterables,
+two processing nodes and a join node collecting the results over the
+parameters, and times ``generate_expanded_graph`` on its flat graph.
+
+Usage::
+
+    python tools/benchmarks/expansion.py --subjects 10 50 100 --sessions 3 \\
+        --params 4
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import argparse
+from copy import deepcopy
+from time import time
+
+from nipype import config, logging
+import nipype.pipeline.engine as pe
+from nipype.pipeline.engine.utils import generate_expanded_graph
+from nipype.interfaces.utility import IdentityInterface, Function
+
+
+def process(subject, session):
+    return subject + session
+
+
+def combine(value, param):
+    return value * param
+
+
+def summarize(values):
+    return sum(values)
+
+
+def make_workflow(subjects, sessions, params):
+    wf = pe.Workflow(name='study')
+    subjsrc = pe.Node(IdentityInterface(fields=['subject']), name='subjects')
+    subjsrc.iterables = ('subject', list(range(subjects)))
+    sesssrc = pe.Node(IdentityInterface(fields=['session']), name='sessions')
+    sesssrc.iterables = ('session', list(range(sessions)))
+    paramsrc = pe.Node(IdentityInterface(fields=['param']), name='params')
+    paramsrc.iterables = ('param', list(range(params)))
+    proc = pe.Node(Function(input_names=['subject', 'session'],
+                            output_names=['value'], function=process),
+                   name='process')
+    comb = pe.Node(Function(input_names=['value', 'param'],
+                            output_names=['value'], function=combine),
+                   name='combine')
+    summ = pe.JoinNode(Function(input_names=['values'],
+                                output_names=['total'], function=summarize),
+                       joinsource='params', joinfield=['values'],
+                       name='summarize')
+    wf.connect([(subjsrc, proc, [('subject', 'subject')]),
+                (sesssrc, proc, [('session', 'session')]),
+                (proc, comb, [('value', 'value')]),
+                (paramsrc, comb, [('param', 'param')]),
+                (comb, summ, [('value', 'values')])])
+    return wf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--subjects', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--sessions', type=int, default=3)
+    parser.add_argument('--params', type=int, default=4)
+    args = parser.parse_args()
+
+    config.set('logging', 'workflow_level', 'WARNING')
+    logging.update_logging(config)
+    for subjects in args.subjects:
+        wf = make_workflow(subjects, args.sessions, args.params)
+        wf._create_flat_graph()
+        flatgraph = deepcopy(wf._graph)
+        t0 = time()
+        execgraph = generate_expanded_graph(flatgraph)
+        elapsed = time() - t0
+        print('%6d subjects: %7d nodes, %8.2f s, %6.2f ms per node' % (
+            subjects, execgraph.number_of_nodes(), elapsed,
+            1e3 * elapsed / execgraph.number_of_nodes()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Benchmark of the execution logs and gantt charts of large workflows
+
+Writes the log of a synthetic run of many short nodes, in the format of
+log_nodes_cb and of an ExecutionLog, then times reading each log, computing
+a resource timeline and rendering the gantt chart.
+
+Usage::
+
+    python tools/benchmarks/gantt.py --nodes 100000
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import argparse
+import datetime
+import os
+import random
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+import simplejson as json
+
+from nipype.interfaces.base import Bunch
+from nipype.pipeline.plugins import callback_log
+from nipype.pipeline.plugins.callback_log import ExecutionLog
+from nipype.utils import draw_gantt_chart
+
+
+def make_events(num_nodes, rate):
+    """Return sorted (time, status, index) events of nodes started at a
+    fixed rate, running up to 5 seconds"""
+    events = []
+    start = time()
+    for idx in range(num_nodes):
+        node_start = start + idx / rate
+        events.append((node_start, 'start', idx))
+        events.append((node_start + random.random() * 5, 'end', idx))
+    return sorted(events)
+
+
+def write_execution_log(filename, events):
+    log = ExecutionLog(filename)
+    clock = callback_log.time
+    try:
+        for when, status, idx in events:
+            callback_log.time = lambda: when
+            log(Bunch(_id='node%d' % idx, name='node%d' % idx,
+                      _interface=Bunch(estimated_memory_gb=1, num_threads=1),
+                      result=Bunch(runtime=Bunch(runtime_memory_gb=0.5,
+                                                 runtime_threads=1))),
+                status)
+    finally:
+        callback_log.time = clock
+        log.close()
+
+
+def write_callback_log(filename, events):
+    with open(filename, 'w') as fp:
+        for when, status, idx in events:
+            record = {'id': 'node%d' % idx, 'name': 'node%d' % idx,
+                      'estimated_memory_gb': 1, 'num_threads': 1}
+            when = str(datetime.datetime.fromtimestamp(when))
+            if status == 'start':
+                record['start'] = when
+            else:
+                record.update(finish=when, runtime_memory_gb=0.5,
+                              runtime_threads=1)
+            fp.write('%s\n' % json.dumps(record))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--nodes', type=int, default=100000)
+    parser.add_argument('--rate', type=float, default=100.,
+                        help='nodes started per second')
+    args = parser.parse_args()
+
+    random.seed(0)
+    events = make_events(args.nodes, args.rate)
+    base_dir = mkdtemp()
+    try:
+        print('%-10s %10s %10s %10s %10s' % ('log', 'size (MB)', 'read s',
+                                             'timeline s', 'chart s'))
+        for name, write in [('callback', write_callback_log),
+                            ('execution', write_execution_log)]:
+            filename = os.path.join(base_dir, '%s.log' % name)
+            write(filename, events)
+            t0 = time()
+            nodes = draw_gantt_chart.log_to_dict(filename)
+            t1 = time()
+            draw_gantt_chart.calculate_timeline(nodes, 'estimated_memory_gb')
+            t2 = time()
+            draw_gantt_chart.generate_gantt_chart(filename, cores=8)
+            t3 = time()
+            print('%-10s %10.1f %10.2f %10.2f %10.2f' % (
+                name, os.path.getsize(filename) / 1024. ** 2, t1 - t0,
+                t2 - t1, t3 - t2))
+    finally:
+        rmtree(base_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Measure the memory held by the execution graph of a large workflow
+
+Expands the synthetic study workflow of ``expansion.py`` and configures its
+nodes as ``Workflow.run`` does, reporting the memory allocated per node by
+each step (requires Python 3.4+ for ``tracemalloc``).
+
+Usage::
+
+    python tools/benchmarks/graph_memory.py --subjects 100 500
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import argparse
+from copy import deepcopy
+import os.path as op
+import sys
+import tracemalloc
+
+from nipype import config, logging
+from nipype.pipeline.engine.utils import generate_expanded_graph, merge_dict
+
+sys.path.insert(0, op.dirname(op.abspath(__file__)))
+from expansion import make_workflow  # noqa
+
+
+def measure(subjects, sessions, params, copy_config):
+    wf = make_workflow(subjects, sessions, params)
+    wf.base_dir = '/tmp'
+    flatgraph = wf._create_flat_graph()
+    wf.config = merge_dict(deepcopy(config._sections), wf.config)
+    tracemalloc.start()
+    execgraph = generate_expanded_graph(deepcopy(flatgraph))
+    expanded = tracemalloc.get_traced_memory()[0]
+    if copy_config:
+        # configuration of the nodes before the config was shared
+        for node in execgraph.nodes():
+            node.config = merge_dict(deepcopy(wf.config), node.config)
+            node.base_dir = wf.base_dir
+        wf._configure_exec_nodes(execgraph)
+    else:
+        wf._configure_new_exec_nodes(execgraph, execgraph.nodes(), 0,
+                                     deepcopy(wf.config), 'Linear', None)
+    configured = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return execgraph.number_of_nodes(), expanded, configured - expanded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--subjects', type=int, nargs='+', default=[100])
+    parser.add_argument('--sessions', type=int, default=3)
+    parser.add_argument('--params', type=int, default=4)
+    args = parser.parse_args()
+
+    config.set('logging', 'workflow_level', 'WARNING')
+    logging.update_logging(config)
+    for subjects in args.subjects:
+        for copy_config in (True, False):
+            nodes, expanded, configured = measure(
+                subjects, args.sessions, args.params, copy_config)
+            print('%6d nodes, %-11s config: expansion %5.2f KB/node, '
+                  'configuration %5.2f KB/node, total %7.1f MB' % (
+                      nodes, 'per-node' if copy_config else 'shared',
+                      expanded / nodes / 1024, configured / nodes / 1024,
+                      (expanded + configured) / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    main()
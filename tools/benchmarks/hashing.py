@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Benchmark of content hashing of input files
+
+Compares the original implementation (sequential reads of 8 KB chunks
+hashed with md5) against :func:`nipype.utils.filemanip.hash_infiles` with
+large buffers, several threads and the available digests. The content hash
+cache is disabled so every run reads the files.
+
+Usage::
+
+    python tools/benchmarks/hashing.py --files 8 --size 256
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import argparse
+import hashlib
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from nipype import config
+from nipype.utils.filemanip import hash_infiles, get_hash_algorithm
+
+
+def hash_infile_8k(afile):
+    """The implementation of hash_infile before buffers and digests became
+    configurable"""
+    md5obj = hashlib.md5()
+    with open(afile, 'rb') as fp:
+        while True:
+            data = fp.read(8192)
+            if not data:
+                break
+            md5obj.update(data)
+    return md5obj.hexdigest()
+
+
+def make_files(num_files, size_mb, base_dir):
+    filenames = []
+    for idx in range(num_files):
+        fname = os.path.join(base_dir, 'data%d.bin' % idx)
+        with open(fname, 'wb') as fp:
+            for _ in range(size_mb):
+                fp.write(os.urandom(1024 * 1024))
+        filenames.append(fname)
+    return filenames
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time()
+        func()
+        elapsed = time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=8,
+                        help='number of files hashed together')
+    parser.add_argument('--size', type=int, default=128,
+                        help='size of each file (MB)')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--algorithms', nargs='+',
+                        default=['md5', 'sha1', 'blake2b', 'xxhash'])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    config.set('execution', 'hash_cache_size', '0')
+    base_dir = mkdtemp()
+    try:
+        filenames = make_files(args.files, args.size, base_dir)
+        total_mb = args.files * args.size
+        elapsed = timed(lambda: [hash_infile_8k(f) for f in filenames],
+                        args.repeat)
+        print('%-10s %-8s %8.3f s %8.1f MB/s' % ('md5-8k', 1, elapsed,
+                                                  total_mb / elapsed))
+        for name in args.algorithms:
+            try:
+                crypto = get_hash_algorithm(name)
+            except (ImportError, ValueError) as err:
+                print('%-10s skipped (%s)' % (name, err))
+                continue
+            for nthreads in args.threads:
+                elapsed = timed(lambda: hash_infiles(filenames, crypto=crypto,
+                                                     nthreads=nthreads),
+                                args.repeat)
+                print('%-10s %-8d %8.3f s %8.1f MB/s' % (
+                    name, nthreads, elapsed, total_mb / elapsed))
+    finally:
+        rmtree(base_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Measure the per-task overhead of MultiProcPlugin node shipping
+
+Compares the default mode, where every node is deep-copied and pickled
+through the pool, against ``ship_nodes_by_file``, where workers receive the
+names of a node file and a shared config file.
+
+Usage::
+
+    python tools/benchmarks/multiproc_overhead.py --nodes 200 --n-procs 4
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import argparse
+import os
+import pickle
+from copy import deepcopy
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from nipype import config, logging
+import nipype.pipeline.engine as pe
+from nipype.interfaces.utility import Function
+from nipype.pipeline.plugins.multiproc import MultiProcPlugin
+
+
+def add_one(value):
+    return value + 1
+
+
+def make_workflow(num_nodes, base_dir):
+    wf = pe.Workflow(name='overhead', base_dir=base_dir)
+    for idx in range(num_nodes):
+        node = pe.Node(Function(input_names=['value'],
+                                output_names=['out'],
+                                function=add_one),
+                       name='add%d' % idx)
+        node.inputs.value = idx
+        wf.add_nodes([node])
+    return wf
+
+
+def submission_cost(num_nodes, ship_by_file):
+    """Master-side time and bytes sent through the pool per task"""
+    wf = make_workflow(num_nodes, mkdtemp())
+    wf.config = pe.utils.merge_dict(deepcopy(config._sections), wf.config)
+    nodes = wf._graph.nodes()
+    for node in nodes:
+        node.config = deepcopy(wf.config)
+    plugin = MultiProcPlugin(plugin_args={'n_procs': 1,
+                                          'ship_nodes_by_file': ship_by_file})
+    nbytes = 0
+    t0 = time()
+    for taskid, node in enumerate(nodes):
+        if ship_by_file:
+            plugin._taskid = taskid
+            task = plugin._ship_node(node) + (False, taskid)
+        else:
+            task = (deepcopy(node), False, taskid)
+        nbytes += len(pickle.dumps(task, 2))
+    elapsed = time() - t0
+    plugin._close()
+    return 1e3 * elapsed / num_nodes, nbytes / num_nodes
+
+
+def end_to_end(num_nodes, n_procs, ship_by_file):
+    base_dir = mkdtemp()
+    wf = make_workflow(num_nodes, base_dir)
+    wf.config['execution'] = {'poll_sleep_duration': 0.1}
+    t0 = time()
+    wf.run(plugin='MultiProc',
+           plugin_args={'n_procs': n_procs,
+                        'ship_nodes_by_file': ship_by_file})
+    elapsed = time() - t0
+    rmtree(base_dir)
+    return 1e3 * elapsed / num_nodes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--nodes', type=int, default=200)
+    parser.add_argument('--n-procs', type=int, default=4)
+    args = parser.parse_args()
+    config.set('logging', 'workflow_level', 'WARNING')
+    logging.update_logging(config)
+    os.chdir(mkdtemp())
+    for ship_by_file in (False, True):
+        mode = 'file' if ship_by_file else 'copy'
+        ms, nbytes = submission_cost(args.nodes, ship_by_file)
+        total = end_to_end(args.nodes, args.n_procs, ship_by_file)
+        print('%-5s submit: %6.2f ms/task %8d bytes/task   '
+              'end-to-end: %6.1f ms/task' % (mode, ms, nbytes, total))
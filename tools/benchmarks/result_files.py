@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Benchmark of the node result file formats
+
+Writes and reads a result shaped like that of a typical command line node
+(the full environment and a long stdout in the runtime, a few hundred file
+names in the outputs) in each [execution] result_format. Reading the
+outputs only is what downstream nodes do when they collect their inputs.
+
+Usage::
+
+    python tools/benchmarks/result_files.py --stdout 256 --files 300
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import argparse
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from nipype.interfaces.base import Bunch, InterfaceResult, CommandLine
+from nipype.pipeline.engine.nodes import RESULT_FORMATS
+from nipype.utils.filemanip import loadpkl, savepkl
+
+
+def make_result(stdout_kb, num_files):
+    runtime = Bunch(cwd='/scratch/work/wf/node', returncode=0,
+                    environ=dict(os.environ), hostname='node01',
+                    cmdline='command --in input.nii.gz --out output.nii.gz',
+                    stdout='processing volume 1234\n' * (stdout_kb * 43),
+                    stderr='', duration=12.5, merged='')
+    outputs = Bunch(out_files=['/scratch/work/wf/node/out_%04d.nii.gz' % idx
+                               for idx in range(num_files)],
+                    out_matrix='/scratch/work/wf/node/affine.mat',
+                    out_value=0.5)
+    return InterfaceResult(interface=CommandLine, runtime=runtime,
+                           inputs={'in_file': 'input.nii.gz', 'args': ''},
+                           outputs=outputs)
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time()
+        func()
+        elapsed = time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--stdout', type=int, default=256,
+                        help='size of the stdout of the result (KB)')
+    parser.add_argument('--files', type=int, default=300,
+                        help='number of output file names')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    result = make_result(args.stdout, args.files)
+    base_dir = mkdtemp()
+    try:
+        print('%-8s %10s %10s %10s %10s' % ('format', 'size (KB)', 'write ms',
+                                            'read ms', 'outputs ms'))
+        for name in sorted(RESULT_FORMATS):
+            filename = os.path.join(base_dir, 'result_%s.pklz' % name)
+            write = timed(lambda: savepkl(filename, result,
+                                          **RESULT_FORMATS[name]),
+                          args.repeat)
+            read = timed(lambda: loadpkl(filename), args.repeat)
+            outputs = timed(lambda: loadpkl(filename, attr='outputs'),
+                            args.repeat)
+            print('%-8s %10.1f %10.2f %10.2f %10.2f' % (
+                name, os.path.getsize(filename) / 1024, write * 1000,
+                read * 1000, outputs * 1000))
+    finally:
+        rmtree(base_dir)
+
+
+if __name__ == '__main__':
+    main()
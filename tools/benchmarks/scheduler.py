@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Benchmark the scheduling core of DistributedPluginBase
+
+Builds synthetic execution graphs made of independent chains (e.g. one
+chain per subject) joined by a final summary node, and runs them through a
+plugin whose jobs finish instantly. The measured time is therefore the
+bookkeeping overhead of the scheduler alone.
+
+Usage::
+
+    python tools/benchmarks/scheduler.py 10000 100000
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import argparse
+from time import time
+
+import networkx as nx
+
+from nipype import config, logging
+from nipype.pipeline.plugins.base import DistributedPluginBase
+
+CONFIG = {'execution': {'poll_sleep_duration': 0,
+                        'stop_on_first_crash': 'false',
+                        'remove_node_directories': 'false',
+                        'local_hash_check': 'false'}}
+
+
+class FakeNode(object):
+    """Minimal stand-in for a pipeline node"""
+
+    def __init__(self, name):
+        self._id = name
+        self.name = name
+        self._hierarchy = None
+        self.config = CONFIG
+        self.run_without_submitting = False
+        # the inputs of the jobs are never collected from upstream results
+        self._got_inputs = True
+
+    def output_dir(self):
+        return '/fake/%s' % self.name
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class InstantPlugin(DistributedPluginBase):
+    """Plugin whose jobs are finished as soon as they are submitted"""
+
+    def __init__(self, plugin_args=None):
+        super(InstantPlugin, self).__init__(plugin_args=plugin_args)
+        self._taskid = 0
+        self.ticks = 0
+
+    def _submit_job(self, node, updatehash=False):
+        self._taskid += 1
+        return self._taskid
+
+    def _get_result(self, taskid):
+        return dict(result=None, traceback=None)
+
+    def _clear_task(self, taskid):
+        pass
+
+    def _wait(self):
+        self.ticks += 1
+
+
+def make_graph(num_nodes, chain_length=10):
+    """Independent chains of ``chain_length`` nodes feeding a sink node"""
+    graph = nx.DiGraph()
+    sink = FakeNode('sink')
+    graph.add_node(sink)
+    for chain in range((num_nodes - 1) // chain_length):
+        prev = None
+        for step in range(chain_length):
+            node = FakeNode('n%d_%d' % (chain, step))
+            graph.add_node(node)
+            if prev is not None:
+                graph.add_edge(prev, node)
+            prev = node
+        graph.add_edge(prev, sink)
+    return graph
+
+
+def run_benchmark(num_nodes, max_jobs):
+    graph = make_graph(num_nodes)
+    plugin_args = None
+    if max_jobs:
+        plugin_args = {'max_jobs': max_jobs}
+    plugin = InstantPlugin(plugin_args=plugin_args)
+    t0 = time()
+    plugin.run(graph, CONFIG)
+    elapsed = time() - t0
+    print('%8d nodes  max_jobs=%-6s %6d ticks  %8.2f s  %8.1f us/node' %
+          (graph.number_of_nodes(), max_jobs or 'inf', plugin.ticks,
+           elapsed, 1e6 * elapsed / graph.number_of_nodes()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('sizes', nargs='*', type=int, default=[10000, 100000],
+                        help='number of nodes of the synthetic graphs')
+    parser.add_argument('--max-jobs', type=int, default=None,
+                        help='maximum number of concurrent jobs')
+    args = parser.parse_args()
+    config.set('logging', 'workflow_level', 'WARNING')
+    logging.update_logging(config)
+    for size in args.sizes:
+        run_benchmark(size, args.max_jobs)